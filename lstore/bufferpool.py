@@ -0,0 +1,215 @@
+from collections import OrderedDict
+from lstore.page import Page, VALUE
+from lstore.segment import Segment
+import os
+import threading
+
+BUFFERPOOL_SIZE = 1024
+
+
+class Frame:
+
+    def __init__(self, page):
+        self.page = page
+        self.pin_count = 0
+        self.dirty = False
+
+
+class BufferPool:
+
+    """
+    # Fixed-size cache of pages shared by every table of a database.
+    # Pages are identified by (table_name, kind, column, page_idx) where kind is 'base', 'tail' or 'merged'.
+    # A tail page is stored at the segment slot the table's TailPages map gives it, not at page_idx.
+    # Frames are kept in LRU order; unpinned frames are evicted (and written back if dirty)
+    # once the pool is over capacity. Without a path dirty frames can't be written back,
+    # so nothing is evicted. With use_mmap clean pages are views over memory mapped segments.
+    """
+    def __init__(self, capacity=BUFFERPOOL_SIZE, use_mmap=False):
+        self.capacity = capacity
+        self.use_mmap = use_mmap
+        # log that must be flushed before a dirty page is written back
+        self.wal = None
+        self.path = None
+        self.frames = OrderedDict()
+        # open segment files: (table_name, kind, column) -> Segment
+        self.segments = {}
+        # table_name -> TailPages of the table, registered by Table
+        self.tail_pages = {}
+        self.lock = threading.RLock()
+
+    def segment_path(self, table_name, kind, col_idx):
+        return os.path.join(self.path, table_name, f'{kind}_col_{col_idx}.seg')
+
+    def get_segment(self, table_name, kind, col_idx):
+        with self.lock:
+            segment = self.segments.get((table_name, kind, col_idx))
+            if segment is None:
+                segment = Segment(self.segment_path(table_name, kind, col_idx), self.use_mmap)
+                self.segments[(table_name, kind, col_idx)] = segment
+            return segment
+
+    """
+    # Returns the requested page pinned in the pool, reading it from disk on a miss.
+    # Every fetch must be matched by an unpin_page call.
+    """
+    def fetch_page(self, page_id):
+        with self.lock:
+            frame = self.frames.get(page_id)
+            if frame is None:
+                return self._add_frame(page_id, self.read_page(page_id)).page
+            self.frames.move_to_end(page_id)
+            frame.pin_count += 1
+            return frame.page
+
+    """
+    # Creates an empty page for page_id, pinned and marked dirty.
+    # A page written again from scratch (merged copies, see Table.merge_page) keeps its frame:
+    # readers still holding the old page read it to the end, and their pins stay on the frame.
+    """
+    def new_page(self, page_id):
+        with self.lock:
+            frame = self.frames.get(page_id)
+            if frame is None:
+                return self._add_frame(page_id, Page(), dirty=True).page
+            self.frames.move_to_end(page_id)
+            frame.page = Page()
+            frame.pin_count += 1
+            frame.dirty = True
+            return frame.page
+
+    """
+    # Values at a list of (page_id, slot_idx) positions, in the same order, taking the pool lock
+    # once instead of a fetch_page and unpin_page per value. Pages missing are read from disk.
+    """
+    def read_slots(self, positions):
+        # bound once, this runs for every column of every point lookup
+        frames = self.frames
+        move_to_end = frames.move_to_end
+        unpack_from = VALUE.unpack_from
+        with self.lock:
+            values = []
+            for page_id, slot_idx in positions:
+                frame = frames.get(page_id)
+                if frame is None:
+                    frame = self._add_frame(page_id, self.read_page(page_id))
+                    frame.pin_count -= 1
+                else:
+                    move_to_end(page_id)
+                # Page.read inlined
+                values.append(unpack_from(frame.page.data, 8 * slot_idx)[0])
+            return values
+
+    """
+    # Writes each value of a list of (page_id, slot_idx, value) into its page and marks the page
+    # dirty, taking the pool lock once. Pages missing are read from disk, so create new ones first.
+    """
+    def write_slots(self, writes):
+        frames = self.frames
+        with self.lock:
+            for page_id, slot_idx, value in writes:
+                frame = frames.get(page_id)
+                if frame is None:
+                    frame = self._add_frame(page_id, self.read_page(page_id))
+                    frame.pin_count -= 1
+                else:
+                    frames.move_to_end(page_id)
+                frame.page.write_at(slot_idx, value)
+                frame.dirty = True
+
+    def discard_pages(self, page_ids):
+        """Drop the frames of pages that are no longer stored without writing them back, pinned ones stay until evicted"""
+        with self.lock:
+            for page_id in page_ids:
+                frame = self.frames.get(page_id)
+                if frame is not None and frame.pin_count == 0:
+                    del self.frames[page_id]
+
+    def unpin_page(self, page_id, dirty=False):
+        with self.lock:
+            frame = self.frames[page_id]
+            frame.pin_count -= 1
+            if dirty:
+                frame.dirty = True
+
+    def _add_frame(self, page_id, page, dirty=False):
+        # pinned before evicting, so the new frame is never the one evicted
+        frame = Frame(page)
+        frame.pin_count = 1
+        frame.dirty = dirty
+        self.frames[page_id] = frame
+        self.evict()
+        return frame
+
+    def evict(self):
+        """
+        # Evict least recently used unpinned frames until the pool fits its capacity, each found by
+        # walking from the LRU end only up to the first unpinned frame
+        """
+        while len(self.frames) > self.capacity:
+            if self.path is None:
+                return
+            page_id = next((page_id for page_id, frame in self.frames.items() if frame.pin_count == 0), None)
+            if page_id is None:
+                return
+            frame = self.frames[page_id]
+            if frame.dirty:
+                self.write_page(page_id, frame.page)
+            del self.frames[page_id]
+
+    def segment_slot(self, table_name, kind, page_idx):
+        """Slot of the segment a page is stored at, -1 for a tail page that isn't stored"""
+        if kind == 'tail':
+            tail_pages = self.tail_pages.get(table_name)
+            if tail_pages is not None:
+                return tail_pages.slot(page_idx)
+        return page_idx
+
+    def read_page(self, page_id):
+        if self.path is None:
+            return Page()
+        table_name, kind, col_idx, page_idx = page_id
+        page_idx = self.segment_slot(table_name, kind, page_idx)
+        if page_idx < 0 or not os.path.exists(self.segment_path(table_name, kind, col_idx)):
+            return Page()
+        return self.get_segment(table_name, kind, col_idx).read_page(page_idx)
+
+    def write_page(self, page_id, page):
+        if self.wal is not None:
+            self.wal.flush()
+        table_name, kind, col_idx, page_idx = page_id
+        page_idx = self.segment_slot(table_name, kind, page_idx)
+        # a reclaimed tail page whose slot went to another page
+        if page_idx < 0:
+            return
+        self.get_segment(table_name, kind, col_idx).write_page(page_idx, page)
+
+    def flush_all(self):
+        """Write back every dirty frame, in page order so each segment is written sequentially, and fsync them"""
+        with self.lock:
+            for page_id in sorted(self.frames.keys()):
+                frame = self.frames[page_id]
+                if frame.dirty:
+                    self.write_page(page_id, frame.page)
+                    frame.dirty = False
+            # pages evicted since the last call were only written, not fsynced
+            for segment in self.segments.values():
+                segment.sync()
+
+    def close(self):
+        """Close all open segment files"""
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+
+    def drop_table(self, table_name):
+        """Discard all frames of a table without writing them back"""
+        with self.lock:
+            for page_id in list(self.frames.keys()):
+                if page_id[0] == table_name:
+                    del self.frames[page_id]
+            self.tail_pages.pop(table_name, None)
+            for segment_id in list(self.segments.keys()):
+                if segment_id[0] == table_name:
+                    self.segments.pop(segment_id).close()
@@ -0,0 +1,72 @@
+from time import time_ns
+import threading
+
+# timestamp of records written by a running transaction, newer than any snapshot until its commit stamps them
+UNCOMMITTED = 2 ** 63 - 1
+
+
+class Clock:
+
+    """
+    # Timestamps written to the TIMESTAMP_COLUMN of records, strictly increasing and close to time_ns.
+    # A snapshot reads the newest version of every record written at or before its timestamp.
+    # Writes outside a transaction are stamped when made, between begin_write and end_write. A
+    # snapshot is taken no newer than the clock was when the oldest write still running began, so
+    # everything it can see is complete, although its readers don't wait for writers.
+    # A transaction's records are written as UNCOMMITTED and all get its commit timestamp at once,
+    # while no snapshot can be taken, so a snapshot sees all of a committed transaction or none of it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # records of earlier runs were written before now
+        self.last = time_ns()
+        # timestamps of open snapshots, one entry per snapshot
+        self.snapshots = []
+        # clock when each write outside a transaction still running began, see begin_write
+        self.writes = []
+
+    def tick(self):
+        with self.lock:
+            self.last = max(self.last + 1, time_ns())
+            return self.last
+
+    def commit(self, stamps):
+        """
+        # Give the records of a transaction its commit timestamp, stamps lists (table, kind, first id, count)
+        # as in Table.stamp. Called holding the latches of the tables.
+        """
+        with self.lock:
+            self.last = max(self.last + 1, time_ns())
+            for table, kind, first_id, count in stamps:
+                table.stamp(kind, first_id, count, self.last)
+            return self.last
+
+    def begin_write(self):
+        """Start of a write outside a transaction, every timestamp it ticks is newer than the one returned"""
+        with self.lock:
+            self.writes.append(self.last)
+            return self.last
+
+    def end_write(self, began):
+        """End of the write begin_write returned began for, its records are all reachable now"""
+        with self.lock:
+            self.writes.remove(began)
+
+    def begin_snapshot(self):
+        with self.lock:
+            timestamp = min(self.writes) if self.writes else self.last
+            self.snapshots.append(timestamp)
+            return timestamp
+
+    def end_snapshot(self, timestamp):
+        with self.lock:
+            self.snapshots.remove(timestamp)
+
+    def horizon(self):
+        """Timestamp no open or future snapshot is older than"""
+        with self.lock:
+            return min(self.snapshots + self.writes + [self.last])
+
+
+# shared by every table, so a snapshot is consistent across tables
+clock = Clock()
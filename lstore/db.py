@@ -1,22 +1,56 @@
 from lstore.table import Table
-from lstore.page import Page
+from lstore.bufferpool import BufferPool, BUFFERPOOL_SIZE
+from lstore.segment import convert_legacy_pages, replace_file, sync_directory
+from lstore.wal import WriteAheadLog, read_log, SYNC_COMMIT, SYNC_INTERVAL_SECONDS, OP_CREATE, OP_DROP, OP_INSERT, OP_UPDATE, OP_DELETE
+from lstore.query import Query
+from lstore.page_directory import PAGE_DIRECTORY_MAGIC, PAGE_DIRECTORY_VERSION
+from lstore.lock_manager import LockManager, NO_WAIT, LOCK_TIMEOUT
+from lstore.merge import MERGE_THRESHOLD
 import os
 import struct
 
+# minimum number of delta entries before a checkpoint rewrites the full page directory
+DELTA_COMPACTION_MIN = 1024
+
 class Database():
 
-    def __init__(self):
+    def __init__(self, bufferpool_size=BUFFERPOOL_SIZE, use_mmap=False, sync_policy=SYNC_COMMIT, sync_interval=SYNC_INTERVAL_SECONDS,
+                 lock_policy=NO_WAIT, lock_timeout=LOCK_TIMEOUT, merge_threshold=MERGE_THRESHOLD, version_retention=None):
         self.tables = []
+        # tables listed in metadata.db that haven't been accessed yet: name -> (num_columns, key_index)
+        self.unloaded_tables = {}
+        # set when tables are created or dropped, metadata.db is only rewritten then
+        self.metadata_dirty = False
         self.path = None
+        self.bufferpool = BufferPool(bufferpool_size, use_mmap)
+        self.wal = None
+        self.sync_policy = sync_policy
+        self.sync_interval = sync_interval
+        self.lock_manager = LockManager(lock_policy, lock_timeout)
+        # given to every table created or loaded, see Table
+        self.merge_threshold = merge_threshold
+        self.version_retention = version_retention
 
     def open(self, path):
-        """Load database from disk"""
+        """Read the table metadata from disk and replay the write-ahead log, tables are loaded when first accessed"""
         self.path = path
+        self.bufferpool.path = path
         
         if not os.path.exists(path):
             os.makedirs(path)
-            return
         
+        self.load_metadata(path)
+        self.recover(path)
+        
+        self.wal = WriteAheadLog(os.path.join(path, 'wal.log'), self.sync_policy, self.sync_interval)
+        # the log was just created, records fsynced to it must not vanish with its directory entry
+        sync_directory(path)
+        self.bufferpool.wal = self.wal
+        for table in self.tables:
+            table.wal = self.wal
+
+    def load_metadata(self, path):
+        """Read the name, column count and key of every table"""
         metadata_path = os.path.join(path, 'metadata.db')
         
         if not os.path.exists(metadata_path):
@@ -31,10 +65,42 @@ class Database():
                 num_columns = struct.unpack('i', f.read(4))[0]
                 key_index = struct.unpack('i', f.read(4))[0]
                 
-                table = Table(name, num_columns, key_index)
-                self.tables.append(table)
-                
-                self.load_table_data(path, table)
+                self.unloaded_tables[name] = (num_columns, key_index)
+
+    def recover(self, path):
+        """Redo the queries logged since the last checkpoint, then checkpoint them"""
+        wal_path = os.path.join(path, 'wal.log')
+        records = list(read_log(wal_path))
+        
+        for op, name, values in records:
+            if op == OP_CREATE:
+                self.create_table(name, values[0], values[1])
+            elif op == OP_DROP:
+                self.remove_table(name)
+            else:
+                query = Query(self.find_table(name))
+                if op == OP_INSERT:
+                    query.insert(*values)
+                elif op == OP_UPDATE:
+                    query.update(values[0], *values[1:])
+                elif op == OP_DELETE:
+                    query.delete(values[0])
+        
+        # the checkpoint is durable once it returns, only then can the log go
+        if records:
+            self.checkpoint()
+        if os.path.exists(wal_path):
+            os.remove(wal_path)
+            sync_directory(path)
+
+    def load_table(self, name):
+        """Build a table listed in metadata.db and load its page directory"""
+        num_columns, key_index = self.unloaded_tables.pop(name)
+        table = Table(name, num_columns, key_index, self.bufferpool, self.wal, self.lock_manager,
+                      self.merge_threshold, self.version_retention)
+        self.tables.append(table)
+        self.load_table_data(self.path, table)
+        return table
 
     def load_table_data(self, path, table):
         """Load all data for a specific table"""        
@@ -43,87 +109,195 @@ class Database():
         if not os.path.exists(table_path):
             return
         
-        for idx in range(table.num_columns):
-            base_dir = os.path.join(table_path, f'base_col_{idx}')
-            table.base_page[idx] = self.load_pages(base_dir)
-        
-        for idx in range(table.num_columns):
-            tail_dir = os.path.join(table_path, f'tail_col_{idx}')
-            table.tail_page[idx] = self.load_pages(tail_dir)
+        # pages are read on demand through the buffer pool, only count them here
+        for idx in range(table.total_columns):
+            table.num_base_pages[idx] = self.count_pages(table, 'base', idx)
         
+        for idx in range(table.total_columns):
+            table.num_tail_pages[idx] = self.count_pages(table, 'tail', idx)
+        self.load_tail_pages(table_path, table)
 
-        self.load_page_directory(table_path, table)
-        self.load_version_chains(table_path, table)
+        table.needs_full_checkpoint = False
+        version = self.load_page_directory(table_path, table)
+        # directories from before tail records come with version chains
+        if version < PAGE_DIRECTORY_VERSION and os.path.exists(os.path.join(table_path, 'version_chains.dat')):
+            self.convert_legacy_versions(table_path, table)
+        if table.version_retention is not None:
+            table.count_live_tail_records()
         
         table.index.drop_index(table.key)
-        table.index.create_index(table.key)
-
-    def get_page_number(self, filename):
-        underscore = filename.split('_')[1] 
-        dot = underscore.split('.')[0]
-        
-        return int(dot)
+        table.create_key_index()
 
-    def load_pages(self, directory):
-        """Load all pages from a directory"""
+    def count_pages(self, table, kind, col_idx):
+        """Number of pages in a column segment, converting the old page-per-file layout if needed"""
+        segment_path = self.bufferpool.segment_path(table.name, kind, col_idx)
+        legacy_dir = os.path.join(self.path, table.name, f'{kind}_col_{col_idx}')
         
-        if not os.path.exists(directory):
-            return [Page()]
+        if not os.path.exists(segment_path):
+            if not os.path.isdir(legacy_dir):
+                return 0
+            convert_legacy_pages(legacy_dir, segment_path)
         
-        all_files = os.listdir(directory)
-        dat_files = []
-        for f in all_files:
-            if f.endswith('.dat'):
-                dat_files.append(f)
+        return self.bufferpool.get_segment(table.name, kind, col_idx).page_count
     
-        page_files = sorted(dat_files, key=self.get_page_number)
-        
-        pages = []
-        for page_file in page_files:
-            page = Page()
-            with open(os.path.join(directory, page_file), 'rb') as f:
-                page.num_records = struct.unpack('i', f.read(4))[0]
-                page.data = bytearray(f.read(4096))
-            pages.append(page)
 
-        if pages:
-            return pages
+    def load_tail_pages(self, table_path, table):
+        """Load the segment slot of every tail page, tables saved without a map stored page n at slot n"""
+        map_path = os.path.join(table_path, 'tail_pages.dat')
+        if not os.path.exists(map_path):
+            table.tail_pages.reset(max(table.num_tail_pages))
         else:
-            return [Page()]
-    
+            with open(map_path, 'rb') as f:
+                table.tail_pages.load(f)
+        # every tail page is started in all columns, see Table.new_tail_page
+        table.num_tail_pages = [len(table.tail_pages)] * table.total_columns
 
     def load_page_directory(self, table_path, table):
-        """Load the page directory mapping RIDs to physical locations"""
+        """Load the page directory mapping RIDs to physical locations, returns the version of its layout"""
         pd_path = os.path.join(table_path, 'page_directory.dat')
+        delta_path = os.path.join(table_path, 'page_directory.delta')
+        
+        # a checkpoint stopped while replacing the directory, see save_page_directory
+        if os.path.exists(pd_path + '.new'):
+            if os.path.exists(delta_path):
+                os.remove(delta_path)
+            os.replace(pd_path + '.new', pd_path)
+            sync_directory(table_path)
         
         if not os.path.exists(pd_path):
-            return
+            return PAGE_DIRECTORY_VERSION
         
         with open(pd_path, 'rb') as f:
-            num_entries = struct.unpack('i', f.read(4))[0]
-            
-            for i in range(num_entries):
-                rid = struct.unpack('q', f.read(8))[0]
-                positions = []
-                
-                for col_idx in range(table.num_columns):
-                    page_idx = struct.unpack('i', f.read(4))[0]
-                    slot_idx = struct.unpack('i', f.read(4))[0]
-                    positions.append((page_idx, slot_idx))
-                
-                table.page_directory[rid] = positions
-            
-            if table.page_directory:
-                table.rid_counter = max(table.page_directory.keys())
+            if f.read(4) != PAGE_DIRECTORY_MAGIC:
+                # old layout: one entry per rid holding a location for every column
+                version = 0
+                f.seek(0)
+                num_entries = struct.unpack('i', f.read(4))[0]
+                for i in range(num_entries):
+                    rid = struct.unpack('q', f.read(8))[0]
+                    table.page_directory[rid] = self.read_locations(f, table.num_columns)[0]
+            else:
+                f.seek(0)
+                version = table.page_directory.load(f)
+        if version < PAGE_DIRECTORY_VERSION:
+            # rewrite it in the current layout at the next checkpoint
+            table.needs_full_checkpoint = True
+        
+        # deltas are written in the same layout as the directory they follow
+        num_locations = table.num_columns if version == 0 else 1
+        # locations, then indirection and schema encoding from version 2 on
+        location_size = 8 * num_locations + (16 if version >= 2 else 0)
+        if os.path.exists(delta_path):
+            with open(delta_path, 'rb') as f:
+                while True:
+                    entry = f.read(9)
+                    if len(entry) < 9:
+                        break
+                    rid, present = struct.unpack('q?', entry)
+                    if present:
+                        location = f.read(location_size)
+                        # an entry torn by a crash during a checkpoint, the log still holds its change
+                        if len(location) < location_size:
+                            break
+                        table.page_directory[rid] = struct.unpack_from('ii', location)
+                        if version >= 2:
+                            table.page_directory.set_latest(rid, *struct.unpack_from('qq', location, 8 * num_locations))
+                    else:
+                        table.page_directory.pop(rid, None)
+                    table.delta_entries += 1
 
-    def load_version_chains(self, table_path, table):
-        """Load version chains for all records"""
-        vc_path = os.path.join(table_path, 'version_chains.dat')
+        # rids are never reused, a record's rid also gives its position (see Table)
+        table.rid_counter = table.count_records('base')
+        table.tail_rid_counter = table.count_records('tail')
+        return version
+
+    def read_locations(self, f, count):
+        positions = []
+        for i in range(count):
+            page_idx = struct.unpack('i', f.read(4))[0]
+            slot_idx = struct.unpack('i', f.read(4))[0]
+            positions.append((page_idx, slot_idx))
+        return positions
+
+    def read_tail_locations(self, f, num_columns):
+        tail_locations = []
+        for col in range(num_columns):
+            has_location = struct.unpack('?', f.read(1))[0]
+            if has_location:
+                page_idx = struct.unpack('i', f.read(4))[0]
+                slot_idx = struct.unpack('i', f.read(4))[0]
+                tail_locations.append((page_idx, slot_idx))
+            else:
+                tail_locations.append(None)
+        return tail_locations
+
+    def convert_legacy_versions(self, table_path, table):
+        """
+        # Tables written before tail records kept the latest values in the base pages, the previous
+        # values of every update in the tail pages and per record lists of their locations in
+        # version_chains.dat. Rebuild such a table as its original base records plus one tail record
+        # per update, then checkpoint it and remove the version chains.
+        """
+        chains = self.read_legacy_version_chains(table_path, table)
         
-        if not os.path.exists(vc_path):
-            return
+        # read the old tail pages straight from their segments, they are replaced below
+        old_tail_values = {}
+        for col_idx in range(table.num_columns):
+            if os.path.exists(self.bufferpool.segment_path(table.name, 'tail', col_idx)):
+                segment = self.bufferpool.get_segment(table.name, 'tail', col_idx)
+                old_tail_values[col_idx] = [page.read_all() for page in segment.read_pages()]
+        
+        # every version of each updated record, oldest first
+        histories = {}
+        all_columns = list(range(table.num_columns))
+        for rid, chain in chains.items():
+            if rid not in table.page_directory or not chain:
+                continue
+            versions = [list(table.read_rows([rid], all_columns)[0])]
+            # chain[0] holds the values replaced by the latest update
+            for tail_locations in chain:
+                previous = list(versions[-1])
+                for col_idx, location in enumerate(tail_locations):
+                    if location is not None:
+                        page_idx, slot_idx = location
+                        previous[col_idx] = old_tail_values[col_idx][page_idx][slot_idx]
+                versions.append(previous)
+            versions.reverse()
+            histories[rid] = (versions, chain)
+        
+        for col_idx in old_tail_values:
+            self.bufferpool.get_segment(table.name, 'tail', col_idx).truncate(0)
+        table.num_tail_pages = [0] * table.total_columns
+        table.tail_pages.reset(0)
+        table.tail_rid_counter = 0
+        
+        # metadata of every base record, updated records get their tail records below
+        num_records = table.count_records('base')
+        rids = list(range(1, num_records + 1))
+        metadata = [[0] * num_records, rids, [0] * num_records, [0] * num_records]
+        for column, values in enumerate(metadata):
+            table.write_values('base', table.metadata_column(column), 1, values)
         
-        with open(vc_path, 'rb') as f:
+        for rid, (versions, chain) in histories.items():
+            page_idx, slot_idx = table.page_directory[rid]
+            for col_idx, value in enumerate(versions[0]):
+                if value != versions[-1][col_idx]:
+                    table.write_column(col_idx, page_idx, slot_idx, value)
+            for update_idx in range(1, len(versions)):
+                tail_locations = chain[len(chain) - update_idx]
+                columns = [versions[update_idx][col_idx] if location is not None else None
+                           for col_idx, location in enumerate(tail_locations)]
+                table.update_row(rid, columns)
+        
+        # the full checkpoint also removes the version chains
+        table.needs_full_checkpoint = True
+        self.bufferpool.flush_all()
+        self.save_table_data(self.path, table)
+
+    def read_legacy_version_chains(self, table_path, table):
+        """rid -> list of per column tail locations of the values each update replaced, newest first"""
+        chains = {}
+        with open(os.path.join(table_path, 'version_chains.dat'), 'rb') as f:
             num_rids = struct.unpack('i', f.read(4))[0]
             
             for i in range(num_rids):
@@ -133,22 +307,47 @@ class Database():
                 num_versions = struct.unpack('i', f.read(4))[0]
                 
                 for j in range(num_versions):
-                    tail_locations = []
-                    for col in range(table.num_columns):
-                        has_location = struct.unpack('?', f.read(1))[0]
-                        if has_location:
-                            page_idx = struct.unpack('i', f.read(4))[0]
-                            slot_idx = struct.unpack('i', f.read(4))[0]
-                            tail_locations.append((page_idx, slot_idx))
-                        else:
-                            tail_locations.append(None)
-
-                    versions.append(tail_locations)
+                    versions.append(self.read_tail_locations(f, table.num_columns))
                 
-                table.version_chain[rid] = versions
+                chains[rid] = versions
+        
+        delta_path = os.path.join(table_path, 'version_chains.delta')
+        if os.path.exists(delta_path):
+            with open(delta_path, 'rb') as f:
+                while True:
+                    entry = f.read(8)
+                    if len(entry) < 8:
+                        break
+                    rid = struct.unpack('q', entry)[0]
+                    if rid not in chains:
+                        chains[rid] = []
+                    chains[rid].insert(0, self.read_tail_locations(f, table.num_columns))
+        return chains
 
     def close(self):
-        """Write all data to disk"""
+        """Write all data to disk, closing a database that isn't open does nothing"""
+        if self.path is None:
+            return
+        
+        for table in self.tables:
+            table.stop_merging()
+        self.checkpoint()
+        self.wal.close()
+        self.wal = None
+        self.bufferpool.wal = None
+        self.bufferpool.close()
+        self.path = None
+
+    def checkpoint(self):
+        """
+        # Write everything changed since the last checkpoint: dirty pages, metadata if tables were
+        # created or dropped, and appended page directory deltas.
+        # Can be called at any time without closing the database, queries wait until it's written.
+        # It waits for running transactions to end and holds off new ones: their changes may still be
+        # rolled back and their log records only reach the log on commit, so writing them would make
+        # them permanent if the process crashed before the transaction ended. Transactions that only
+        # read so far (snapshot ones, optimistic ones before commit) aren't waited for.
+        """
         if self.path is None:
             return
         
@@ -157,84 +356,148 @@ class Database():
         if not os.path.exists(path):
             os.makedirs(path)
         
-        metadata_path = os.path.join(path, 'metadata.db')
-        with open(metadata_path, 'wb') as f:
-            f.write(struct.pack('i', len(self.tables)))
+        # before taking any latch, running transactions need them to end
+        if self.wal is not None:
+            self.wal.hold_transactions()
+        try:
+            # a merge swapping in pages between flush_all and saving the directory would leave it
+            # pointing at pages that were never written
+            tables = sorted(self.tables, key=lambda table: table.name)
+            for table in tables:
+                table.merge_lock.acquire()
+            # queries change a table holding its latch and transactions log their changes on commit:
+            # with both held off, the pages, directories and log all stop at the same point
+            for table in tables:
+                table.latch.acquire()
+            if self.wal is not None:
+                self.wal.appends.acquire()
+            try:
+                self.bufferpool.flush_all()
+                for table in tables:
+                    self.save_table_data(path, table)
+                    # segment files created since the last checkpoint
+                    sync_directory(os.path.join(path, table.name))
+                
+                if self.metadata_dirty or not os.path.exists(os.path.join(path, 'metadata.db')):
+                    self.save_metadata(path)
+                    self.metadata_dirty = False
+                sync_directory(path)
+                
+                # everything logged so far is now part of the checkpoint, and durable
+                if self.wal is not None:
+                    self.wal.truncate()
+            finally:
+                if self.wal is not None:
+                    self.wal.appends.release()
+                for table in reversed(tables):
+                    table.latch.release()
+                    table.merge_lock.release()
+        finally:
+            if self.wal is not None:
+                self.wal.release_transactions()
+
+    def save_metadata(self, path):
+        """Save the name, column count and key of every table"""
+        table_metadata = [(table.name, table.num_columns, table.key) for table in self.tables]
+        # tables that were never accessed are unchanged on disk, only keep their metadata
+        for name, (num_columns, key_index) in self.unloaded_tables.items():
+            table_metadata.append((name, num_columns, key_index))
+        
+        def write(f):
+            f.write(struct.pack('i', len(table_metadata)))
             
-            for table in self.tables:
-                name_bytes = table.name.encode('utf-8')
+            for name, num_columns, key_index in table_metadata:
+                name_bytes = name.encode('utf-8')
                 f.write(struct.pack('i', len(name_bytes)))
                 f.write(name_bytes)
 
-                f.write(struct.pack('i', table.num_columns))
-                f.write(struct.pack('i', table.key))
+                f.write(struct.pack('i', num_columns))
+                f.write(struct.pack('i', key_index))
         
-        for table in self.tables:
-            self.save_table_data(path, table)
+        replace_file(os.path.join(path, 'metadata.db'), write)
 
     def save_table_data(self, path, table):
-        """Save all data for a specific table"""
+        """Save the page directory changes of a table, and its tail page map if that changed"""
         table_path = os.path.join(path, table.name)
         
         if not os.path.exists(table_path):
             os.makedirs(table_path)
         
-        for idx in range(table.num_columns):
-            base_dir = os.path.join(table_path, f'base_col_{idx}')
-            self.save_pages(base_dir, table.base_page[idx])
+        # before the directory, which may point into tail pages the old map doesn't have
+        if table.tail_pages.dirty or table.tail_pages.pending:
+            replace_file(os.path.join(table_path, 'tail_pages.dat'), table.tail_pages.save)
+            table.tail_pages.checkpointed()
         
-        for idx in range(table.num_columns):
-            tail_dir = os.path.join(table_path, f'tail_col_{idx}')
-            self.save_pages(tail_dir, table.tail_page[idx])
+        num_changes = len(table.directory_changes)
+        # rewrite everything once replaying the deltas would cost more than reading the full files
+        if table.needs_full_checkpoint or table.delta_entries + num_changes > max(len(table.page_directory), DELTA_COMPACTION_MIN):
+            # dirty pages were written back by the buffer pool, only drop stale pages here
+            for idx in range(table.total_columns):
+                self.remove_stale_pages(table, 'base', idx, table.num_base_pages[idx])
+            
+            # tail pages are stored at slots of their own, see TailPages
+            for idx in range(table.total_columns):
+                self.remove_stale_pages(table, 'tail', idx, table.tail_pages.num_slots)
+            
+            # every base page has two merged copies, see Table.merge_page
+            for idx in range(table.num_columns):
+                self.remove_stale_pages(table, 'merged', idx, 2 * table.num_base_pages[idx])
+            
+            self.save_page_directory(table_path, table)
+            # version chains are left over from a table of the same name in the old layout
+            for stale_name in ('version_chains.dat', 'version_chains.delta'):
+                stale_path = os.path.join(table_path, stale_name)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            table.needs_full_checkpoint = False
+            table.delta_entries = 0
+        elif num_changes > 0:
+            self.append_page_directory_delta(table_path, table)
+            table.delta_entries += num_changes
         
-        self.save_page_directory(table_path, table)
-        self.save_version_chains(table_path, table)
+        table.directory_changes = set()
 
-    def save_pages(self, directory, pages):
-        """Save all pages to a directory"""
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        
-        for idx, page in enumerate(pages):
-            page_path = os.path.join(directory, f'page_{idx}.dat')
-            with open(page_path, 'wb') as f:
-                f.write(struct.pack('i', page.num_records))
-                f.write(page.data)
+    def remove_stale_pages(self, table, kind, col_idx, num_pages):
+        """Truncate pages left over from a previous table with the same name"""
+        if not os.path.exists(self.bufferpool.segment_path(table.name, kind, col_idx)):
+            return
+        
+        segment = self.bufferpool.get_segment(table.name, kind, col_idx)
+        segment.truncate(num_pages)
+        segment.sync()
 
     def save_page_directory(self, table_path, table):
-        """Save the page directory"""
+        """
+        # Save the full page directory in place of the old one and its deltas. The new directory is
+        # made durable as page_directory.dat.new first: the deltas would undo newer changes if replayed
+        # on top of it, so they are removed before it replaces the old directory. load_page_directory
+        # finishes the replacement if a crash stops it in between.
+        """
         pd_path = os.path.join(table_path, 'page_directory.dat')
+        delta_path = os.path.join(table_path, 'page_directory.delta')
         
-        with open(pd_path, 'wb') as f:
-            f.write(struct.pack('i', len(table.page_directory)))
-            
-            for rid, positions in table.page_directory.items():
-                f.write(struct.pack('q', rid))
-                
-                for page_idx, slot_idx in positions:
-                    f.write(struct.pack('i', page_idx))
-                    f.write(struct.pack('i', slot_idx))
+        replace_file(pd_path + '.new', table.page_directory.save)
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+            sync_directory(table_path)
+        os.replace(pd_path + '.new', pd_path)
+        sync_directory(table_path)
 
-    def save_version_chains(self, table_path, table):
-        """Save version chains"""
-        vc_path = os.path.join(table_path, 'version_chains.dat')
+    def append_page_directory_delta(self, table_path, table):
+        """Append inserted and deleted page directory entries since the last checkpoint"""
+        if not table.directory_changes:
+            return
         
-        with open(vc_path, 'wb') as f:
-            f.write(struct.pack('i', len(table.version_chain)))
-            
-            for rid, versions in table.version_chain.items():
-                f.write(struct.pack('q', rid))
-                f.write(struct.pack('i', len(versions)))
-                
-                for tail_locs in versions:
-                    for col_idx in range(table.num_columns):
-                        if tail_locs[col_idx] is not None:
-                            f.write(struct.pack('?', True))
-                            page_idx, slot_idx = tail_locs[col_idx]
-                            f.write(struct.pack('i', page_idx))
-                            f.write(struct.pack('i', slot_idx))
-                        else:
-                            f.write(struct.pack('?', False))
+        delta_path = os.path.join(table_path, 'page_directory.delta')
+        with open(delta_path, 'ab') as f:
+            for rid in sorted(table.directory_changes):
+                position = table.page_directory.get(rid)
+                f.write(struct.pack('q?', rid, position is not None))
+                if position is not None:
+                    f.write(struct.pack('ii', *position))
+                    f.write(struct.pack('qq', table.page_directory.indirection[rid], table.page_directory.schema_encoding[rid]))
+            f.flush()
+            os.fsync(f.fileno())
 
    
     def create_table(self, name, num_columns, key_index):
@@ -244,28 +507,60 @@ class Database():
         :param num_columns: int
         :param key: int
         """
-        table = Table(name, num_columns, key_index)
+        # a table with the same name would share its pages in the buffer pool, replace it
+        self.remove_table(name)
+        self.metadata_dirty = True
+        table = Table(name, num_columns, key_index, self.bufferpool, self.wal, self.lock_manager,
+                      self.merge_threshold, self.version_retention)
         self.tables.append(table)
+        if self.wal is not None:
+            self.wal.append(OP_CREATE, name, [num_columns, key_index])
+            self.wal.wait_pending()
         return table
 
     
     
     def drop_table(self, name):
         """Deletes the specified table"""
+        if self.remove_table(name):
+            if self.wal is not None:
+                self.wal.append(OP_DROP, name, [])
+                self.wal.wait_pending()
+            print("table dropped")
+            return 1
+        print("table not found")
+        return -1
+
+    def remove_table(self, name):
         for table in self.tables:
             if table.name == name:
+                table.stop_merging()
                 self.tables.remove(table)
-                print("table dropped")
-                return 1
-        print("table not found")
-        return -1
+                self.bufferpool.drop_table(name)
+                self.metadata_dirty = True
+                return True
+        if name in self.unloaded_tables:
+            del self.unloaded_tables[name]
+            self.metadata_dirty = True
+            return True
+        return False
 
    
-    def get_table(self, name):
-        """ Returns table with the passed name """
+    def find_table(self, name):
+        """Returns table with the passed name, loading it if needed, or None"""
         for table in self.tables:
             if table.name == name:
-                print("table was found")
                 return table
+        if name in self.unloaded_tables:
+            return self.load_table(name)
+        return None
+
+   
+    def get_table(self, name):
+        """ Returns table with the passed name """
+        table = self.find_table(name)
+        if table is not None:
+            print("table was found")
+            return table
         print('table not found')
-        return None
\ No newline at end of file
+        return None
@@ -1,4 +1,12 @@
 import math
+from bisect import bisect_left, bisect_right
+
+# default number of children per B+ tree node
+BPLUS_TREE_ORDER = 128
+
+# index types
+BTREE_INDEX = 'btree'   # ordered, serves point and range lookups
+HASH_INDEX = 'hash'     # point lookups only
 
 class Index:
 
@@ -6,16 +14,31 @@ class Index:
         # One index for each table. All our empty initially.
         self.table = table
         self.indices = [None] *  table.num_columns
+        # optional hash index per column, used instead of the tree for point lookups
+        self.hash_indices = [None] * table.num_columns
 
     """
     # returns the location of all records with the given value on column "column"
     """
 
     def locate(self, column, value):
-        tree = self.indices[column]
-        result = tree.locate(value)
+        hash_index = self.hash_indices[column]
+        if hash_index is not None:
+            result = hash_index.locate(value)
+        else:
+            result = self.indices[column].locate(value)
         return result[0] if result else None
 
+    def locate_all(self, column, value):
+        """RIDs of every record with value in column, None if the column has no index"""
+        hash_index = self.hash_indices[column]
+        if hash_index is not None:
+            return hash_index.locate(value)
+        tree = self.indices[column]
+        if tree is not None:
+            return tree.locate(value)
+        return None
+
 
     """
     # Returns the RIDs of all records with values in column "column" between "begin" and "end"
@@ -28,23 +51,58 @@ class Index:
 
     """
     # optional: Create index on specific column
+    # :param index_type: BTREE_INDEX or HASH_INDEX, a column can have one of each
+    # :param order: max number of children per tree node
     """
 
-    def create_index(self, column_number):
-        if (self.indices[column_number] is None):
-            self.indices[column_number] = BPlusTree(order=4)
-            # page_directory maps: rid -> list of (page_idx, slot_idx) for each column
-            for rid, positions in self.table.page_directory.items():
-                # Get the position for this specific column
-                page_idx, slot_idx = positions[column_number]
-                value = self.table.read_column(column_number, page_idx, slot_idx)
-                self.indices[column_number].insert(value, rid)
+    def create_index(self, column_number, index_type=BTREE_INDEX, order=BPLUS_TREE_ORDER):
+        indices = self.hash_indices if index_type == HASH_INDEX else self.indices
+        if (indices[column_number] is None):
+            index = HashIndex() if index_type == HASH_INDEX else BPlusTree(order=order)
+            # (rid, value) of every live record, in rid order
+            index.bulk_load((value, rid) for rid, value in self.table.scan_column(column_number))
+            indices[column_number] = index
                 
     def insert(self, column_number, value, rid):
-        """Insert a (value, rid) pair into the column's index (if it exists)."""
+        """Insert a (value, rid) pair into the column's indexes (if they exist)."""
         tree = self.indices[column_number]
         if tree is not None:
             tree.insert(value, rid)
+        hash_index = self.hash_indices[column_number]
+        if hash_index is not None:
+            hash_index.insert(value, rid)
+
+    def insert_many(self, column_number, values, rids):
+        """Insert (value, rid) pairs into the column's indexes (if they exist), in value order."""
+        for index in (self.indices[column_number], self.hash_indices[column_number]):
+            if index is None:
+                continue
+            if index.is_empty():
+                index.bulk_load(zip(values, rids))
+            else:
+                for value, rid in sorted(zip(values, rids)):
+                    index.insert(value, rid)
+
+    def delete(self, column_number, value, rid):
+        """Remove a (value, rid) pair from the column's indexes (if they exist)."""
+        tree = self.indices[column_number]
+        if tree is not None:
+            tree.delete(value, rid)
+        hash_index = self.hash_indices[column_number]
+        if hash_index is not None:
+            hash_index.delete(value, rid)
+
+    def update(self, column_number, old_value, new_value, rid):
+        """Move a record from old_value to new_value in the column's indexes (if they exist)."""
+        if old_value != new_value and self.has_index(column_number):
+            self.delete(column_number, old_value, rid)
+            self.insert(column_number, new_value, rid)
+
+    def has_index(self, column_number):
+        return self.indices[column_number] is not None or self.hash_indices[column_number] is not None
+
+    def indexed_columns(self):
+        return [column_number for column_number in range(self.table.num_columns) if self.has_index(column_number)]
 
     """
     # optional: Drop index of specific column
@@ -52,11 +110,128 @@ class Index:
 
     def drop_index(self, column_number):
         self.indices[column_number] = None
+        self.hash_indices[column_number] = None
+
+class HashIndex:
+
+    """
+    # Equality-only index: maps each key to its rid, or to a list of rids once the key repeats.
+    """
+    def __init__(self):
+        self.buckets = {}
+
+    def is_empty(self):
+        return not self.buckets
+
+    def bulk_load(self, pairs):
+        self.buckets = {}
+        for key, rid in pairs:
+            self.insert(key, rid)
+
+    def insert(self, key, rid):
+        current = self.buckets.get(key)
+        if current is None:
+            self.buckets[key] = rid
+        elif isinstance(current, list):
+            current.append(rid)
+        else:
+            self.buckets[key] = [current, rid]
+
+    def locate(self, key):
+        current = self.buckets.get(key)
+        if current is None:
+            return []
+        if isinstance(current, list):
+            return list(current)
+        return [current]
+
+    def delete(self, key, rid):
+        """Remove one (key, rid) entry, returns False if it isn't in the index"""
+        current = self.buckets.get(key)
+        if current is None:
+            return False
+        if not isinstance(current, list):
+            if current != rid:
+                return False
+            del self.buckets[key]
+            return True
+        if rid not in current:
+            return False
+        current.remove(rid)
+        if len(current) == 1:
+            self.buckets[key] = current[0]
+        return True
+
 
 class BPlusTree:
-    def __init__(self, order=4):
+
+    """
+    # Leaves keep parallel sorted lists of keys and rids, internal nodes a sorted list of separator keys.
+    # Every key under children[i] is <= keys[i] <= every key under children[i + 1], so duplicates of a
+    # key may span several leaves: lookups descend to the leftmost candidate leaf and scan right.
+    """
+    def __init__(self, order=BPLUS_TREE_ORDER):
+        if order < 4:
+            raise ValueError('B+ tree order must be at least 4')
         self.root = Node(order)
         self.order = order
+        # fewest keys a node other than the root may hold, both halves of a split keep at least this many
+        self.min_keys = (order - 2) // 2
+
+    def is_empty(self):
+        return self.root.is_leaf and not self.root.keys
+
+    def bulk_load(self, pairs):
+        """
+        Replace the contents of the tree with (key, rid) pairs, building it bottom-up:
+        pairs are sorted once, packed into as few leaves as possible, then each level of
+        internal nodes is built over the one below until a single root remains.
+        """
+        pairs = sorted(pairs)
+
+        level = []
+        for start, end in self._even_slices(len(pairs), self.order - 1):
+            leaf = Node(self.order)
+            leaf.keys = [key for key, rid in pairs[start:end]]
+            leaf.rids = [rid for key, rid in pairs[start:end]]
+            if level:
+                level[-1].next = leaf
+            level.append(leaf)
+        if not level:
+            self.root = Node(self.order)
+            return
+        # smallest key under each node, used as the separator in front of it
+        level_min_keys = [leaf.keys[0] for leaf in level]
+
+        while len(level) > 1:
+            parents = []
+            parent_min_keys = []
+            for start, end in self._even_slices(len(level), self.order):
+                parent = Node(self.order)
+                parent.is_leaf = False
+                parent.children = level[start:end]
+                parent.keys = level_min_keys[start + 1:end]
+                parents.append(parent)
+                parent_min_keys.append(level_min_keys[start])
+            level = parents
+            level_min_keys = parent_min_keys
+
+        self.root = level[0]
+
+    def _even_slices(self, count, max_size):
+        """(start, end) slices splitting count items into as few groups of at most max_size as possible,
+        spread evenly so no group ends up under the minimum fill"""
+        if count == 0:
+            return []
+        num_groups = -(-count // max_size)
+        size, extra = divmod(count, num_groups)
+        slices = []
+        start = 0
+        for i in range(num_groups):
+            end = start + size + (1 if i < extra else 0)
+            slices.append((start, end))
+            start = end
+        return slices
 
     def insert(self, key, rid):
         root = self.root
@@ -71,71 +246,134 @@ class BPlusTree:
         self.insert_non_full(self.root, key, rid)
 
     def insert_non_full(self, node, key, rid):
-        if (node.is_leaf):
-            idx = 0
-
-            while (idx < len(node.keys) and node.keys[idx][0] < key):
-                idx += 1
-            
-            node.keys.insert(idx, (key,rid))
-        else:
-            i = 0
-            while (i < len(node.keys) and key > node.keys[i]):
-                i += 1
-            
+        while not node.is_leaf:
+            i = bisect_right(node.keys, key)
             if len(node.children[i].keys) == self.order - 1:
                 self._split_child(node, i)
-                if key > node.keys[i]:
+                if key >= node.keys[i]:
                     i += 1
+            node = node.children[i]
 
-            self.insert_non_full(node.children[i], key, rid)
+        idx = bisect_right(node.keys, key)
+        node.keys.insert(idx, key)
+        node.rids.insert(idx, rid)
         
     def _split_child(self, parent, index):
         node = parent.children[index]
-        mid = self.order // 2
+        mid = (self.order - 1) // 2
         new_node = Node(self.order)
         new_node.is_leaf = node.is_leaf
 
-        split_key = node.keys[mid][0] if node.is_leaf else node.keys[mid]
+        split_key = node.keys[mid]
         parent.keys.insert(index, split_key)
-        new_node.keys = node.keys[mid:] if node.is_leaf else node.keys[mid + 1:]
-        node.keys = node.keys[:mid]
 
         if (not node.is_leaf):
+            new_node.keys = node.keys[mid + 1:]
             new_node.children = node.children[mid + 1:]
+            node.keys = node.keys[:mid]
             node.children = node.children[:mid + 1]
         else:
+            new_node.keys = node.keys[mid:]
+            new_node.rids = node.rids[mid:]
+            node.keys = node.keys[:mid]
+            node.rids = node.rids[:mid]
             new_node.next = node.next
             node.next = new_node
 
         parent.children.insert(index + 1, new_node)
-        
-    def locate(self, key):
-        node = self.root
-        while not node.is_leaf:
-            i = 0
-            while i < len(node.keys) and key >= node.keys[i]:
+
+    def delete(self, key, rid):
+        """Remove one (key, rid) entry, merging or redistributing underfull nodes; returns False if it isn't in the tree"""
+        removed = self._delete(self.root, key, rid)
+        if not self.root.is_leaf and len(self.root.children) == 1:
+            self.root = self.root.children[0]
+        return removed
+
+    def _delete(self, node, key, rid):
+        if node.is_leaf:
+            i = bisect_left(node.keys, key)
+            while i < len(node.keys) and node.keys[i] == key:
+                if node.rids[i] == rid:
+                    del node.keys[i]
+                    del node.rids[i]
+                    return True
                 i += 1
-            node = node.children[i]
+            return False
 
-        return [rid for k, rid in node.keys if k == key]
-    
-    def locate_range(self, start, end):
+        # duplicates of key may sit in any child between these two
+        for i in range(bisect_left(node.keys, key), bisect_right(node.keys, key) + 1):
+            if self._delete(node.children[i], key, rid):
+                if len(node.children[i].keys) < self.min_keys:
+                    self._rebalance(node, i)
+                return True
+        return False
+
+    def _rebalance(self, parent, index):
+        """Refill the underfull child at index from a sibling, or merge it with one"""
+        child = parent.children[index]
+        left = parent.children[index - 1] if index > 0 else None
+        right = parent.children[index + 1] if index + 1 < len(parent.children) else None
+
+        if left is not None and len(left.keys) > self.min_keys:
+            if child.is_leaf:
+                child.keys.insert(0, left.keys.pop())
+                child.rids.insert(0, left.rids.pop())
+                parent.keys[index - 1] = child.keys[0]
+            else:
+                child.keys.insert(0, parent.keys[index - 1])
+                child.children.insert(0, left.children.pop())
+                parent.keys[index - 1] = left.keys.pop()
+        elif right is not None and len(right.keys) > self.min_keys:
+            if child.is_leaf:
+                child.keys.append(right.keys.pop(0))
+                child.rids.append(right.rids.pop(0))
+                parent.keys[index] = right.keys[0]
+            else:
+                child.keys.append(parent.keys[index])
+                child.children.append(right.children.pop(0))
+                parent.keys[index] = right.keys.pop(0)
+        elif left is not None:
+            self._merge(parent, index - 1)
+        elif right is not None:
+            self._merge(parent, index)
+
+    def _merge(self, parent, index):
+        """Merge the child after index into the child at index"""
+        node = parent.children[index]
+        sibling = parent.children[index + 1]
+        if node.is_leaf:
+            node.keys.extend(sibling.keys)
+            node.rids.extend(sibling.rids)
+            node.next = sibling.next
+        else:
+            node.keys.append(parent.keys[index])
+            node.keys.extend(sibling.keys)
+            node.children.extend(sibling.children)
+        del parent.keys[index]
+        del parent.children[index + 1]
+
+    def _find_leaf(self, key):
+        """Leftmost leaf that can hold key"""
         node = self.root
         while not node.is_leaf:
-            i = 0
-            while i < len(node.keys) and start > node.keys[i]:
-                i += 1
-            node = node.children[i]
+            node = node.children[bisect_left(node.keys, key)]
+        return node
+        
+    def locate(self, key):
+        return self.locate_range(key, key)
+    
+    def locate_range(self, start, end):
+        node = self._find_leaf(start)
+        i = bisect_left(node.keys, start)
 
         results = []
         while node:
-            for k, rid in node.keys:
-                if start <= k <= end:
-                    results.append(rid)
-                elif k > end:
-                    return results
+            stop = bisect_right(node.keys, end, i)
+            results.extend(node.rids[i:stop])
+            if stop < len(node.keys):
+                return results
             node = node.next
+            i = 0
         return results
 
 
@@ -145,6 +383,8 @@ class Node:
     def __init__(self, order):
         self.order = order
         self.keys = []
+        # leaf nodes only: rid of each key
+        self.rids = []
         self.children = []
         self.is_leaf = True
-        self.next = None
\ No newline at end of file
+        self.next = None
@@ -0,0 +1,155 @@
+import threading
+import time
+
+# lock modes, the intention modes are only taken on tables
+INTENTION_SHARED = 'IS'
+INTENTION_EXCLUSIVE = 'IX'
+SHARED = 'S'
+EXCLUSIVE = 'X'
+
+# modes a lock can be granted in while another transaction holds the key mode
+COMPATIBLE = {
+    INTENTION_SHARED: {INTENTION_SHARED, INTENTION_EXCLUSIVE, SHARED},
+    INTENTION_EXCLUSIVE: {INTENTION_SHARED, INTENTION_EXCLUSIVE},
+    SHARED: {INTENTION_SHARED, SHARED},
+    EXCLUSIVE: set(),
+}
+# (held, requested) pairs where the held mode already covers the requested one
+COVERS = {
+    (SHARED, INTENTION_SHARED),
+    (INTENTION_EXCLUSIVE, INTENTION_SHARED),
+    (EXCLUSIVE, INTENTION_SHARED),
+    (EXCLUSIVE, INTENTION_EXCLUSIVE),
+    (EXCLUSIVE, SHARED),
+}
+
+# deadlock handling
+NO_WAIT = 'no-wait'     # a conflicting request fails at once
+WAIT_DIE = 'wait-die'   # older transactions wait for younger ones, younger ones fail
+TIMEOUT = 'timeout'     # a conflicting request waits up to the timeout, then fails
+
+LOCK_TIMEOUT = 0.5
+LOCK_SHARDS = 64
+
+class Context(threading.local):
+
+    """
+    # State of the queries running on a thread. The defaults live on the class, reading an
+    # attribute a thread never set costs no more than any other read (getattr with a default
+    # raises and catches AttributeError first).
+    """
+    # transaction running on the current thread, set by Transaction.run
+    transaction = None
+    # lock owner of the write running outside a transaction, and the owner reused by every such
+    # write of the thread, see Query.autocommit
+    autocommit = None
+    autocommit_owner = None
+
+
+context = Context()
+
+
+def current_transaction():
+    return context.transaction
+
+
+def combine(held, requested):
+    """Weakest mode covering both held and requested"""
+    if held == requested or (held, requested) in COVERS:
+        return held
+    if (requested, held) in COVERS:
+        return requested
+    # S and IX together, there is no SIX mode
+    return EXCLUSIVE
+
+
+class LockEntry:
+
+    __slots__ = ('holders', 'waiting')
+
+    def __init__(self):
+        # transaction id -> mode
+        self.holders = {}
+        self.waiting = 0
+
+
+class LockShard:
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        # resource -> LockEntry, entries are removed once nobody holds or waits for them
+        self.locks = {}
+
+
+class LockManager:
+
+    """
+    # Strict two phase locking of tables and records, shared by every table of a database.
+    # Resources are hashed over independent shards, each with its own mutex and lock table, so
+    # transactions locking different records rarely contend on the same mutex.
+    # Transactions are identified by increasing ids, a smaller id is an older transaction.
+    # Locks are only released all at once by Transaction.commit and Transaction.abort, or once
+    # a write outside a transaction returns (see Query.autocommit).
+    """
+    def __init__(self, policy=NO_WAIT, timeout=LOCK_TIMEOUT, num_shards=LOCK_SHARDS):
+        self.policy = policy
+        self.timeout = timeout
+        self.shards = [LockShard() for i in range(num_shards)]
+        self.conflicts = 0
+
+    def acquire(self, transaction_id, resource, mode):
+        """Lock resource in mode (or upgrade a lock already held), returns False if the request fails"""
+        shard = self.shards[hash(resource) % len(self.shards)]
+        with shard.condition:
+            entry = shard.locks.get(resource)
+            if entry is None:
+                # nobody holds or waits for it, the common case
+                entry = LockEntry()
+                entry.holders[transaction_id] = mode
+                shard.locks[resource] = entry
+                return True
+            held = entry.holders.get(transaction_id)
+            if held is not None:
+                mode = combine(held, mode)
+                if mode == held:
+                    return True
+
+            deadline = None
+            while True:
+                conflicting = [holder for holder, holder_mode in entry.holders.items()
+                               if holder != transaction_id and holder_mode not in COMPATIBLE[mode]]
+                if not conflicting:
+                    entry.holders[transaction_id] = mode
+                    return True
+
+                self.conflicts += 1
+                wait = None
+                if self.policy == NO_WAIT:
+                    break
+                if self.policy == WAIT_DIE:
+                    if min(conflicting) < transaction_id:
+                        break
+                else:
+                    if deadline is None:
+                        deadline = time.monotonic() + self.timeout
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        break
+                entry.waiting += 1
+                shard.condition.wait(wait)
+                entry.waiting -= 1
+
+            if not entry.holders and not entry.waiting:
+                del shard.locks[resource]
+            return False
+
+    def release(self, transaction_id, resource):
+        shard = self.shards[hash(resource) % len(self.shards)]
+        with shard.condition:
+            entry = shard.locks.get(resource)
+            if entry is None or entry.holders.pop(transaction_id, None) is None:
+                return
+            if entry.waiting:
+                shard.condition.notify_all()
+            elif not entry.holders:
+                del shard.locks[resource]
@@ -0,0 +1,47 @@
+import threading
+
+# number of full tail pages waiting to be merged before Table.update_row wakes up the merge thread
+MERGE_THRESHOLD = 8
+
+
+class MergeStats:
+
+    def __init__(self):
+        self.merges = 0
+        self.pages_merged = 0
+        self.tail_records_merged = 0
+        # tail pages whose records were all cut off version chains, see Table.trim_versions
+        self.tail_pages_reclaimed = 0
+        self.merge_time = 0.0
+
+
+class MergeWorker:
+
+    """
+    # Background thread running Table.merge for one table whenever it is woken up.
+    # Queries never wait for it: merged base pages are written as copies and swapped in through
+    # the page directory once complete.
+    """
+    def __init__(self, table):
+        self.table = table
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self):
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if self.stopped:
+                return
+            self.table.merge()
+
+    def stop(self):
+        """Wait for a running merge to finish and end the thread"""
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
@@ -1,4 +1,10 @@
 
+import struct
+
+RECORDS_PER_PAGE = 512
+VALUE = struct.Struct('<q')
+
+
 class Page:
 
     def __init__(self):
@@ -6,18 +12,48 @@ class Page:
         self.data = bytearray(4096)
 
     def has_capacity(self):
-        return self.num_records < 512
+        return self.num_records < RECORDS_PER_PAGE
+
+    def make_writable(self):
+        # pages read through a memory map share the file's bytes, copy them before the first write
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data)
 
     def write(self, value):
         if self.has_capacity():
+            self.make_writable()
             offset = self.num_records * 8
             self.data[offset:offset + 8] = value.to_bytes(8, byteorder='little', signed=True)
             self.num_records += 1
             return True
         else:
             return False
+
+    def write_at(self, slot, value):
+        self.make_writable()
+        VALUE.pack_into(self.data, 8 * slot, value)
+        if slot >= self.num_records:
+            self.num_records = slot + 1
+
+    def write_slots(self, slot, values, start=0):
+        # writes values[start:] from slot on until the page is full, returns how many were written
+        count = min(RECORDS_PER_PAGE - slot, len(values) - start)
+        if count > 0:
+            self.make_writable()
+            struct.pack_into(f'<{count}q', self.data, slot * 8, *values[start:start + count])
+            self.num_records = max(self.num_records, slot + count)
+        return count
+
     def read(self, slot):
-        offset = 8 * slot
-        data_bytes = self.data[offset:offset+8]
-        return int.from_bytes(data_bytes,byteorder='little', signed=True)
+        # unpacks in place, slicing would copy the value into a new bytes object first
+        return VALUE.unpack_from(self.data, 8 * slot)[0]
+
+    def read_all(self):
+        # decodes every written slot with a single unpack instead of one from_bytes per value
+        return struct.unpack_from(f'<{self.num_records}q', self.data)
 
+
+    def update(self, slot, value):
+        self.make_writable()
+        offset = 8 * slot
+        self.data[offset:offset + 8] = value.to_bytes(8, byteorder='little', signed=True)
@@ -0,0 +1,173 @@
+from array import array
+from lstore.page import RECORDS_PER_PAGE
+import struct
+import time
+
+PAGE_DIRECTORY_MAGIC = b'LPDR'
+PAGE_DIRECTORY_VERSION = 3
+
+# magic, version, number of rid slots (highest rid + 1)
+HEADER = struct.Struct('<4sii')
+# last tail rid merged, number of base pages with a merged copy entry
+MERGE_HEADER = struct.Struct('<qi')
+
+
+class PageDirectory:
+
+    """
+    # Base position of every record, indexed by RID.
+    # All columns of a base record are written at the same (page_idx, slot_idx), so the whole
+    # record is located by one int64 per RID, page_idx * RECORDS_PER_PAGE + slot_idx, kept in a
+    # dense array. Deleted (and never used) RIDs are marked in a tombstone bitmap.
+    # The directory also holds each record's indirection (RID of its latest tail record, 0 if
+    # never updated) and schema encoding (bit i set once column i was updated), so base pages
+    # are never written after insert.
+    # For every base page that was merged it points at the latest merged copy (see Table.merge).
+    """
+    def __init__(self):
+        # rid 0 is never handed out, bits past the last rid slot are always set
+        self.positions = array('q', [-1])
+        self.indirection = array('q', [0])
+        self.schema_encoding = array('q', [0])
+        self.tombstones = bytearray(b'\xff')
+        self.live = 0
+        # base page idx -> (merged page idx, last tail rid folded into it), None if never merged;
+        # entries are replaced as a whole so readers always see a matching pair
+        self.merged_pages = []
+        # tail records up to this one have been merged
+        self.merged_tail_rid = 0
+        # odd while set_latest writes a record's indirection and schema encoding, see latest
+        self.sequence = 0
+
+    def __len__(self):
+        return self.live
+
+    def __contains__(self, rid):
+        return 0 < rid < len(self.positions) and not self.tombstones[rid >> 3] & (1 << (rid & 7))
+
+    def __getitem__(self, rid):
+        position = self.get(rid)
+        if position is None:
+            raise KeyError(rid)
+        return position
+
+    def get(self, rid, default=None):
+        """(page_idx, slot_idx) of a live record, default otherwise"""
+        if 0 < rid < len(self.positions) and not self.tombstones[rid >> 3] & (1 << (rid & 7)):
+            return divmod(self.positions[rid], RECORDS_PER_PAGE)
+        return default
+
+    def __setitem__(self, rid, position):
+        if rid >= len(self.positions):
+            self.grow(rid + 1)
+        if rid not in self:
+            self.live += 1
+            self.tombstones[rid >> 3] &= ~(1 << (rid & 7))
+            self.indirection[rid] = 0
+            self.schema_encoding[rid] = 0
+        page_idx, slot_idx = position
+        self.positions[rid] = page_idx * RECORDS_PER_PAGE + slot_idx
+
+    def __delitem__(self, rid):
+        if rid not in self:
+            raise KeyError(rid)
+        self.tombstones[rid >> 3] |= 1 << (rid & 7)
+        self.live -= 1
+
+    def __iter__(self):
+        """Live RIDs in ascending order"""
+        tombstones = self.tombstones
+        for rid in range(1, len(self.positions)):
+            if not tombstones[rid >> 3] & (1 << (rid & 7)):
+                yield rid
+
+    def keys(self):
+        return iter(self)
+
+    def pop(self, rid, default=None):
+        if rid not in self:
+            return default
+        position = self[rid]
+        del self[rid]
+        return position
+
+    def set_latest(self, rid, tail_rid, schema_encoding):
+        """Point a live record at its newest tail record, call holding the table latch"""
+        self.sequence += 1
+        self.indirection[rid] = tail_rid
+        self.schema_encoding[rid] = schema_encoding
+        self.sequence += 1
+
+    def latest(self, rid):
+        """
+        # (indirection, schema encoding) of a record as one set_latest left them, for readers not
+        # holding the table latch: read again while a set_latest runs or if one ran meanwhile
+        """
+        while True:
+            sequence = self.sequence
+            tail_rid = self.indirection[rid]
+            schema_encoding = self.schema_encoding[rid]
+            if sequence == self.sequence and not sequence & 1:
+                return tail_rid, schema_encoding
+            time.sleep(0)
+
+    def merged_page(self, page_idx):
+        """(merged page idx, last tail rid folded into it) of a base page, None if it was never merged"""
+        if page_idx < len(self.merged_pages):
+            return self.merged_pages[page_idx]
+        return None
+
+    def set_merged_page(self, page_idx, merged_page_idx, tail_rid):
+        while len(self.merged_pages) <= page_idx:
+            self.merged_pages.append(None)
+        self.merged_pages[page_idx] = (merged_page_idx, tail_rid)
+
+    def grow(self, size):
+        """Extend to size rid slots, the new ones tombstoned until written"""
+        extension = size - len(self.positions)
+        self.positions.extend(array('q', [-1]) * extension)
+        self.indirection.extend(array('q', [0]) * extension)
+        self.schema_encoding.extend(array('q', [0]) * extension)
+        self.tombstones.extend(b'\xff' * (((size + 7) >> 3) - len(self.tombstones)))
+
+    def save(self, f):
+        """Write the directory with one header write, then one write per array and the bitmap"""
+        f.write(HEADER.pack(PAGE_DIRECTORY_MAGIC, PAGE_DIRECTORY_VERSION, len(self.positions)))
+        self.positions.tofile(f)
+        self.indirection.tofile(f)
+        self.schema_encoding.tofile(f)
+        f.write(self.tombstones)
+        f.write(MERGE_HEADER.pack(self.merged_tail_rid, len(self.merged_pages)))
+        merged = [entry if entry is not None else (-1, 0) for entry in self.merged_pages]
+        array('q', [merged_page_idx for merged_page_idx, tail_rid in merged]).tofile(f)
+        array('q', [tail_rid for merged_page_idx, tail_rid in merged]).tofile(f)
+
+    def load(self, f):
+        """Read a directory written by save, returns the version of its layout"""
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+        self.positions = array('q')
+        self.positions.fromfile(f, size)
+        self.indirection = array('q')
+        self.schema_encoding = array('q')
+        if version >= 2:
+            self.indirection.fromfile(f, size)
+            self.schema_encoding.fromfile(f, size)
+        else:
+            # version 1 kept no tail record pointers
+            self.indirection.extend(array('q', [0]) * size)
+            self.schema_encoding.extend(array('q', [0]) * size)
+        self.tombstones = bytearray(f.read((size + 7) >> 3))
+        deleted = bin(int.from_bytes(self.tombstones, 'little')).count('1')
+        self.live = len(self.tombstones) * 8 - deleted
+
+        self.merged_pages = []
+        self.merged_tail_rid = 0
+        if version >= 3:
+            self.merged_tail_rid, num_pages = MERGE_HEADER.unpack(f.read(MERGE_HEADER.size))
+            merged_page_indexes = array('q')
+            merged_page_indexes.fromfile(f, num_pages)
+            tail_rids = array('q')
+            tail_rids.fromfile(f, num_pages)
+            for merged_page_idx, tail_rid in zip(merged_page_indexes, tail_rids):
+                self.merged_pages.append((merged_page_idx, tail_rid) if merged_page_idx >= 0 else None)
+        return version
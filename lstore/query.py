@@ -1,6 +1,9 @@
 from lstore.table import Table, Record
-from lstore.page import Page
 from lstore.index import Index
+from lstore.wal import OP_INSERT, OP_UPDATE, OP_DELETE
+from lstore.transaction import Transaction, transaction_ids
+from lstore.lock_manager import context, current_transaction, INTENTION_SHARED, INTENTION_EXCLUSIVE, SHARED, EXCLUSIVE
+from lstore.clock import clock
 
 
 class Query:
@@ -9,12 +12,201 @@ class Query:
     Queries that fail must return False
     Queries that succeed should return the result or True
     Any query that crashes (due to exceptions) should return False
+    # Inside a transaction a query first takes its locks (see lock). Writes then change the table
+    # holding its latch, so they never see each other half done. Reads don't take the latch:
+    # their locks keep writers away from what they read, a record's latest version is read as one
+    # (see PageDirectory.latest) and only B+ tree lookups hold the latch, see index_range_rids.
+    # Writes outside a transaction lock like a transaction of their own, see autocommit.
+    # Reads of a snapshot transaction take no locks and read the table as of the snapshot.
+    # Queries of an optimistic transaction read the same way, seeing the writes the transaction
+    # buffered, and are validated and written at commit (see Transaction.commit_optimistic).
     """
     def __init__(self, table):
         self.table = table
         pass
 
+    """
+    # internal Method
+    # Records the effect of a successful query in the table's write-ahead log, see autocommit for
+    # when it's durable outside a transaction
+    """
+    def log(self, op, *values):
+        if self.table.wal is not None:
+            self.table.wal.append(op, self.table.name, values)
+
     
+    """
+    # internal Method
+    # Locks the table in table_mode and the records with the given primary keys in record_mode
+    # for the transaction running on this thread, or for the write running outside a transaction
+    # (see autocommit). Reads outside a transaction take no locks
+    # Returns False if the lock manager refused a lock
+    """
+    def lock(self, table_mode, record_mode=None, *primary_keys):
+        transaction = current_transaction()
+        if transaction is None:
+            transaction = context.autocommit
+            if transaction is None:
+                return True
+        if transaction.buffering:
+            # optimistic transactions lock what they write at commit
+            return True
+        if transaction.snapshot:
+            # snapshot transactions only read, their reads don't lock
+            return False
+        lock_manager = self.table.lock_manager
+        if not transaction.lock(lock_manager, (self.table.name,), table_mode):
+            return False
+        for primary_key in primary_keys:
+            if not transaction.lock(lock_manager, (self.table.name, primary_key), record_mode):
+                return False
+        return True
+
+
+    """
+    # internal Method
+    # True if a write has to run through autocommit: it's neither part of a transaction nor of
+    # another write outside one
+    """
+    def outside_transaction(self):
+        return current_transaction() is None and context.autocommit is None
+
+
+    """
+    # internal Method
+    # Runs query(*args), a write outside a transaction, as a transaction of its own: the locks it
+    # takes are held until it returns, so it never changes a record a running transaction has
+    # locked and may still roll back. Writes it makes in turn (increment's update) share its locks.
+    # Returns once its log records are durable (as far as the sync policy goes), waiting for them
+    # after the table latch is released so other writers can join the same group commit meanwhile.
+    # The lock owner is made once per thread and reused, it holds no locks between writes.
+    # Snapshots taken meanwhile are older than the write, see Clock.begin_write.
+    """
+    def autocommit(self, query, *args):
+        owner = context.autocommit_owner
+        if owner is None:
+            owner = context.autocommit_owner = Transaction()
+            owner.transaction_id = next(transaction_ids)
+        context.autocommit = owner
+        began = clock.begin_write()
+        try:
+            return query(*args)
+        finally:
+            clock.end_write(began)
+            context.autocommit = None
+            owner.release_locks()
+            if self.table.wal is not None:
+                self.table.wal.wait_pending()
+
+
+    """
+    # internal Method
+    # Records how to undo a change if the query runs in a transaction
+    """
+    def add_undo(self, undo, *args):
+        transaction = current_transaction()
+        if transaction is not None:
+            transaction.add_undo(self.table, undo, *args)
+
+
+    """
+    # internal Method
+    # Timestamp reads run at in a snapshot transaction, None otherwise
+    """
+    def snapshot_timestamp(self):
+        transaction = current_transaction()
+        if transaction is None or not transaction.snapshot:
+            return None
+        return transaction.snapshot_timestamp
+
+
+    """
+    # internal Method
+    # Transaction running on this thread if it buffers its writes (optimistic mode), None otherwise
+    """
+    def optimistic_transaction(self):
+        transaction = current_transaction()
+        if transaction is not None and transaction.buffering:
+            return transaction
+        return None
+
+
+    """
+    # internal Method
+    # (rid, row of all columns) of the records whose column value lies in [begin, end] as an optimistic
+    # transaction sees them: as of its snapshot, with its buffered writes applied (rid None for records
+    # it wrote). Older relative versions are read as of the snapshot only.
+    # The lookup and the versions read join the transaction's read set, see validate.
+    """
+    def optimistic_search(self, transaction, begin, end, column, relative_version=0):
+        timestamp = transaction.snapshot_timestamp
+        rids, versions = self.snapshot_search(begin, end, column, timestamp)
+        transaction.add_read(self, column, begin, end, {rid: tail_rid for rid, (tail_rid, schema_encoding) in zip(rids, versions)})
+        if relative_version != 0 and rids:
+            rids, versions = self.table.snapshot_versions(rids, timestamp, relative_version)
+        rows = self.table.read_rows(rids, list(range(self.table.num_columns)), versions=versions) if rids else []
+        written = transaction.writes.get(self.table)
+        if not written or relative_version != 0:
+            return list(zip(rids, rows))
+        
+        key = self.table.key
+        found = [(rid, row) for rid, row in zip(rids, rows) if row[key] not in written]
+        for row in written.values():
+            if row is not None and begin <= row[column] <= end:
+                found.append((None, tuple(row)))
+        return found
+
+
+    """
+    # internal Method
+    # True if the records whose column value lies in [begin, end] are still the ones an optimistic
+    # transaction found, in the versions it read (versions maps each rid to the tail rid read)
+    # Called holding the table latch
+    """
+    def validate(self, column, begin, end, versions):
+        directory = self.table.page_directory
+        for rid, tail_rid in versions.items():
+            if rid not in directory or directory.indirection[rid] != tail_rid:
+                return False
+        rids = self.index_range_rids(begin, end, column)
+        if rids is None:
+            rids = self.table.scan_column(column, begin, end).rids()
+        return set(rids) == versions.keys()
+
+
+    """
+    # internal Method
+    # RIDs of the records whose column value lay in [begin, end] at timestamp, and the version of
+    # each to read (see Table.snapshot_versions). Writers note a change before they move or drop
+    # the record's index entries, so one not found in the index is among the changes read after.
+    """
+    def snapshot_search(self, begin, end, column, timestamp, relative_version=0):
+        rids = self.index_range_rids(begin, end, column)
+        if rids is None:
+            rids = range(1, self.table.rid_counter + 1)
+        else:
+            # records changed since may be indexed under other values now
+            rids = sorted(set(rids).union(self.table.changed_since(timestamp)))
+        rids, versions = self.table.snapshot_versions(rids, timestamp)
+        values = self.table.read_rows(rids, [column], versions=versions) if rids else []
+        matching = [i for i, (value,) in enumerate(values) if begin <= value <= end]
+        rids = [rids[i] for i in matching]
+        if relative_version == 0:
+            return rids, [versions[i] for i in matching]
+        return self.table.snapshot_versions(rids, timestamp, relative_version)
+
+
+    """
+    # internal Method
+    # Locks needed to read the records whose search_key_index column equals search_key: the
+    # record itself when searching on the primary key, the whole table otherwise
+    """
+    def lock_search(self, search_key, search_key_index):
+        if search_key_index == self.table.key:
+            return self.lock(INTENTION_SHARED, SHARED, search_key)
+        return self.lock(SHARED)
+
+
     """
     # internal Method
     # Read a record with specified RID
@@ -22,12 +214,29 @@ class Query:
     # Return False if record doesn't exist or is locked due to 2PL
     """
     def delete(self, primary_key):
-        try:
-            rid = self.table.index.locate(self.table.key, primary_key)
-            if rid is None or rid not in self.table.page_directory:
+        transaction = self.optimistic_transaction()
+        if transaction is not None:
+            if not self.optimistic_search(transaction, primary_key, primary_key, self.table.key):
                 return False
-            del self.table.page_directory[rid]
+            transaction.add_write(self.table, {primary_key: None}, self.delete, primary_key)
             return True
+        if self.outside_transaction():
+            return self.autocommit(self.delete, primary_key)
+
+        if not self.lock(INTENTION_EXCLUSIVE, EXCLUSIVE, primary_key):
+            return False
+        try:
+            with self.table.latch:
+                rid = self.table.index.locate(self.table.key, primary_key)
+                if rid is None or rid not in self.table.page_directory:
+                    return False
+                directory = self.table.page_directory
+                position = directory[rid]
+                tail_rid, schema_encoding = directory.indirection[rid], directory.schema_encoding[rid]
+                self.table.delete_row(rid)
+                self.add_undo(self.table.undelete_row, rid, position, tail_rid, schema_encoding)
+                self.log(OP_DELETE, primary_key)
+                return True
         except:
             return False
     
@@ -40,17 +249,75 @@ class Query:
     """
     def insert(self, *columns):
         primary_key = columns[self.table.key]
-        existing_rid = self.table.index.locate(self.table.key, primary_key)
+        transaction = self.optimistic_transaction()
+        if transaction is not None:
+            if self.optimistic_search(transaction, primary_key, primary_key, self.table.key):
+                return False
+            transaction.add_write(self.table, {primary_key: list(columns)}, self.insert, *columns)
+            return True
+        if self.outside_transaction():
+            return self.autocommit(self.insert, *columns)
 
-        if existing_rid is not None:
+        if not self.lock(INTENTION_EXCLUSIVE, EXCLUSIVE, primary_key):
             return False
         
-        rid = self.table.insert_row(list(columns))
+        with self.table.latch:
+            existing_rid = self.table.index.locate(self.table.key, primary_key)
         
-        if rid is not None:
+            if existing_rid is not None:
+                return False
+
+            rid = self.table.insert_row(list(columns))
+
+            if rid is not None:
+                self.add_undo(self.table.delete_row, rid)
+                self.log(OP_INSERT, *columns)
+                return True
+            else:
+                return False
+
+    
+    """
+    # Insert many records at once
+    # :param rows: list of records, each a list of column values
+    # Return True upon succesful insertion
+    # Returns False without inserting anything if a primary key is repeated or already exists
+    """
+    def insert_many(self, rows):
+        return self.insert_columns([list(column) for column in zip(*rows)])
+
+    
+    """
+    # Insert many records given as a columnar batch
+    # :param columns: one list of values per column, all of the same length
+    # Return True upon succesful insertion
+    # Returns False without inserting anything if a primary key is repeated or already exists
+    """
+    def insert_columns(self, columns):
+        if not columns or not columns[0]:
             return True
-        else:
+        if self.optimistic_transaction() is not None:
+            # buffered record by record, a failed insert aborts the transaction anyway
+            return all(self.insert(*row) for row in zip(*columns))
+        if self.outside_transaction():
+            return self.autocommit(self.insert_columns, columns)
+        # one table lock instead of a lock per record
+        if not self.lock(EXCLUSIVE):
             return False
+        
+        with self.table.latch:
+            primary_keys = columns[self.table.key]
+            if len(set(primary_keys)) != len(primary_keys):
+                return False
+            for primary_key in primary_keys:
+                if self.table.index.locate(self.table.key, primary_key) is not None:
+                    return False
+        
+            for rid in self.table.insert_columns(columns):
+                self.add_undo(self.table.delete_row, rid)
+            if self.table.wal is not None:
+                self.table.wal.append_many(OP_INSERT, self.table.name, list(zip(*columns)))
+            return True
 
     
     """
@@ -58,23 +325,42 @@ class Query:
     # :param search_key: the value you want to search based on
     # :param search_key_index: the column index you want to search based on
     # :param projected_columns_index: what columns to return. array of 1 or 0 values.
+    # :param as_tuples: return a tuple of the projected values per record instead of a Record
     # Returns a list of Record objects upon success
     # Returns False if record locked by TPL
     # Assume that select will never be called on a key that doesn't exist
     """
-    def select(self, search_key, search_key_index, projected_columns_index):
-        rid = self.table.index.locate(search_key_index, search_key)
-        if rid is None:
-            return []
-        locations = self.table.page_directory[rid]
-        record_values = []
-        for col_idx, (page_idx, slot_idx) in enumerate(locations):
-            if projected_columns_index[col_idx]:
-                value = self.table.read_column(col_idx, page_idx, slot_idx)
-                record_values.append(value)
+    def select(self, search_key, search_key_index, projected_columns_index, as_tuples=False):
+        columns = [col_idx for col_idx, projected in enumerate(projected_columns_index) if projected]
+        # looked up once, select runs for every point read
+        transaction = current_transaction()
+        if transaction is not None and transaction.buffering:
+            found = self.optimistic_search(transaction, search_key, search_key, search_key_index)
+            rids = [rid for rid, row in found]
+            rows = [tuple(row[col_idx] for col_idx in columns) for rid, row in found]
+        elif transaction is not None and transaction.snapshot:
+            rids, versions = self.snapshot_search(search_key, search_key, search_key_index,
+                                                  transaction.snapshot_timestamp)
+            rows = self.table.read_rows(rids, columns, versions=versions) if rids else []
+        else:
+            if not self.lock_search(search_key, search_key_index):
+                return False
+            rids = self.locate_rids(search_key, search_key_index)
+            rows = self.table.read_rows(rids, columns)
+        if as_tuples:
+            return rows
+        
+        records = []
+        full_projection = len(columns) == self.table.num_columns
+        for rid, row in zip(rids, rows):
+            if full_projection:
+                record_values = list(row)
             else:
-                record_values.append(None)
-        return [Record(rid, search_key, record_values)]
+                record_values = [None] * self.table.num_columns
+                for col_idx, value in zip(columns, row):
+                    record_values[col_idx] = value
+            records.append(Record(rid, search_key, record_values))
+        return records
 
 
     
@@ -89,55 +375,67 @@ class Query:
     # Assume that select will never be called on a key that doesn't exist
     """
     def select_version(self, search_key, search_key_index, projected_columns_index, relative_version):
-        rid = self.table.index.locate(search_key_index, search_key)
-        if (rid is None or rid not in self.table.page_directory):
-            return None
+        columns = [col_idx for col_idx, projected in enumerate(projected_columns_index) if projected == 1]
+        transaction = self.optimistic_transaction()
+        timestamp = self.snapshot_timestamp()
+        if transaction is not None:
+            found = self.optimistic_search(transaction, search_key, search_key, search_key_index, relative_version)
+            if not found:
+                return None
+            rids = [rid for rid, row in found]
+            rows = [tuple(row[col_idx] for col_idx in columns) for rid, row in found]
+        elif timestamp is not None:
+            # versions counted back from the one visible in the snapshot
+            rids, versions = self.snapshot_search(search_key, search_key, search_key_index, timestamp, relative_version)
+            if not rids:
+                return None
+            rows = self.table.read_rows(rids, columns, versions=versions)
+        else:
+            if not self.lock_search(search_key, search_key_index):
+                return False
+            rids = self.locate_rids(search_key, search_key_index)
+            if not rids:
+                return None
+            rows = self.table.read_rows(rids, columns, relative_version)
+        records = []
+        for rid, row in zip(rids, rows):
+            record_values = [None] * self.table.num_columns
+            for col_idx, value in zip(columns, row):
+                record_values[col_idx] = value
+            records.append(Record(rid, search_key, record_values))
         
-        record_values = []
-        actual_version = relative_version
+        return records
 
-        if (relative_version < 0):
-            if (rid not in self.table.version_chain or len(self.table.version_chain[rid]) == 0):
-                actual_version = 0
-            else:
-                version_idx = -relative_version - 1
-                if (version_idx >= len(self.table.version_chain[rid])):
-                    version_idx = len(self.table.version_chain[rid]) - 1
-                    actual_version = -(version_idx + 1)
     
-        for col_idx, is_projected in enumerate(projected_columns_index):
-            if (is_projected == 1):
-                if (actual_version == 0):
-                    page_index, record_offset = self.table.page_directory[rid][col_idx]
-                    value = self.table.read_column(col_idx, page_index, record_offset)
-                    record_values.append(value)
-                else:
-                    version_idx = -actual_version - 1
-                    tail_locations = self.table.version_chain[rid][version_idx]
-                    
-                    if (tail_locations[col_idx] is not None):
-                        page_index, record_offset = tail_locations[col_idx]
-                        page = self.table.tail_page[col_idx][page_index]
-                        value = page.read(record_offset)
-                        record_values.append(value)
-                    else:
-                        value = None
-                        for older_idx in range(version_idx + 1, len(self.table.version_chain[rid])):
-                            older_tail = self.table.version_chain[rid][older_idx]
-                            if (older_tail[col_idx] is not None):
-                                page_index, record_offset = older_tail[col_idx]
-                                page = self.table.tail_page[col_idx][page_index]
-                                value = page.read(record_offset)
-                                break
-                        if (value is None):
-                            page_index, record_offset = self.table.page_directory[rid][col_idx]
-                            value = self.table.read_column(col_idx, page_index, record_offset)
-                        
-                        record_values.append(value)
-            else:
-                record_values.append(None)
-        
-        return [Record(rid, search_key, record_values)]
+    """
+    # internal Method
+    # RIDs of all records whose search_key_index column equals search_key, found through
+    # the column's index if it has one and by scanning the column otherwise
+    """
+    def locate_rids(self, search_key, search_key_index):
+        rids = self.index_range_rids(search_key, search_key, search_key_index)
+        if rids is None:
+            rids = self.table.scan_column(search_key_index, search_key, search_key).rids()
+        return rids
+
+    
+    """
+    # internal Method
+    # RIDs of all records whose column value lies in [begin, end] through an index
+    # Returns None if the column has no index supporting the predicate
+    # Hash index lookups are single dict reads, B+ tree nodes split and merge under writers so
+    # tree lookups hold the table latch.
+    """
+    def index_range_rids(self, begin, end, column):
+        index = self.table.index
+        if begin == end and index.hash_indices[column] is not None:
+            return index.locate_all(column, begin)
+        if index.indices[column] is None:
+            return None
+        with self.table.latch:
+            if begin == end:
+                return index.locate_all(column, begin)
+            return index.locate_range(begin, end, column)
 
     
     """
@@ -146,38 +444,52 @@ class Query:
     # Returns False if no records exist with given key or if the target record cannot be accessed due to 2PL locking
     """
     def update(self, primary_key, *columns):
-        rid = self.table.index.locate(self.table.key, primary_key)
-        if rid is None or rid not in self.table.page_directory:
+        new_primary_key = columns[self.table.key]
+        transaction = self.optimistic_transaction()
+        if transaction is not None:
+            found = self.optimistic_search(transaction, primary_key, primary_key, self.table.key)
+            if not found:
+                return False
+            row = [value if value is not None else old for value, old in zip(columns, found[0][1])]
+            rows = {primary_key: row}
+            if new_primary_key is not None and new_primary_key != primary_key:
+                if self.optimistic_search(transaction, new_primary_key, new_primary_key, self.table.key):
+                    return False
+                rows = {primary_key: None, new_primary_key: row}
+            transaction.add_write(self.table, rows, self.update, primary_key, *columns)
+            return True
+        if self.outside_transaction():
+            return self.autocommit(self.update, primary_key, *columns)
+
+        if new_primary_key is not None and new_primary_key != primary_key:
+            # the new key is locked too, nobody else may insert it meanwhile
+            locked = self.lock(INTENTION_EXCLUSIVE, EXCLUSIVE, primary_key, new_primary_key)
+        else:
+            locked = self.lock(INTENTION_EXCLUSIVE, EXCLUSIVE, primary_key)
+        if not locked:
             return False
         
-        if columns[self.table.key] is not None:
-            new_primary_key = columns[self.table.key]
-            if new_primary_key != primary_key:  # Only check if actually changing the key
+        with self.table.latch:
+            rid = self.table.index.locate(self.table.key, primary_key)
+            if rid is None or rid not in self.table.page_directory:
+                return False
+
+            if new_primary_key is not None and new_primary_key != primary_key:  # Only check if actually changing the key
                 existing_rid = self.table.index.locate(self.table.key, new_primary_key)
                 if existing_rid is not None:
                     return False
         
-        old_locations = self.table.page_directory[rid]
-        tail_locations = [None] * self.table.num_columns
-        for col_idx, new_value in enumerate(columns):
-            if new_value is not None:
-                page_idx, slot_idx = old_locations[col_idx]
-                old_value = self.table.read_column(col_idx, page_idx, slot_idx)
-                tail_page = self.table.tail_page[col_idx][-1]
-                if not tail_page.has_capacity():
-                    new_tail = Page()
-                    self.table.tail_page[col_idx].append(new_tail)
-                    tail_page = new_tail
-                tail_page.write(old_value)
-                tail_page_idx = len(self.table.tail_page[col_idx]) - 1
-                tail_slot_idx = tail_page.num_records - 1
-                tail_locations[col_idx] = (tail_page_idx, tail_slot_idx)
-                offset = slot_idx * 8
-                page = self.table.base_page[col_idx][page_idx]
-                page.data[offset:offset + 8] = new_value.to_bytes(8, byteorder='little', signed=True)
-        if rid not in self.table.version_chain:
-            self.table.version_chain[rid] = []
-        self.table.version_chain[rid].insert(0, tail_locations) 
+            directory = self.table.page_directory
+            tail_rid, schema_encoding = directory.indirection[rid], directory.schema_encoding[rid]
+            transaction = current_transaction()
+            if transaction is not None:
+                transaction.track_tail(self.table)
+            old_values = self.table.update_row(rid, columns)
+            for col_idx, new_value in enumerate(columns):
+                if new_value is not None:
+                    self.table.index.update(col_idx, old_values[col_idx], new_value, rid)
+            self.add_undo(self.table.undo_update, rid, tail_rid, schema_encoding, columns, old_values)
+            self.log(OP_UPDATE, primary_key, *columns)
         
         return True
 
@@ -195,57 +507,28 @@ class Query:
     # Returns False if no record exists in the given range
     """
     def sum_version(self, start_range, end_range, aggregate_column_index, relative_version):
-        output = 0
-        found = False
-        rid_list = self.table.index.locate_range(start_range, end_range, self.table.key)
-        for rid in rid_list:
-            if rid not in self.table.page_directory:
-                continue
-            value = None
-            if relative_version == 0:
-                page_index, record_offset = self.table.page_directory[rid][aggregate_column_index]
-                value = self.table.read_column(aggregate_column_index, page_index, record_offset)
-            else:
-                version_idx = -relative_version - 1
-                if rid in self.table.version_chain and version_idx < len(self.table.version_chain[rid]):
-                    tail_locations = self.table.version_chain[rid][version_idx]
-                    if tail_locations[aggregate_column_index] is not None:
-                        page_index, record_offset = tail_locations[aggregate_column_index]
-                        page = self.table.tail_page[aggregate_column_index][page_index]
-                        value = page.read(record_offset)
-                    else:
-                        value_found = False
-                        for older_idx in range(version_idx + 1, len(self.table.version_chain[rid])):
-                            older_tail = self.table.version_chain[rid][older_idx]
-                            if older_tail[aggregate_column_index] is not None:
-                                page_index, record_offset = older_tail[aggregate_column_index]
-                                page = self.table.tail_page[aggregate_column_index][page_index]
-                                value = page.read(record_offset)
-                                value_found = True
-                                break
-                        if not value_found:
-                            page_index, record_offset = self.table.page_directory[rid][aggregate_column_index]
-                            value = self.table.read_column(aggregate_column_index, page_index, record_offset)
-                else:
-                    if rid in self.table.version_chain and len(self.table.version_chain[rid]) > 0:
-                        oldest_tail = self.table.version_chain[rid][-1]
-                        if oldest_tail[aggregate_column_index] is not None:
-                            page_index, record_offset = oldest_tail[aggregate_column_index]
-                            page = self.table.tail_page[aggregate_column_index][page_index]
-                            value = page.read(record_offset)
-                        else:
-                            page_index, record_offset = self.table.page_directory[rid][aggregate_column_index]
-                            value = self.table.read_column(aggregate_column_index, page_index, record_offset)
-                    else:
-                        page_index, record_offset = self.table.page_directory[rid][aggregate_column_index]
-                        value = self.table.read_column(aggregate_column_index, page_index, record_offset)
-            if value is not None:
-                output += value
-                found = True
-        
-        return output if found else False
+        transaction = self.optimistic_transaction()
+        if transaction is not None:
+            found = self.optimistic_search(transaction, start_range, end_range, self.table.key, relative_version)
+            if not found:
+                return False
+            return sum(row[aggregate_column_index] for rid, row in found)
 
+        timestamp = self.snapshot_timestamp()
+        if timestamp is not None:
+            rid_list, versions = self.snapshot_search(start_range, end_range, self.table.key, timestamp, relative_version)
+            if not rid_list:
+                return False
+            return self.table.sum_column(rid_list, aggregate_column_index, versions=versions)
 
+        # a range is locked as a whole, so no record can be inserted into it meanwhile
+        if not self.lock(SHARED):
+            return False
+        rid_list = [rid for rid in self.index_range_rids(start_range, end_range, self.table.key)
+                    if rid in self.table.page_directory]
+        if not rid_list:
+            return False
+        return self.table.sum_column(rid_list, aggregate_column_index, relative_version)
 
     
     """
@@ -257,10 +540,16 @@ class Query:
     # Returns False if no record matches key or if target record is locked by 2PL.
     """
     def increment(self, key, column):
-        r = self.select(key, self.table.key, [1] * self.table.num_columns)[0]
-        if r is not False:
+        if self.outside_transaction():
+            return self.autocommit(self.increment, key, column)
+        # locked for writing up front, upgrading the select's shared lock could deadlock
+        if not self.lock(INTENTION_EXCLUSIVE, EXCLUSIVE, key):
+            return False
+        # the exclusive lock keeps other writers of the record away until the update is made
+        records = self.select(key, self.table.key, [1] * self.table.num_columns)
+        if records:
             updated_columns = [None] * self.table.num_columns
-            updated_columns[column] = r[column] + 1
+            updated_columns[column] = records[0].columns[column] + 1
             u = self.update(key, *updated_columns)
             return u
         return False
@@ -275,17 +564,42 @@ class Query:
     """
     
     def sum(self, start_range, end_range, aggregate_column_index):
-        output = 0
-        found = False
-        rid_list = self.table.index.locate_range(start_range, end_range, self.table.key)
-        for rid in rid_list:
-            if rid in self.table.page_directory:
-                page_index, record_offset = self.table.page_directory[rid][aggregate_column_index]
-                value = self.table.read_column(aggregate_column_index, page_index, record_offset)
-                output += value
-                found = True
-
-        if not found:
+        return self.sum_version(start_range, end_range, aggregate_column_index, 0)
+
+    
+    """
+    :param start_range: int         # Start of the range of search column values to aggregate
+    :param end_range: int           # End of the range of search column values to aggregate
+    :param search_key_index: int    # Index of the column to filter on, any column
+    :param aggregate_column_index: int  # Index of desired column to aggregate
+    # Returns the summation of the aggregate column over matching records upon success
+    # Returns False if no record matches
+    """
+    def sum_where(self, start_range, end_range, search_key_index, aggregate_column_index):
+        transaction = self.optimistic_transaction()
+        if transaction is not None:
+            found = self.optimistic_search(transaction, start_range, end_range, search_key_index)
+            if not found:
+                return False
+            return sum(row[aggregate_column_index] for rid, row in found)
+
+        timestamp = self.snapshot_timestamp()
+        if timestamp is not None:
+            rid_list, versions = self.snapshot_search(start_range, end_range, search_key_index, timestamp)
+            if not rid_list:
+                return False
+            return self.table.sum_column(rid_list, aggregate_column_index, versions=versions)
+
+        if not self.lock(SHARED):
             return False
-        
-        return output
+        rid_list = self.index_range_rids(start_range, end_range, search_key_index)
+        if rid_list is None:
+            scan = self.table.scan_column(search_key_index, start_range, end_range)
+            if aggregate_column_index == search_key_index:
+                # the scan already decoded the values to aggregate
+                values = scan.values()
+                return sum(values) if values else False
+            rid_list = scan.rids()
+        if not rid_list:
+            return False
+        return self.table.sum_column(rid_list, aggregate_column_index)
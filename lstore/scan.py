@@ -0,0 +1,71 @@
+from lstore.page import RECORDS_PER_PAGE
+
+
+class ColumnScan:
+
+    """
+    # Sequential scan over the base pages of one column, touching no other column's pages
+    # except the tail pages holding updated values.
+    # Slot s of base page p belongs to RID p * RECORDS_PER_PAGE + s + 1 (see Table), pages are
+    # decoded whole, values of updated records are replaced by their latest values, from the
+    # merged copy of the page when they were merged and from tail pages otherwise, and deleted
+    # records are skipped.
+    # The predicate is an inclusive range, begin == end for equality and None for an open bound.
+    """
+    def __init__(self, table, col_idx, begin=None, end=None):
+        self.table = table
+        self.col_idx = col_idx
+        self.begin = begin
+        self.end = end
+
+    def matches(self, value):
+        return ((self.begin is None or value >= self.begin)
+                and (self.end is None or value <= self.end))
+
+    def __iter__(self):
+        """Yields (rid, value) for every live record whose latest value matches the predicate, in RID order"""
+        table = self.table
+        directory = table.page_directory
+        bit = 1 << self.col_idx
+        for page_idx in range(table.num_base_pages[self.col_idx]):
+            values = list(table.read_page_values('base', self.col_idx, page_idx))
+            merged = directory.merged_page(page_idx)
+            merged_values = ()
+            merged_tail_rid = 0
+            if merged is not None:
+                merged_values = table.read_page_values('merged', self.col_idx, merged[0])
+                merged_tail_rid = merged[1]
+            first_rid = page_idx * RECORDS_PER_PAGE + 1
+            live = []
+            updated = []
+            positions = []
+            for slot in range(len(values)):
+                rid = first_rid + slot
+                if rid in directory:
+                    live.append(slot)
+                    # checked again with the indirection it goes with, an update may run meanwhile
+                    if directory.schema_encoding[rid] & bit:
+                        tail_rid, schema_encoding = directory.latest(rid)
+                        if not schema_encoding & bit:
+                            continue
+                        if tail_rid > merged_tail_rid:
+                            updated.append(slot)
+                            positions.append(table.record_position(tail_rid))
+                        else:
+                            values[slot] = merged_values[slot]
+            if updated:
+                for slot, value in zip(updated, table.read_values('tail', self.col_idx, positions)):
+                    values[slot] = value
+            
+            if self.begin is not None and self.begin == self.end:
+                matching = [slot for slot in live if values[slot] == self.begin]
+            else:
+                matching = [slot for slot in live if self.matches(values[slot])]
+            for slot in matching:
+                yield first_rid + slot, values[slot]
+
+    def rids(self):
+        return [rid for rid, value in self]
+
+    def values(self):
+        return [value for rid, value in self]
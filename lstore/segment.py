@@ -0,0 +1,190 @@
+from lstore.page import Page
+import mmap
+import os
+import struct
+
+SEGMENT_MAGIC = b'LSEG'
+SEGMENT_VERSION = 1
+PAGE_SIZE = 4096
+
+# magic, version, page size, page count
+HEADER = struct.Struct('<4siii')
+# num_records, padded so page data stays 8 byte aligned
+PAGE_HEADER = struct.Struct('<ixxxx')
+SLOT_SIZE = PAGE_HEADER.size + PAGE_SIZE
+
+
+class Segment:
+
+    """
+    # All pages of one base or tail column stored in a single file.
+    # Layout: header, then one fixed size slot per page (num_records followed by the page image),
+    # so page i starts at HEADER.size + i * SLOT_SIZE and the page count in the header is the offset table.
+    # With use_mmap pages are read as read-only memoryview slices over a shared mapping of the file.
+    """
+    def __init__(self, path, use_mmap=False):
+        self.path = path
+        self.use_mmap = use_mmap
+        self.mmap = None
+        # set by every write, cleared once sync made them durable
+        self.unsynced = False
+        if os.path.exists(path):
+            self.file = open(path, 'r+b')
+            magic, version, page_size, page_count = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or page_size != PAGE_SIZE:
+                self.file.close()
+                raise ValueError(f'{path} is not a version {SEGMENT_VERSION} segment file')
+            self.page_count = page_count
+        else:
+            directory = os.path.dirname(path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.file = open(path, 'w+b')
+            self.page_count = 0
+            self.write_header()
+
+    def write_header(self):
+        self.unsynced = True
+        self.file.seek(0)
+        self.file.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, PAGE_SIZE, self.page_count))
+
+    def read_page(self, page_idx):
+        page = Page()
+        if page_idx >= self.page_count:
+            return page
+        if self.use_mmap:
+            return self.map_page(page_idx)
+        self.file.seek(HEADER.size + page_idx * SLOT_SIZE)
+        page.num_records = PAGE_HEADER.unpack(self.file.read(PAGE_HEADER.size))[0]
+        self.file.readinto(page.data)
+        return page
+
+    def map_page(self, page_idx):
+        """Page whose data is a zero-copy view of the mapped file, copied on its first write"""
+        offset = HEADER.size + page_idx * SLOT_SIZE
+        if self.mmap is None or len(self.mmap) < offset + SLOT_SIZE:
+            # the file grew since it was mapped, views handed out earlier keep the old mapping alive
+            self.file.flush()
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        page = Page()
+        page.num_records = PAGE_HEADER.unpack_from(self.mmap, offset)[0]
+        page.data = memoryview(self.mmap)[offset + PAGE_HEADER.size:offset + SLOT_SIZE]
+        return page
+
+    def write_page(self, page_idx, page):
+        self.unsynced = True
+        self.file.seek(HEADER.size + page_idx * SLOT_SIZE)
+        self.file.write(PAGE_HEADER.pack(page.num_records))
+        self.file.write(page.data)
+        if page_idx >= self.page_count:
+            self.page_count = page_idx + 1
+            self.write_header()
+        if self.mmap is not None:
+            # keep the mapping in sync with what was just written
+            self.file.flush()
+
+    def read_pages(self):
+        """Read every page of the segment with a single readinto"""
+        buffer = bytearray(self.page_count * SLOT_SIZE)
+        self.file.seek(HEADER.size)
+        self.file.readinto(buffer)
+        pages = []
+        for page_idx in range(self.page_count):
+            offset = page_idx * SLOT_SIZE
+            page = Page()
+            page.num_records = PAGE_HEADER.unpack_from(buffer, offset)[0]
+            page.data = buffer[offset + PAGE_HEADER.size:offset + SLOT_SIZE]
+            pages.append(page)
+        return pages
+
+    def write_pages(self, pages):
+        """Replace the contents of the segment with pages using one sequential write"""
+        buffer = bytearray(HEADER.size + len(pages) * SLOT_SIZE)
+        HEADER.pack_into(buffer, 0, SEGMENT_MAGIC, SEGMENT_VERSION, PAGE_SIZE, len(pages))
+        for page_idx, page in enumerate(pages):
+            offset = HEADER.size + page_idx * SLOT_SIZE
+            PAGE_HEADER.pack_into(buffer, offset, page.num_records)
+            buffer[offset + PAGE_HEADER.size:offset + SLOT_SIZE] = page.data
+        self.unsynced = True
+        self.file.seek(0)
+        self.file.write(buffer)
+        self.file.truncate()
+        self.page_count = len(pages)
+
+    def truncate(self, num_pages):
+        """Drop pages past num_pages"""
+        if num_pages < self.page_count:
+            self.mmap = None
+            self.page_count = num_pages
+            self.file.truncate(HEADER.size + num_pages * SLOT_SIZE)
+            self.write_header()
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        """Flush and fsync the file if it was written since the last sync"""
+        if self.unsynced:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = False
+
+    def close(self):
+        # the mapping is released once the last page view into it is gone
+        self.mmap = None
+        self.file.close()
+
+
+def convert_legacy_pages(directory, segment_path):
+    """
+    # Convert a column directory in the old one-file-per-page layout (page_{idx}.dat holding
+    # num_records followed by the page image) into a segment file, then remove the directory.
+    """
+    page_files = []
+    for f in os.listdir(directory):
+        if f.startswith('page_') and f.endswith('.dat'):
+            page_files.append((int(f[len('page_'):-len('.dat')]), f))
+    page_files.sort()
+
+    pages = []
+    for page_idx, page_file in page_files:
+        page = Page()
+        with open(os.path.join(directory, page_file), 'rb') as f:
+            page.num_records = struct.unpack('i', f.read(4))[0]
+            page.data = bytearray(f.read(PAGE_SIZE))
+        pages.append(page)
+
+    segment = Segment(segment_path)
+    segment.write_pages(pages)
+    segment.sync()
+    segment.close()
+    # the page files are only removed once the segment replacing them is durable
+    sync_directory(os.path.dirname(segment_path))
+
+    for page_idx, page_file in page_files:
+        os.remove(os.path.join(directory, page_file))
+    if not os.listdir(directory):
+        os.rmdir(directory)
+
+
+def sync_directory(path):
+    """fsync a directory, making the files created, replaced or removed in it durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_file(path, write):
+    """
+    # Replace the file at path by what write(f) writes: written to a temporary file and fsynced
+    # first, so a crash leaves either the old or the new file, never a torn one.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    sync_directory(os.path.dirname(path))
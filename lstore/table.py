@@ -1,15 +1,31 @@
-from lstore.index import Index
-from time import time
-from lstore.page import Page
+from lstore.index import Index, HASH_INDEX
+from time import perf_counter
+from lstore.page import RECORDS_PER_PAGE
+from lstore.bufferpool import BufferPool
+from lstore.scan import ColumnScan
+from lstore.page_directory import PageDirectory
+from lstore.merge import MergeStats, MergeWorker, MERGE_THRESHOLD
+from lstore.version_cache import VersionCache
+from lstore.tail_pages import TailPages
+from lstore.lock_manager import LockManager, current_transaction
+from lstore.clock import clock, UNCOMMITTED
+import threading
 
 INDIRECTION_COLUMN = 0
 RID_COLUMN = 1
 TIMESTAMP_COLUMN = 2
 SCHEMA_ENCODING_COLUMN = 3
+METADATA_COLUMNS = 4
+# indirection of the oldest tail record kept of a record whose older versions were dropped, see trim_versions
+CHAIN_CUT = -1
+# records whose update or delete times are kept before the ones no snapshot needs are dropped
+CHANGE_LOG_SIZE = 4096
 
 
 class Record:
 
+    __slots__ = ('rid', 'key', 'columns')
+
     def __init__(self, rid, key, columns):
         self.rid = rid
         self.key = key
@@ -21,46 +37,674 @@ class Table:
     :param name: string         #Table name
     :param num_columns: int     #Number of Columns: all columns are integer
     :param key: int             #Index of table key in columns
+    :param bufferpool: BufferPool   #Pool the table's pages are fetched through (private pool if None)
+    :param wal: WriteAheadLog       #Log the table's queries are recorded in (not logged if None)
+    :param lock_manager: LockManager    #Locks taken by transactions on the table (private lock manager if None)
+    :param merge_threshold: int     #Full tail pages waiting before a background merge starts (never merged in the background if None)
+    :param version_retention: int   #Versions of a record kept once merged, counting the latest (all if None), see trim_versions
+    # Records are stored as in L-Store: base records are written once on insert, an update appends
+    # a tail record and points the base record's indirection at it. Every record carries the user
+    # columns followed by the metadata columns (INDIRECTION_COLUMN etc. count from num_columns).
+    # A tail record holds every column updated so far (bits of its schema encoding, the others aren't written)
+    # and its indirection is the previous tail record of the same base record, 0 for none.
+    # Base and tail records are numbered from 1 and record n sits at slot (n - 1) % RECORDS_PER_PAGE
+    # of page (n - 1) // RECORDS_PER_PAGE in every column.
+    # Tail records are merged in the background into copies of the base pages, see merge.
+    # Tail page n is stored wherever tail_pages maps it, so pages of dropped versions can be reused.
+    # Records are stamped by the shared clock, so older versions can also be read as of a
+    # snapshot timestamp, see snapshot_versions.
     """
-    def __init__(self, name, num_columns, key):
+    def __init__(self, name, num_columns, key, bufferpool=None, wal=None, lock_manager=None, merge_threshold=MERGE_THRESHOLD,
+                 version_retention=None):
         self.name = name
         self.key = key
         self.num_columns = num_columns
-        self.page_directory = {}
+        self.total_columns = num_columns + METADATA_COLUMNS
+        self.page_directory = PageDirectory()
         self.index = Index(self)
-        self.base_page = [[Page()] for _ in range(num_columns)]
-        self.tail_page = [[Page()] for _ in range(num_columns)]
+        self.bufferpool = bufferpool if bufferpool is not None else BufferPool()
+        self.wal = wal
+        self.lock_manager = lock_manager if lock_manager is not None else LockManager()
+        # number of pages in each column, the pages themselves live in the buffer pool
+        self.num_base_pages = [0] * self.total_columns
+        self.num_tail_pages = [0] * self.total_columns
         self.rid_counter = 0
-        self.version_chain = {}
+        self.tail_rid_counter = 0
+        self.tail_pages = TailPages()
+        self.bufferpool.tail_pages[name] = self.tail_pages
+        # rids whose page directory entry changed since the last checkpoint, written out as deltas by Database.checkpoint
+        self.directory_changes = set()
+        self.needs_full_checkpoint = True
+        self.delta_entries = 0
+        
+        self.merge_threshold = merge_threshold
+        if version_retention is not None and version_retention < 1:
+            raise ValueError('version_retention must keep at least the latest version')
+        self.version_retention = version_retention
+        self.version_cache = VersionCache()
+        self.merge_worker = None
+        self.merge_stats = MergeStats()
+        # held for a whole merge, Database.checkpoint takes it so merged pages are written before the directory
+        self.merge_lock = threading.Lock()
+        # held by queries while they change the table (directory, indexes, tail records) so writes
+        # don't interleave; reads don't take it, see Query
+        self.latch = threading.RLock()
+        # transaction id -> first tail rid of running transactions that updated the table
+        self.active_tail_rids = {}
+        # rid -> timestamp of its last update or delete, entries older than every snapshot are dropped
+        self.changed_at = {}
+        self.change_log_limit = CHANGE_LOG_SIZE
 
+        self.create_key_index()
+
+    def create_key_index(self):
+        """Index the primary key with a B+ tree for ranges and a hash index for point lookups"""
         self.index.create_index(self.key)
+        self.index.create_index(self.key, HASH_INDEX)
+
+    def metadata_column(self, column):
+        """Column index a metadata column (INDIRECTION_COLUMN etc.) is stored under"""
+        return self.num_columns + column
+
+    def record_position(self, record_id):
+        """(page_idx, slot_idx) of a base record given its rid, or of a tail record given its tail rid"""
+        return divmod(record_id - 1, RECORDS_PER_PAGE)
 
     def insert_row(self, columns):
         rid = self.rid_counter + 1
         self.rid_counter += 1
-        page_positions = [None] * self.num_columns
-   
-        for i, value in enumerate(columns):
-            current_page = self.base_page[i][-1]
-            if not current_page.has_capacity():
-                new_page = Page()
-                self.base_page[i].append(new_page)
-                current_page = new_page
-            current_page.write(value)
-            page_index = len(self.base_page[i])-1
-            record_offset = self.base_page[i][-1].num_records - 1
-            page_positions[i] = (page_index, record_offset)
+        # indirection and schema encoding start out 0, the live values are kept in the page directory
+        self.write_record('base', rid, list(columns) + [None, rid, self.new_timestamp('base', rid), None])
             
-        self.page_directory[rid] = page_positions
-        primary_key_value = columns[self.key]
-        self.index.insert(self.key, primary_key_value, rid)
+        self.page_directory[rid] = self.record_position(rid)
+        self.directory_changes.add(rid)
+        for col_idx in self.index.indexed_columns():
+            self.index.insert(col_idx, columns[col_idx], rid)
         return rid
+
+    def insert_rows(self, rows):
+        """Insert a list of rows, returns their rids"""
+        return self.insert_columns([list(column) for column in zip(*rows)])
+
+    def insert_columns(self, columns):
+        """Insert a columnar batch (one list of values per column), returns the rids of the new records"""
+        num_rows = len(columns[0])
+        first_rid = self.rid_counter + 1
+        self.rid_counter += num_rows
+        rids = list(range(first_rid, first_rid + num_rows))
+        
+        metadata = [[0] * num_rows, rids, [self.new_timestamp('base', first_rid, num_rows)] * num_rows, [0] * num_rows]
+        for col_idx, values in enumerate(list(columns) + metadata):
+            self.write_values('base', col_idx, first_rid, values)
+        
+        for rid in rids:
+            self.page_directory[rid] = self.record_position(rid)
+        self.directory_changes.update(rids)
+        for col_idx in self.index.indexed_columns():
+            self.index.insert_many(col_idx, columns[col_idx], rids)
+        return rids
+
+    def update_row(self, rid, columns):
+        """
+        # Append a tail record with the non-None values of columns and make it the record's latest version.
+        # Returns the previous values of the updated columns (None for the others)
+        """
+        indirection = self.page_directory.indirection[rid]
+        schema_encoding = self.page_directory.schema_encoding[rid]
+        
+        # carry over the columns updated before so the latest version is always one tail record away,
+        # read together with the base values the update replaces under one pool lock
+        carried = [col_idx for col_idx in range(self.num_columns) if schema_encoding >> col_idx & 1] if indirection else []
+        replaced = [col_idx for col_idx, value in enumerate(columns) if value is not None and not schema_encoding >> col_idx & 1]
+        tail_page, tail_slot = self.record_position(indirection)
+        base_page, base_slot = self.record_position(rid)
+        values = self.bufferpool.read_slots(
+            [((self.name, 'tail', col_idx, tail_page), tail_slot) for col_idx in carried]
+            + [((self.name, 'base', col_idx, base_page), base_slot) for col_idx in replaced])
+        tail_values = [None] * self.num_columns
+        for col_idx, value in zip(carried, values):
+            tail_values[col_idx] = value
+        old_values = [None] * self.num_columns
+        for col_idx, value in zip(replaced, values[len(carried):]):
+            old_values[col_idx] = value
+        
+        new_schema_encoding = schema_encoding
+        for col_idx, value in enumerate(columns):
+            if value is not None:
+                if schema_encoding >> col_idx & 1:
+                    old_values[col_idx] = tail_values[col_idx]
+                tail_values[col_idx] = value
+                new_schema_encoding |= 1 << col_idx
+        
+        tail_rid = self.tail_rid_counter + 1
+        # also the time of the change, see note_change
+        timestamp = self.new_timestamp('tail', tail_rid, changed_rid=rid)
+        self.write_record('tail', tail_rid, tail_values + [indirection, rid, timestamp, new_schema_encoding])
+        self.tail_pages.live[(tail_rid - 1) // RECORDS_PER_PAGE] += 1
         
-    def read_column(self,col_idx, page_idx, slot_idx):
-        page = self.base_page[col_idx] [page_idx]
-        return page.read(slot_idx)
+        self.page_directory.set_latest(rid, tail_rid, new_schema_encoding)
+        self.version_cache.invalidate(rid)
+        # counted only once written, merge relies on every tail record up to tail_rid_counter being complete
+        self.tail_rid_counter = tail_rid
+        self.directory_changes.add(rid)
+        self.note_change(rid, timestamp)
         
+        if (self.merge_threshold is not None
+                and tail_rid - self.page_directory.merged_tail_rid >= self.merge_threshold * RECORDS_PER_PAGE):
+            if self.merge_worker is None:
+                self.merge_worker = MergeWorker(self)
+            self.merge_worker.request()
+        return old_values
+
+    def delete_row(self, rid):
+        # noted before the record leaves the indexes, snapshot lookups not finding it there then
+        # find it through changed_since
+        self.note_change(rid, self.new_timestamp('changed', rid))
+        indexed_columns = self.index.indexed_columns()
+        values = self.read_rows([rid], indexed_columns)[0]
+        for col_idx, value in zip(indexed_columns, values):
+            self.index.delete(col_idx, value, rid)
+        del self.page_directory[rid]
+        self.directory_changes.add(rid)
+
+    def new_timestamp(self, kind, first_id, count=1, changed_rid=None):
+        """
+        # Timestamp of count new base or tail records from first_id on, or of a change of rid first_id
+        # ('changed', see note_change). Inside a transaction that's UNCOMMITTED until it commits,
+        # see Clock.commit. changed_rid also stamps a change of that rid with the same timestamp.
+        """
+        transaction = current_transaction()
+        if transaction is None:
+            return clock.tick()
+        transaction.stamps.append((self, kind, first_id, count))
+        if changed_rid is not None:
+            transaction.stamps.append((self, 'changed', changed_rid, 1))
+        return UNCOMMITTED
+
+    def stamp(self, kind, first_id, count, timestamp):
+        """Overwrite the timestamps given out by new_timestamp, call holding the latch"""
+        if kind == 'changed':
+            if first_id in self.changed_at:
+                self.changed_at[first_id] = timestamp
+        else:
+            self.write_values(kind, self.metadata_column(TIMESTAMP_COLUMN), first_id, [timestamp] * count)
+
+    def note_change(self, rid, timestamp):
+        """
+        # Remember when a record was last updated or deleted: snapshots older than that may have to
+        # find it by values it's no longer indexed under, or read it although it's deleted now.
+        """
+        self.changed_at[rid] = timestamp
+        if len(self.changed_at) > self.change_log_limit:
+            horizon = clock.horizon()
+            self.changed_at = {rid: timestamp for rid, timestamp in self.changed_at.items() if timestamp > horizon}
+            self.change_log_limit = max(CHANGE_LOG_SIZE, 2 * len(self.changed_at))
+
+    def changed_since(self, timestamp):
+        """Rids updated or deleted after timestamp, read from a copy as writers may add to the log meanwhile"""
+        return [rid for rid, changed in self.changed_at.copy().items() if changed > timestamp]
+
+    def undo_update(self, rid, tail_rid, schema_encoding, columns, old_values):
+        """
+        # Make the tail record that was latest before an update the latest again and restore the
+        # indexes. The update's tail record stays behind, unreachable.
+        """
+        undone = self.page_directory.indirection[rid]
+        self.tail_pages.live[(undone - 1) // RECORDS_PER_PAGE] -= 1
+        self.page_directory.set_latest(rid, tail_rid, schema_encoding)
+        self.version_cache.invalidate(rid)
+        self.directory_changes.add(rid)
+        for col_idx, value in enumerate(columns):
+            if value is not None:
+                self.index.update(col_idx, value, old_values[col_idx], rid)
+
+    def undelete_row(self, rid, position, tail_rid, schema_encoding):
+        """Bring back a deleted record as it was before the delete"""
+        self.page_directory[rid] = position
+        self.page_directory.set_latest(rid, tail_rid, schema_encoding)
+        self.directory_changes.add(rid)
+        indexed_columns = self.index.indexed_columns()
+        values = self.read_rows([rid], indexed_columns)[0]
+        for col_idx, value in zip(indexed_columns, values):
+            self.index.insert(col_idx, value, rid)
+
+    def version_tail(self, rid, relative_version=0):
+        """
+        # Tail rid and schema encoding of the given relative version of a record, (0, 0) if that
+        # version is the base record. Versions older than the oldest one resolve to the base record, or
+        # to the oldest one kept if older ones were dropped (see trim_versions).
+        # Older versions come from the record's cached chain, extended as far as needed.
+        """
+        tail_rid, schema_encoding = self.page_directory.latest(rid)
+        steps = -relative_version
+        if steps <= 0 or tail_rid == 0:
+            return tail_rid, schema_encoding
+        
+        chain = self.version_cache.get(rid, tail_rid)
+        if chain is None:
+            chain = [(tail_rid, schema_encoding)]
+        if len(chain) <= steps and chain[-1][0] > 0:
+            while len(chain) <= steps and chain[-1][0] > 0:
+                page_idx, slot_idx = self.record_position(chain[-1][0])
+                tail_rid = self.read_tail(self.metadata_column(INDIRECTION_COLUMN), page_idx, slot_idx)
+                schema_encoding = 0
+                if tail_rid > 0:
+                    page_idx, slot_idx = self.record_position(tail_rid)
+                    schema_encoding = self.read_tail(self.metadata_column(SCHEMA_ENCODING_COLUMN), page_idx, slot_idx)
+                # a cut chain ends in (CHAIN_CUT, 0), which is never returned
+                chain.append((tail_rid, schema_encoding))
+            self.version_cache.put(rid, chain[0][0], chain)
+        oldest = len(chain) - 2 if chain[-1][0] == CHAIN_CUT else len(chain) - 1
+        return chain[min(steps, oldest)]
+
+    def snapshot_versions(self, rids, timestamp, relative_version=0):
+        """
+        # The rids whose records existed at timestamp, and for each the tail rid and schema encoding of
+        # its newest version written at or before timestamp (relative_version versions older than that),
+        # as version_tail returns them.
+        # Deleted records count until their delete.
+        # Needs no latch: base records and linked tail records never change, and an update links its
+        # tail record only once it's written.
+        """
+        directory = self.page_directory
+        timestamp_column = self.metadata_column(TIMESTAMP_COLUMN)
+        indirection_column = self.metadata_column(INDIRECTION_COLUMN)
+        base_timestamps = self.read_values('base', timestamp_column, [self.record_position(rid) for rid in rids])
+        visible = []
+        versions = []
+        for rid, base_timestamp in zip(rids, base_timestamps):
+            if base_timestamp > timestamp:
+                continue
+            if rid not in directory:
+                deleted = self.changed_at.get(rid)
+                if deleted is None or deleted <= timestamp:
+                    continue
+            tail_rid = directory.indirection[rid]
+            older = -relative_version
+            while tail_rid:
+                page_idx, slot_idx = self.record_position(tail_rid)
+                if self.read_tail(timestamp_column, page_idx, slot_idx) <= timestamp:
+                    if older == 0:
+                        break
+                    older -= 1
+                previous = self.read_tail(indirection_column, page_idx, slot_idx)
+                # older versions were dropped, the oldest one kept stands for them
+                if previous == CHAIN_CUT:
+                    break
+                tail_rid = previous
+            schema_encoding = 0
+            if tail_rid:
+                # the directory's schema encoding may already belong to a newer version
+                page_idx, slot_idx = self.record_position(tail_rid)
+                schema_encoding = self.read_tail(self.metadata_column(SCHEMA_ENCODING_COLUMN), page_idx, slot_idx)
+            visible.append(rid)
+            versions.append((tail_rid, schema_encoding))
+        return visible, versions
+
+    def value_location(self, rid, col_idx, tail_rid, schema_encoding):
+        """Where a column of the version found by version_tail is stored: ('base' | 'tail', (page_idx, slot_idx))"""
+        if schema_encoding >> col_idx & 1:
+            return ('tail', self.record_position(tail_rid))
+        # base records never move, deleted ones are still where they were
+        return ('base', self.record_position(rid))
+
+    def write_record(self, kind, record_id, values):
+        """Write the columns of a base or tail record, None values are skipped and read as 0"""
+        num_pages = self.num_base_pages if kind == 'base' else self.num_tail_pages
+        page_idx, slot_idx = self.record_position(record_id)
+        if kind == 'tail' and page_idx >= len(self.tail_pages):
+            self.new_tail_page()
+        writes = []
+        for col_idx, value in enumerate(values):
+            if value is None:
+                continue
+            page_id = (self.name, kind, col_idx, page_idx)
+            if page_idx >= num_pages[col_idx]:
+                self.bufferpool.new_page(page_id)
+                self.bufferpool.unpin_page(page_id, dirty=True)
+                num_pages[col_idx] = page_idx + 1
+            writes.append((page_id, slot_idx, value))
+        self.bufferpool.write_slots(writes)
+
+    def new_tail_page(self):
+        """
+        # Start the next tail page in every column, so none reads what a reclaimed page left in its slot.
+        # The frames of the reclaimed page whose slot it takes are dropped, and the cached chains:
+        # besides them only readers already walking a chain when it was cut could still reach it.
+        """
+        page_idx = len(self.tail_pages)
+        previous = self.tail_pages.allocate()
+        if previous is not None:
+            self.bufferpool.discard_pages([(self.name, 'tail', col_idx, previous) for col_idx in range(self.total_columns)])
+            self.version_cache.clear()
+        for col_idx in range(self.total_columns):
+            page_id = (self.name, 'tail', col_idx, page_idx)
+            self.bufferpool.new_page(page_id)
+            self.bufferpool.unpin_page(page_id, dirty=True)
+            self.num_tail_pages[col_idx] = page_idx + 1
+
+    def write_values(self, kind, col_idx, first_id, values):
+        """Write values of consecutive base or tail records, starting with record first_id, into a column"""
+        num_pages = self.num_base_pages if kind == 'base' else self.num_tail_pages
+        start = 0
+        while start < len(values):
+            page_idx, slot_idx = self.record_position(first_id + start)
+            page_id = (self.name, kind, col_idx, page_idx)
+            if page_idx < num_pages[col_idx]:
+                page = self.bufferpool.fetch_page(page_id)
+            else:
+                page = self.bufferpool.new_page(page_id)
+                num_pages[col_idx] = page_idx + 1
+            start += page.write_slots(slot_idx, values, start)
+            self.bufferpool.unpin_page(page_id, dirty=True)
+
+    def read_column(self, col_idx, page_idx, slot_idx):
+        page_id = (self.name, 'base', col_idx, page_idx)
+        page = self.bufferpool.fetch_page(page_id)
+        value = page.read(slot_idx)
+        self.bufferpool.unpin_page(page_id)
+        return value
+
+    def read_tail(self, col_idx, page_idx, slot_idx):
+        page_id = (self.name, 'tail', col_idx, page_idx)
+        page = self.bufferpool.fetch_page(page_id)
+        value = page.read(slot_idx)
+        self.bufferpool.unpin_page(page_id)
+        return value
+
+    def read_page_values(self, kind, col_idx, page_idx):
+        """All values written to a base or tail page, indexed by slot"""
+        page_id = (self.name, kind, col_idx, page_idx)
+        page = self.bufferpool.fetch_page(page_id)
+        values = page.read_all()
+        self.bufferpool.unpin_page(page_id)
+        return values
+
+    def read_values(self, kind, col_idx, positions):
+        """Values at a list of (page_idx, slot_idx) positions, in the same order, decoding each page once"""
+        page_values = {}
+        values = []
+        for page_idx, slot_idx in positions:
+            if page_idx not in page_values:
+                page_values[page_idx] = self.read_page_values(kind, col_idx, page_idx)
+            values.append(page_values[page_idx][slot_idx])
+        return values
+
+    def read_rows(self, rids, columns, relative_version=0, versions=None):
+        """
+        # Values of the given columns in a relative version of each record, one tuple per rid in column order.
+        # versions gives the (tail_rid, schema_encoding) of the version to read of each rid instead.
+        """
+        if versions is None:
+            versions = [self.version_tail(rid, relative_version) for rid in rids]
+        if len(rids) == 1:
+            # point lookups read every column under one pool lock, skipping the per-page bookkeeping
+            tail_rid, schema_encoding = versions[0]
+            base = divmod(rids[0] - 1, RECORDS_PER_PAGE)
+            tail = divmod(tail_rid - 1, RECORDS_PER_PAGE)
+            name = self.name
+            positions = [((name, 'tail', col_idx, tail[0]), tail[1]) if schema_encoding >> col_idx & 1
+                         else ((name, 'base', col_idx, base[0]), base[1]) for col_idx in columns]
+            return [tuple(self.bufferpool.read_slots(positions))]
+        
+        column_values = []
+        for col_idx in columns:
+            # (position in the batch, slot) grouped by page, so each page is pinned once and only
+            # while its slots are read, however many pages the batch spans
+            slots_by_page = {}
+            for i, (rid, (tail_rid, schema_encoding)) in enumerate(zip(rids, versions)):
+                kind, (page_idx, slot_idx) = self.value_location(rid, col_idx, tail_rid, schema_encoding)
+                slots = slots_by_page.get((kind, page_idx))
+                if slots is None:
+                    slots = slots_by_page[(kind, page_idx)] = []
+                slots.append((i, slot_idx))
+            values = [None] * len(rids)
+            for (kind, page_idx), slots in slots_by_page.items():
+                page_id = (self.name, kind, col_idx, page_idx)
+                page = self.bufferpool.fetch_page(page_id)
+                for i, slot_idx in slots:
+                    values[i] = page.read(slot_idx)
+                self.bufferpool.unpin_page(page_id)
+            column_values.append(values)
+        if len(column_values) == 1:
+            return [(value,) for value in column_values[0]]
+        return list(zip(*column_values))
+
+    def sum_column(self, rids, col_idx, relative_version=0, versions=None):
+        """
+        # Sum of a column over a relative version of each of the (live) rids, decoding each page once.
+        # Latest values already merged are read from the merged copy of their base page.
+        # versions gives the (tail_rid, schema_encoding) of the version to sum of each rid instead.
+        """
+        base_positions = []
+        merged_positions = []
+        tail_positions = []
+        directory = self.page_directory
+        latest = versions is None and relative_version == 0
+        for i, rid in enumerate(rids):
+            if versions is not None:
+                tail_rid, schema_encoding = versions[i]
+            elif relative_version == 0:
+                tail_rid, schema_encoding = directory.latest(rid)
+            else:
+                tail_rid, schema_encoding = self.version_tail(rid, relative_version)
+            if schema_encoding >> col_idx & 1:
+                if latest:
+                    page_idx, slot_idx = divmod(directory.positions[rid], RECORDS_PER_PAGE)
+                    merged = directory.merged_page(page_idx)
+                    if merged is not None and tail_rid <= merged[1]:
+                        merged_positions.append((merged[0], slot_idx))
+                        continue
+                tail_positions.append(divmod(tail_rid - 1, RECORDS_PER_PAGE))
+            else:
+                base_positions.append(divmod(directory.positions[rid], RECORDS_PER_PAGE))
+        return (self.sum_values('base', col_idx, base_positions)
+                + self.sum_values('merged', col_idx, merged_positions)
+                + self.sum_values('tail', col_idx, tail_positions))
+
+    def scan_column(self, col_idx, begin=None, end=None):
+        """Scan of the base pages of col_idx for values in [begin, end]"""
+        return ColumnScan(self, col_idx, begin, end)
+
+    def count_records(self, kind):
+        """Number of base or tail records ever written, live or not, going by the fullest column"""
+        num_pages = self.num_base_pages if kind == 'base' else self.num_tail_pages
+        count = 0
+        for col_idx in range(self.total_columns):
+            last_page = num_pages[col_idx] - 1
+            if last_page < 0:
+                continue
+            page_id = (self.name, kind, col_idx, last_page)
+            page = self.bufferpool.fetch_page(page_id)
+            count = max(count, last_page * RECORDS_PER_PAGE + page.num_records)
+            self.bufferpool.unpin_page(page_id)
+        return count
+
+    def sum_values(self, kind, col_idx, positions):
+        """Sum the values at a list of (page_idx, slot_idx) positions, decoding each page once"""
+        slots_by_page = {}
+        for page_idx, slot_idx in positions:
+            if page_idx not in slots_by_page:
+                slots_by_page[page_idx] = []
+            slots_by_page[page_idx].append(slot_idx)
+        
+        total = 0
+        for page_idx, slots in slots_by_page.items():
+            values = self.read_page_values(kind, col_idx, page_idx)
+            total += sum(map(values.__getitem__, slots))
+        return total
+
+    def write_column(self, col_idx, page_idx, slot_idx, value):
+        """Overwrite a value in a base page, only done when converting old tables"""
+        page_id = (self.name, 'base', col_idx, page_idx)
+        page = self.bufferpool.fetch_page(page_id)
+        page.update(slot_idx, value)
+        self.bufferpool.unpin_page(page_id, dirty=True)
 
     def merge(self):
-        pass
- 
\ No newline at end of file
+        """
+        # Fold the tail records of every full tail page not merged yet into new copies of the base
+        # pages they update, swapped in through the page directory once written.
+        # Base pages themselves are never rewritten, versions older than the latest still read the
+        # original values from them. Returns the number of base pages merged.
+        # With a version_retention the chains of the records merged are then cut, see trim_versions.
+        """
+        with self.merge_lock:
+            start = perf_counter()
+            directory = self.page_directory
+            first_tail_rid = directory.merged_tail_rid
+            last_tail_rid = self.tail_rid_counter // RECORDS_PER_PAGE * RECORDS_PER_PAGE
+            active = list(self.active_tail_rids.values())
+            if active:
+                # updates of running transactions may still be undone
+                last_tail_rid = min(last_tail_rid, (min(active) - 1) // RECORDS_PER_PAGE * RECORDS_PER_PAGE)
+            if last_tail_rid <= first_tail_rid:
+                return 0
+            
+            updated = set()
+            rid_column = self.metadata_column(RID_COLUMN)
+            for tail_page in range(first_tail_rid // RECORDS_PER_PAGE, last_tail_rid // RECORDS_PER_PAGE):
+                updated.update(self.read_page_values('tail', rid_column, tail_page))
+            base_pages = {self.record_position(rid)[0] for rid in updated}
+            
+            for page_idx in sorted(base_pages):
+                self.merge_page(page_idx, last_tail_rid)
+            directory.merged_tail_rid = last_tail_rid
+            if self.version_retention is not None:
+                self.trim_versions(updated, first_tail_rid, last_tail_rid)
+            # merged page entries aren't part of the directory deltas
+            self.needs_full_checkpoint = True
+            
+            self.merge_stats.merges += 1
+            self.merge_stats.pages_merged += len(base_pages)
+            self.merge_stats.tail_records_merged += last_tail_rid - first_tail_rid
+            self.merge_stats.merge_time += perf_counter() - start
+            return len(base_pages)
+
+    def merge_page(self, page_idx, last_tail_rid):
+        """
+        # Write a copy of a base page with the latest values as of tail record last_tail_rid and swap it in.
+        # Only slots of records updated by then are read from a copy, the others may be incomplete.
+        """
+        directory = self.page_directory
+        previous = directory.merged_page(page_idx)
+        columns = [list(self.read_page_values('base', col_idx, page_idx)) for col_idx in range(self.num_columns)]
+        num_records = max(len(values) for values in columns)
+        for values in columns:
+            values.extend([0] * (num_records - len(values)))
+        
+        merged_tail_rid = 0
+        if previous is not None:
+            merged_tail_rid = previous[1]
+            previous_columns = [self.read_page_values('merged', col_idx, previous[0]) for col_idx in range(self.num_columns)]
+        
+        indirection_column = self.metadata_column(INDIRECTION_COLUMN)
+        schema_column = self.metadata_column(SCHEMA_ENCODING_COLUMN)
+        first_rid = page_idx * RECORDS_PER_PAGE + 1
+        for slot_idx in range(num_records):
+            rid = first_rid + slot_idx
+            # deleted records are merged too, an aborted delete brings them back
+            if rid >= len(directory.indirection):
+                continue
+            # updates past last_tail_rid are left to the next merge
+            tail_rid = directory.indirection[rid]
+            while tail_rid > last_tail_rid:
+                tail_rid = self.read_tail(indirection_column, *self.record_position(tail_rid))
+            if tail_rid == 0:
+                continue
+            if tail_rid <= merged_tail_rid:
+                for col_idx, values in enumerate(columns):
+                    values[slot_idx] = previous_columns[col_idx][slot_idx]
+                continue
+            tail_page, tail_slot = self.record_position(tail_rid)
+            schema_encoding = self.read_tail(schema_column, tail_page, tail_slot)
+            for col_idx in range(self.num_columns):
+                if schema_encoding >> col_idx & 1:
+                    columns[col_idx][slot_idx] = self.read_tail(col_idx, tail_page, tail_slot)
+        
+        # two copies per base page used in turn, so the one readers may still be using isn't overwritten
+        merged_page_idx = 2 * page_idx
+        if previous is not None and previous[0] == merged_page_idx:
+            merged_page_idx += 1
+        for col_idx, values in enumerate(columns):
+            page_id = (self.name, 'merged', col_idx, merged_page_idx)
+            page = self.bufferpool.new_page(page_id)
+            page.write_slots(0, values)
+            self.bufferpool.unpin_page(page_id, dirty=True)
+        directory.set_merged_page(page_idx, merged_page_idx, last_tail_rid)
+
+    def trim_versions(self, rids, first_tail_rid, last_tail_rid):
+        """
+        # Cut the version chains of records merged up to last_tail_rid after version_retention versions,
+        # then reclaim the merged tail pages left with no reachable tail record (see TailPages).
+        # A chain is cut below its oldest version kept, which is merged, so merge_page never walks
+        # past it, and no newer than the clock's horizon, so every snapshot still finds its version.
+        # Readers stop at the CHAIN_CUT written into its indirection. Records not updated since
+        # their last merge keep their chains until they are. Called by merge.
+        """
+        horizon = clock.horizon()
+        live = self.tail_pages.live
+        name = self.name
+        indirection_column = self.metadata_column(INDIRECTION_COLUMN)
+        timestamp_column = self.metadata_column(TIMESTAMP_COLUMN)
+        # pages just merged may hold only updates that were undone
+        emptied = {page_idx for page_idx in range(first_tail_rid // RECORDS_PER_PAGE, last_tail_rid // RECORDS_PER_PAGE)
+                   if live[page_idx] == 0}
+        for rid in rids:
+            tail_rid = self.page_directory.latest(rid)[0]
+            versions = 0
+            while tail_rid > 0:
+                page_idx, slot_idx = self.record_position(tail_rid)
+                timestamp, previous = self.bufferpool.read_slots([((name, 'tail', timestamp_column, page_idx), slot_idx),
+                                                                  ((name, 'tail', indirection_column, page_idx), slot_idx)])
+                if timestamp != UNCOMMITTED:
+                    versions += 1
+                if versions >= self.version_retention and timestamp <= horizon and tail_rid <= last_tail_rid:
+                    break
+                tail_rid = previous
+            if tail_rid <= 0 or previous <= 0:
+                continue
+            self.bufferpool.write_slots([((name, 'tail', indirection_column, page_idx), slot_idx, CHAIN_CUT)])
+            self.version_cache.invalidate(rid)
+            # count the tail records cut off out of their pages
+            tail_rid = previous
+            while tail_rid > 0:
+                page_idx, slot_idx = self.record_position(tail_rid)
+                live[page_idx] -= 1
+                if live[page_idx] == 0:
+                    emptied.add(page_idx)
+                tail_rid = self.read_tail(indirection_column, page_idx, slot_idx)
+        for page_idx in sorted(emptied):
+            self.tail_pages.reclaim(page_idx, self.bufferpool.path is not None)
+        self.merge_stats.tail_pages_reclaimed += len(emptied)
+
+    def count_live_tail_records(self):
+        """
+        # Count the tail records of each tail page reachable from a base record, which aren't saved,
+        # for tables loaded with a version_retention. Merged pages found with none are reclaimed, such
+        # as pages cut off by a merge after the last checkpoint. Records deleted before the table was
+        # loaded can't be brought back any more, their chains are dropped.
+        """
+        directory = self.page_directory
+        live = self.tail_pages.live
+        indirection_column = self.metadata_column(INDIRECTION_COLUMN)
+        for rid in range(1, len(directory.indirection)):
+            if rid not in directory:
+                directory.indirection[rid] = 0
+                directory.schema_encoding[rid] = 0
+                continue
+            tail_rid = directory.indirection[rid]
+            while tail_rid > 0:
+                page_idx, slot_idx = self.record_position(tail_rid)
+                live[page_idx] += 1
+                tail_rid = self.read_tail(indirection_column, page_idx, slot_idx)
+        free = set(self.tail_pages.free)
+        for page_idx in range(directory.merged_tail_rid // RECORDS_PER_PAGE):
+            if live[page_idx] == 0 and self.tail_pages.slot(page_idx) >= 0 and page_idx not in free:
+                self.tail_pages.reclaim(page_idx, self.bufferpool.path is not None)
+
+    def stop_merging(self):
+        """Stop the background merge thread, waiting for a running merge"""
+        if self.merge_worker is not None:
+            self.merge_worker.stop()
+            self.merge_worker = None
@@ -0,0 +1,103 @@
+from array import array
+import struct
+
+TAIL_PAGES_MAGIC = b'LTPM'
+TAIL_PAGES_VERSION = 1
+
+# magic, version, number of tail pages, number of segment slots, number of free pages
+HEADER = struct.Struct('<4siqqq')
+
+
+class TailPages:
+
+    """
+    # Segment slot each tail page of a table is stored at.
+    # Tail rids give positions as base rids do, so the table always addresses tail page n as page n;
+    # the buffer pool reads and writes it at slot slots[n] of the tail segments instead, -1 once
+    # that slot was given to a newer page.
+    # Pages left holding no reachable tail record (see Table.trim_versions) are reclaimed: their
+    # slots are reused by new pages once a checkpoint wrote the cut chains (pending until then,
+    # as a crash before it would bring the chains back), right away for tables without a path.
+    # live counts the tail records of each page still reachable from a base record.
+    """
+    def __init__(self):
+        self.slots = array('q')
+        self.live = array('q')
+        self.num_slots = 0
+        # reclaimed pages whose slots can be reused, each page keeps its slot until then
+        self.free = []
+        # pages reclaimed since the last checkpoint
+        self.pending = []
+        # set when slots or free changed since the map was last saved
+        self.dirty = True
+
+    def __len__(self):
+        return len(self.slots)
+
+    def slot(self, page_idx):
+        """Segment slot of a tail page, -1 if it has none"""
+        if page_idx < len(self.slots):
+            return self.slots[page_idx]
+        return -1
+
+    def allocate(self):
+        """
+        # Give the next tail page a slot: a free one if there is one, otherwise a new one past the
+        # end of the segments. Returns the page that held the slot before, None for a new slot.
+        """
+        previous = None
+        if self.free:
+            previous = self.free.pop()
+            slot = self.slots[previous]
+            self.slots[previous] = -1
+        else:
+            slot = self.num_slots
+            self.num_slots += 1
+        self.slots.append(slot)
+        self.live.append(0)
+        self.dirty = True
+        return previous
+
+    def reclaim(self, page_idx, durable):
+        """Give up a page with no reachable tail record, its slot is reused after the next checkpoint if durable"""
+        if durable:
+            self.pending.append(page_idx)
+        else:
+            self.free.append(page_idx)
+            self.dirty = True
+
+    def checkpointed(self):
+        """The pages reclaimed so far were saved as free, their slots can be reused"""
+        self.free.extend(self.pending)
+        self.pending = []
+        self.dirty = False
+
+    def reset(self, num_pages):
+        """Store tail page n at slot n for the first num_pages pages, as tables saved without a map did"""
+        self.slots = array('q', range(num_pages))
+        self.live = array('q', [0]) * num_pages
+        self.num_slots = num_pages
+        self.free = []
+        self.pending = []
+        self.dirty = True
+
+    def save(self, f):
+        """Write the map, pending pages saved as free: the checkpoint writing it also writes their cut chains"""
+        free = self.free + self.pending
+        f.write(HEADER.pack(TAIL_PAGES_MAGIC, TAIL_PAGES_VERSION, len(self.slots), self.num_slots, len(free)))
+        self.slots.tofile(f)
+        array('q', free).tofile(f)
+
+    def load(self, f):
+        """Read a map written by save, live counts start at 0"""
+        magic, version, num_pages, self.num_slots, num_free = HEADER.unpack(f.read(HEADER.size))
+        if magic != TAIL_PAGES_MAGIC or version != TAIL_PAGES_VERSION:
+            raise ValueError(f'{f.name} is not a version {TAIL_PAGES_VERSION} tail page map')
+        self.slots = array('q')
+        self.slots.fromfile(f, num_pages)
+        free = array('q')
+        free.fromfile(f, num_free)
+        self.free = list(free)
+        self.pending = []
+        self.live = array('q', [0]) * num_pages
+        self.dirty = False
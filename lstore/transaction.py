@@ -1,14 +1,62 @@
 from lstore.table import Table, Record
 from lstore.index import Index
+from lstore.lock_manager import context, INTENTION_EXCLUSIVE, EXCLUSIVE
+from lstore.clock import clock
+import itertools
+
+# transaction ids, also the age used by wait-die
+transaction_ids = itertools.count(1)
+
+# concurrency control of a transaction
+LOCKING = 'locking'         # strict 2PL, queries lock what they read and write
+OPTIMISTIC = 'optimistic'   # reads lock nothing, writes are buffered and validated at commit
 
 class Transaction:
 
     """
     # Creates a transaction object.
+    # Queries run by the transaction lock what they read and write through their table's lock
+    # manager (strict 2PL), the locks are held until commit or abort.
+    # Every change a query makes is paired with an undo entry, abort runs them newest first.
+    # Committing only drops the list.
+    # A snapshot transaction only reads: every run picks a snapshot timestamp and its queries see the
+    # tables as of then, taking no locks, so they never wait for writers nor hold them up.
+    # An optimistic transaction (mode OPTIMISTIC) reads like a snapshot transaction and buffers its
+    # writes, see commit_optimistic. mode None leaves the choice to whoever runs it.
     """
-    def __init__(self):
+    def __init__(self, snapshot=False, mode=None):
         self.queries = []
-        pass
+        self.snapshot = snapshot
+        self.mode = mode
+        # timestamp the queries of a running snapshot or optimistic transaction read at, None otherwise
+        self.snapshot_timestamp = None
+        # write-ahead logs of the tables touched, the transaction's records are committed together
+        self.wals = []
+        # assigned on the first run and kept on retries, so a retried transaction keeps its age
+        self.transaction_id = None
+        # (lock manager, resource) of every lock held
+        self.locks = set()
+        # set when the last run aborted because a lock was refused, so running it again may succeed
+        self.lock_refused = False
+        # (table, undo function, args) for every change made, oldest first
+        self.undo_log = []
+        # tables this transaction appended tail records to, see track_tail
+        self.tail_tables = []
+        # (table, kind, first id, count) of the records written as UNCOMMITTED, see Table.new_timestamp
+        self.stamps = []
+        # set while an optimistic transaction runs its queries, which then buffer their writes
+        self.buffering = False
+        # (query, column, begin, end, {rid: tail rid read}) of every lookup of an optimistic transaction
+        self.reads = []
+        # table -> {primary key: row as the transaction wrote it, None if deleted}
+        self.writes = {}
+        # (query function, args) of the buffered writes, run in order at commit
+        self.pending = []
+        # optimistic commits over all runs, and how many of them failed validation
+        self.validations = 0
+        self.validation_failures = 0
+        # set when the last run aborted because validation failed, so running it again may succeed
+        self.validation_failed = False
 
     """
     # Adds the given query to this transaction
@@ -18,26 +66,197 @@ class Transaction:
     # t.add_query(q.update, grades_table, 0, *[None, 1, None, 2, None])
     """
     def add_query(self, query, table, *args):
-        self.queries.append((query, args))
+        self.queries.append((query, table, args))
         # use grades_table for aborting
+        if table.wal is not None and table.wal not in self.wals:
+            self.wals.append(table.wal)
 
         
     # If you choose to implement this differently this method must still return True if transaction commits or False on abort
-    def run(self):
-        for query, args in self.queries:
-            result = query(*args)
-            # If the query has failed the transaction should abort
-            if result == False:
+    # default_mode is used if the transaction wasn't given a mode
+    def run(self, default_mode=LOCKING):
+        if self.transaction_id is None:
+            self.transaction_id = next(transaction_ids)
+        self.lock_refused = False
+        self.validation_failed = False
+        mode = self.mode if self.mode is not None else default_mode
+        self.buffering = mode == OPTIMISTIC and not self.snapshot
+        if self.snapshot or self.buffering:
+            self.snapshot_timestamp = clock.begin_snapshot()
+        else:
+            # counted from now on by checkpoints, snapshot and optimistic transactions only once
+            # they write (see commit_optimistic)
+            for wal in self.wals:
+                wal.begin()
+        context.transaction = self
+        try:
+            for query, table, args in self.queries:
+                try:
+                    result = query(*args)
+                except Exception:
+                    # a crashed query fails like any other, the locks are still released by abort
+                    result = False
+                # If the query has failed the transaction should abort
+                if result == False:
+                    return self.abort()
+            if self.buffering:
+                return self.commit_optimistic()
+            return self.commit()
+        finally:
+            context.transaction = None
+
+    
+    """
+    # Lock a table or record for this transaction, called by Query before it touches the table
+    # Returns False if the lock manager refused the lock
+    """
+    def lock(self, lock_manager, resource, mode):
+        if not lock_manager.acquire(self.transaction_id, resource, mode):
+            self.lock_refused = True
+            return False
+        self.locks.add((lock_manager, resource))
+        return True
+
+    
+    """
+    # Records how to undo a change made to table, called by Query after every change
+    """
+    def add_undo(self, table, undo, *args):
+        self.undo_log.append((table, undo, args))
+
+    
+    """
+    # Called by Query before appending a tail record to table: the table's merge leaves the tail
+    # records of running transactions alone, as an abort may still unlink them
+    """
+    def track_tail(self, table):
+        if self.transaction_id not in table.active_tail_rids:
+            table.active_tail_rids[self.transaction_id] = table.tail_rid_counter + 1
+            self.tail_tables.append(table)
+
+    
+    """
+    # Records a lookup of an optimistic transaction, validated at commit
+    """
+    def add_read(self, query, column, begin, end, versions):
+        self.reads.append((query, column, begin, end, versions))
+
+    
+    """
+    # Buffers a write of an optimistic transaction: query(*args) runs at commit, rows maps the
+    # primary keys written to the records as the transaction sees them from now on
+    """
+    def add_write(self, table, rows, query, *args):
+        self.writes.setdefault(table, {}).update(rows)
+        self.pending.append((query, args))
+
+    
+    def commit_optimistic(self):
+        """
+        # Validate the reads of an optimistic transaction and run its buffered writes, aborting if
+        # a record read changed meanwhile. The records written are locked first, like any writer
+        # would, then the latches of every table involved are held from validation until the last
+        # write, so no other query sees only part of the writes.
+        """
+        self.buffering = False
+        for wal in self.wals:
+            wal.begin()
+        for table, rows in self.writes.items():
+            if not self.lock(table.lock_manager, (table.name,), INTENTION_EXCLUSIVE):
                 return self.abort()
+            for primary_key in rows:
+                if not self.lock(table.lock_manager, (table.name, primary_key), EXCLUSIVE):
+                    return self.abort()
+        
+        tables = set(self.writes)
+        tables.update(query.table for query, column, begin, end, versions in self.reads)
+        latches = self.latches(tables)
+        for latch in latches:
+            latch.acquire()
+        try:
+            self.validations += 1
+            for query, column, begin, end, versions in self.reads:
+                if not query.validate(column, begin, end, versions):
+                    self.validation_failures += 1
+                    self.validation_failed = True
+                    return self.abort()
+            for query, args in self.pending:
+                try:
+                    result = query(*args)
+                except Exception:
+                    result = False
+                if result == False:
+                    return self.abort()
+        finally:
+            for latch in reversed(latches):
+                latch.release()
         return self.commit()
 
     
+    def latches(self, tables):
+        """Latches of tables, always taken in the same order so two committing transactions can't deadlock"""
+        return [table.latch for table in sorted(tables, key=lambda table: table.name)]
+
+    
+    def stamp(self):
+        """Replace the UNCOMMITTED timestamps of the records written by a commit timestamp"""
+        if not self.stamps:
+            return
+        latches = self.latches({table for table, kind, first_id, count in self.stamps})
+        for latch in latches:
+            latch.acquire()
+        try:
+            clock.commit(self.stamps)
+        finally:
+            for latch in reversed(latches):
+                latch.release()
+        self.stamps = []
+
+    
+    def end(self):
+        """Forget the undo log and release everything held, the transaction is over"""
+        self.undo_log = []
+        self.buffering = False
+        self.reads = []
+        self.writes = {}
+        self.pending = []
+        for table in self.tail_tables:
+            table.active_tail_rids.pop(self.transaction_id, None)
+        self.tail_tables = []
+        if self.snapshot_timestamp is not None:
+            clock.end_snapshot(self.snapshot_timestamp)
+            self.snapshot_timestamp = None
+        self.release_locks()
+        # stamped and released, a checkpoint may now write the transaction's changes
+        for wal in self.wals:
+            wal.end()
+
+    
+    def release_locks(self):
+        for lock_manager, resource in self.locks:
+            lock_manager.release(self.transaction_id, resource)
+        self.locks = set()
+
+    
     def abort(self):
-        #TODO: do roll-back and any other necessary operations
+        for table, undo, args in reversed(self.undo_log):
+            with table.latch:
+                undo(*args)
+        # the log records of the undone changes are dropped
+        for wal in self.wals:
+            wal.abort()
+        # the undone records are unreachable, stamped only so their change times can be dropped
+        self.stamp()
+        self.end()
         return False
 
     
     def commit(self):
-        # TODO: commit to database
+        # waits until the transaction's log records are durable (depending on the sync policy)
+        for wal in self.wals:
+            wal.commit()
+        # snapshots taken from now on see all of the transaction's writes
+        self.stamp()
+        self.end()
         return True
 
@@ -1,44 +1,128 @@
 from lstore.table import Table, Record
 from lstore.index import Index
+from lstore.transaction import LOCKING
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+import random
+import threading
+
+# threads of the executor shared by workers that aren't given one
+EXECUTOR_THREADS = 8
+# times a transaction that aborted on a refused lock or failed validation is run again before it counts as aborted
+MAX_RETRIES = 100
+# longest wait in seconds before the first retry, doubled on every further retry up to RETRY_BACKOFF_MAX
+RETRY_BACKOFF = 0.0005
+RETRY_BACKOFF_MAX = 0.05
+
+shared = None
+shared_lock = threading.Lock()
+
+
+def shared_executor():
+    """Executor every TransactionWorker runs on unless given its own, created on first use"""
+    global shared
+    with shared_lock:
+        if shared is None:
+            shared = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix='transaction-worker')
+        return shared
+
+
+def configure_executor(num_threads):
+    """Replace the shared executor by one with num_threads threads, workers already running keep the old one"""
+    global shared
+    with shared_lock:
+        previous = shared
+        shared = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix='transaction-worker')
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+class TransactionStats:
+
+    """
+    # Outcome of one transaction run by a TransactionWorker.
+    # latency is the wall time in seconds over all attempts, retries the number of attempts after the first.
+    # validations counts the attempts of an optimistic transaction that reached validation, validation_failures those that failed it.
+    """
+    def __init__(self, committed, latency, retries, validations=0, validation_failures=0):
+        self.committed = committed
+        self.latency = latency
+        self.retries = retries
+        self.validations = validations
+        self.validation_failures = validation_failures
+
 
 class TransactionWorker:
 
     """
     # Creates a transaction worker object.
+    # Transactions run one after another on a thread of executor (the shared executor if None),
+    # so many workers can run concurrently on a bounded number of threads.
+    # Transactions not given a mode of their own run in mode (LOCKING or OPTIMISTIC).
     """
-    def __init__(self, transactions = []):
+    def __init__(self, transactions=None, executor=None, max_retries=MAX_RETRIES, mode=LOCKING):
+        # one TransactionStats per transaction, in order
         self.stats = []
-        self.transactions = transactions
+        self.transactions = transactions if transactions is not None else []
         self.result = 0
-        pass
+        self.executor = executor
+        self.max_retries = max_retries
+        self.mode = mode
+        self.future = None
+
 
-    
     """
     Appends t to transactions
     """
     def add_transaction(self, t):
         self.transactions.append(t)
 
-        
+
     """
     Runs all transaction as a thread
     """
     def run(self):
-        pass
-        # here you need to create a thread and call __run
-    
+        executor = self.executor if self.executor is not None else shared_executor()
+        self.future = executor.submit(self.__run)
+
 
     """
     Waits for the worker to finish
     """
     def join(self):
-        pass
+        if self.future is not None:
+            # re-raises an exception the worker died with
+            self.future.result()
+
+
+    """
+    Share of the optimistic commit attempts that failed validation, 0.0 if there were none
+    """
+    def validation_failure_rate(self):
+        validations = sum(stats.validations for stats in self.stats)
+        if not validations:
+            return 0.0
+        return sum(stats.validation_failures for stats in self.stats) / validations
 
 
     def __run(self):
         for transaction in self.transactions:
+            start = perf_counter()
             # each transaction returns True if committed or False if aborted
-            self.stats.append(transaction.run())
+            validations = transaction.validations
+            validation_failures = transaction.validation_failures
+            committed = transaction.run(self.mode)
+            retries = 0
+            # other aborts (a failed query) would fail again
+            while (not committed and (transaction.lock_refused or transaction.validation_failed)
+                   and retries < self.max_retries):
+                # random backoff, so transactions that aborted each other don't collide again right away
+                sleep(random.uniform(0, min(RETRY_BACKOFF * 2 ** retries, RETRY_BACKOFF_MAX)))
+                retries += 1
+                committed = transaction.run(self.mode)
+            self.stats.append(TransactionStats(committed, perf_counter() - start, retries,
+                                               transaction.validations - validations,
+                                               transaction.validation_failures - validation_failures))
         # stores the number of transactions that committed
-        self.result = len(list(filter(lambda x: x, self.stats)))
+        self.result = len([stats for stats in self.stats if stats.committed])
 
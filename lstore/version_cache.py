@@ -0,0 +1,51 @@
+from collections import OrderedDict
+import threading
+
+# records, each entry holds a few tuples per cached version
+VERSION_CACHE_SIZE = 65536
+
+
+class VersionCache:
+
+    """
+    # Reconstructed version chains of recently read records, so repeated select_version and
+    # sum_version calls don't walk the same tail records again.
+    # A chain is the list of (tail_rid, schema_encoding) for versions 0, -1, -2, ... as returned by
+    # Table.version_tail, ending in (0, 0) once the base record is reached, or in (CHAIN_CUT, 0) where
+    # older versions were dropped. Chains are tagged with the record's indirection when they were
+    # built and dropped on update; the least recently used record is evicted once capacity records
+    # are cached.
+    """
+    def __init__(self, capacity=VERSION_CACHE_SIZE):
+        self.capacity = capacity
+        # rid -> (indirection, chain)
+        self.chains = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rid, indirection):
+        """Cached chain of a record whose latest tail record is indirection, None if not cached"""
+        with self.lock:
+            entry = self.chains.get(rid)
+            if entry is None or entry[0] != indirection:
+                self.misses += 1
+                return None
+            self.chains.move_to_end(rid)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, rid, indirection, chain):
+        with self.lock:
+            self.chains[rid] = (indirection, chain)
+            self.chains.move_to_end(rid)
+            while len(self.chains) > self.capacity:
+                self.chains.popitem(last=False)
+
+    def invalidate(self, rid):
+        with self.lock:
+            self.chains.pop(rid, None)
+
+    def clear(self):
+        with self.lock:
+            self.chains.clear()
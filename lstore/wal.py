@@ -0,0 +1,262 @@
+import os
+import struct
+import threading
+import zlib
+
+# sync policies
+SYNC_COMMIT = 'commit'      # a commit returns once its log records are fsynced
+SYNC_INTERVAL = 'interval'  # a background thread fsyncs the log every sync_interval seconds
+SYNC_OS = 'os'              # records are handed to the OS on commit, fsynced only on checkpoint/close
+
+SYNC_INTERVAL_SECONDS = 0.01
+
+# log record types
+OP_CREATE = 1   # values: num_columns, key_index
+OP_DROP = 2
+OP_INSERT = 3   # values: columns
+OP_UPDATE = 4   # values: primary_key, columns (None for unchanged columns)
+OP_DELETE = 5   # values: primary_key
+# records logged between these two are replayed together or not at all
+OP_BEGIN = 6
+OP_COMMIT = 7
+
+# payload length, crc32 of the payload
+RECORD_HEADER = struct.Struct('<II')
+# op, length of the table name
+PAYLOAD_HEADER = struct.Struct('<BH')
+VALUE = struct.Struct('<?q')
+
+
+def encode_record(op, table_name, values):
+    name_bytes = table_name.encode('utf-8')
+    payload = bytearray(PAYLOAD_HEADER.pack(op, len(name_bytes)))
+    payload += name_bytes
+    payload += struct.pack('<H', len(values))
+    for value in values:
+        payload += VALUE.pack(value is not None, value if value is not None else 0)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_group(records, count):
+    """Frame count encoded records so they are only replayed together"""
+    if count < 2:
+        return records
+    return encode_record(OP_BEGIN, '', []) + records + encode_record(OP_COMMIT, '', [])
+
+
+def read_log(path):
+    """
+    # Yields (op, table_name, values) for every complete record, stopping at a torn or corrupt tail.
+    # Records of a group (see encode_group) are only yielded once the whole group was read.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    # records of the group being read, None outside a group
+    group = None
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        op, name_len = PAYLOAD_HEADER.unpack_from(payload, 0)
+        position = PAYLOAD_HEADER.size
+        table_name = payload[position:position + name_len].decode('utf-8')
+        position += name_len
+        num_values = struct.unpack_from('<H', payload, position)[0]
+        position += 2
+        values = []
+        for i in range(num_values):
+            present, value = VALUE.unpack_from(payload, position)
+            values.append(value if present else None)
+            position += VALUE.size
+        offset += RECORD_HEADER.size + length
+        if op == OP_BEGIN:
+            group = []
+        elif op == OP_COMMIT:
+            yield from group
+            group = None
+        elif group is not None:
+            group.append((op, table_name, values))
+        else:
+            yield op, table_name, values
+
+
+class WriteAheadLog:
+
+    """
+    # Redo log of query effects, replayed by Database.open from the last checkpoint.
+    # Records are buffered in memory; the thread that needs them on disk first writes out
+    # the whole buffer and fsyncs it, so transactions committing meanwhile share that fsync.
+    # Queries outside a transaction commit on their own, waiting for their records only once they
+    # released the table latch (see wait_pending). Inside one their records are kept by the
+    # transaction's thread and only reach the log on Transaction.commit, so aborted transactions
+    # are never replayed and the log lists transactions in commit order.
+    # Records committed together are framed as a group, a torn group is not replayed at all.
+    # The log also counts running transactions that may write, so Database.checkpoint can run
+    # between them (see hold_transactions). Snapshot transactions never count, optimistic ones
+    # only from validation on.
+    """
+    def __init__(self, path, sync_policy=SYNC_COMMIT, sync_interval=SYNC_INTERVAL_SECONDS):
+        self.path = path
+        self.sync_policy = sync_policy
+        self.sync_interval = sync_interval
+        self.file = open(path, 'ab')
+        self.buffer = bytearray()
+        # log sequence numbers count the bytes ever appended to the log
+        self.next_lsn = self.file.tell()
+        self.flushed_lsn = self.next_lsn
+        self.synced_lsn = self.next_lsn
+        self.flushing = False
+        self.flushed = threading.Condition(threading.Lock())
+        # held by Database.checkpoint, records can't be added between the checkpoint and truncate
+        self.appends = threading.Lock()
+        self.local = threading.local()
+        # transactions between begin and end, and whether a checkpoint keeps new ones from beginning
+        self.transactions = threading.Condition(threading.Lock())
+        self.running = 0
+        self.held = False
+
+        self.closed = threading.Event()
+        self.sync_thread = None
+        if sync_policy == SYNC_INTERVAL:
+            self.sync_thread = threading.Thread(target=self.sync_periodically, daemon=True)
+            self.sync_thread.start()
+
+    def sync_periodically(self):
+        while not self.closed.wait(self.sync_interval):
+            self.flush()
+
+    def append(self, op, table_name, values):
+        """Buffer a log record, returns its lsn"""
+        return self.append_many(op, table_name, [values])
+
+    def append_many(self, op, table_name, values_list):
+        """
+        # Buffer one log record per entry of values_list, committed together, returns the last lsn.
+        # Outside a transaction they are committed right away, the caller then waits for them with
+        # wait_pending, so nobody waits for an fsync holding a latch others need to log their records.
+        """
+        records = b''.join(encode_record(op, table_name, values) for values in values_list)
+        if getattr(self.local, 'in_transaction', False):
+            self.local.records += records
+            self.local.count += len(values_list)
+            return self.next_lsn
+        lsn = self.write_records(encode_group(records, len(values_list)))
+        self.local.pending_lsn = lsn
+        return lsn
+
+    def write_records(self, records):
+        """Add encoded records to the log buffer, returns the lsn they end at"""
+        with self.appends, self.flushed:
+            self.buffer += records
+            self.next_lsn += len(records)
+            return self.next_lsn
+
+    def begin(self):
+        """Keep this thread's records until commit or abort, waiting while a checkpoint holds transactions off"""
+        with self.transactions:
+            while self.held:
+                self.transactions.wait()
+            self.running += 1
+        self.local.running = True
+        self.local.in_transaction = True
+        self.local.records = bytearray()
+        self.local.count = 0
+
+    def commit(self):
+        self.local.in_transaction = False
+        records = getattr(self.local, 'records', None)
+        self.local.records = bytearray()
+        if records:
+            self.wait_durable(self.write_records(encode_group(records, self.local.count)))
+
+    def abort(self):
+        """Drop this thread's records, the transaction's changes were rolled back"""
+        self.local.in_transaction = False
+        self.local.records = bytearray()
+
+    def end(self):
+        """The transaction running on this thread is over, its changes are committed or rolled back"""
+        if not getattr(self.local, 'running', False):
+            return
+        self.local.running = False
+        with self.transactions:
+            self.running -= 1
+            if self.running == 0:
+                self.transactions.notify_all()
+
+    def hold_transactions(self):
+        """Wait until no transaction is running and keep new ones from beginning until release_transactions"""
+        with self.transactions:
+            while self.held:
+                self.transactions.wait()
+            self.held = True
+            while self.running:
+                self.transactions.wait()
+
+    def release_transactions(self):
+        with self.transactions:
+            self.held = False
+            self.transactions.notify_all()
+
+    def wait_pending(self):
+        """Wait until the records this thread committed outside a transaction are durable"""
+        lsn = getattr(self.local, 'pending_lsn', None)
+        if lsn is not None:
+            self.local.pending_lsn = None
+            self.wait_durable(lsn)
+
+    def wait_durable(self, lsn):
+        if self.sync_policy == SYNC_COMMIT:
+            self.flush(lsn)
+        elif self.sync_policy == SYNC_OS:
+            self.flush(lsn, sync=False)
+        # SYNC_INTERVAL: the background thread makes it durable
+
+    def flush(self, lsn=None, sync=True):
+        """Write (and fsync unless sync is False) the log up to lsn, everything buffered if lsn is None"""
+        with self.flushed:
+            if lsn is None:
+                lsn = self.next_lsn
+            while self.flushed_lsn < lsn or (sync and self.synced_lsn < lsn):
+                if self.flushing:
+                    # another thread is writing, its batch probably covers our records
+                    self.flushed.wait()
+                    continue
+                data = bytes(self.buffer)
+                self.buffer.clear()
+                target = self.next_lsn
+                self.flushing = True
+                self.flushed.release()
+                try:
+                    self.file.write(data)
+                    self.file.flush()
+                    if sync:
+                        os.fsync(self.file.fileno())
+                finally:
+                    self.flushed.acquire()
+                    self.flushing = False
+                    self.flushed_lsn = target
+                    if sync:
+                        self.synced_lsn = target
+                    self.flushed.notify_all()
+
+    def truncate(self):
+        """Empty the log once a checkpoint made its records redundant"""
+        self.flush()
+        with self.flushed:
+            while self.flushing:
+                self.flushed.wait()
+            # lsns keep counting up, only records still in the buffer will land in the emptied file
+            self.file.truncate(0)
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.closed.set()
+        if self.sync_thread is not None:
+            self.sync_thread.join()
+        self.flush()
+        self.file.close()
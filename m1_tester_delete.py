@@ -0,0 +1,132 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.index import BPlusTree
+
+from random import randint, sample, seed, shuffle
+
+# Indexes stay exact when records are deleted or their key changes: the B+ tree drops single
+# (key, rid) entries, rebalancing or merging underfull nodes, and lookups never return a deleted rid.
+
+seed(3562901)
+
+errors = 0
+
+
+def check_tree(tree, entries, order):
+    """Compare a tree with the sorted (key, rid) list it should hold and check its node invariants"""
+    global errors
+    found = []
+    problems = []
+
+    def walk(node, depth, low, high, leaf_depths):
+        if node is not tree.root and len(node.keys) < tree.min_keys:
+            problems.append('underfull node of ' + str(len(node.keys)) + ' keys')
+        if len(node.keys) > order - 1 or node.keys != sorted(node.keys):
+            problems.append('overfull or unsorted node ' + str(node.keys))
+        if any((low is not None and key < low) or (high is not None and key > high) for key in node.keys):
+            problems.append('key out of its separators ' + str((low, high)))
+        if node.is_leaf:
+            leaf_depths.add(depth)
+            return
+        if len(node.children) != len(node.keys) + 1:
+            problems.append('internal node with ' + str(len(node.children)) + ' children and ' + str(len(node.keys)) + ' keys')
+        bounds = [low] + node.keys + [high]
+        for i, child in enumerate(node.children):
+            walk(child, depth + 1, bounds[i], bounds[i + 1], leaf_depths)
+
+    leaf_depths = set()
+    walk(tree.root, 0, None, None, leaf_depths)
+    if len(leaf_depths) > 1:
+        problems.append('leaves at depths ' + str(sorted(leaf_depths)))
+
+    # the leaf chain holds every entry in key order
+    node = tree.root
+    while not node.is_leaf:
+        node = node.children[0]
+    while node:
+        found.extend(zip(node.keys, node.rids))
+        node = node.next
+    if [key for key, rid in found] != [key for key, rid in entries] or sorted(found) != entries:
+        problems.append('leaf chain holds ' + str(len(found)) + ' entries, correct: ' + str(len(entries)))
+
+    for problem in problems[:5]:
+        print('tree error (order', str(order) + '):', problem)
+    errors += len(problems) > 0
+
+
+# random inserts and deletes with many duplicate keys, through small and large nodes
+for order in [4, 5, 16, 128]:
+    tree = BPlusTree(order)
+    entries = [(randint(0, 300), rid) for rid in range(3000)]
+    for key, rid in entries:
+        tree.insert(key, rid)
+    shuffle(entries)
+    deleted = entries[:2500]
+    for key, rid in deleted:
+        if not tree.delete(key, rid):
+            print('delete error (order', str(order) + '): (' + str(key) + ', ' + str(rid) + ') not found')
+            errors += 1
+    if tree.delete(deleted[0][0], deleted[0][1]):
+        print('delete error (order', str(order) + '): deleted', deleted[0], 'twice')
+        errors += 1
+    remaining = sorted(entries[2500:])
+    check_tree(tree, remaining, order)
+    for key in range(0, 301, 7):
+        if sorted(tree.locate(key)) != sorted(rid for entry_key, rid in remaining if entry_key == key):
+            print('locate error (order', str(order) + ') on', key, ':', sorted(tree.locate(key)))
+            errors += 1
+    # emptying the tree leaves a single empty leaf
+    for key, rid in remaining:
+        tree.delete(key, rid)
+    if not tree.is_empty():
+        print('delete error (order', str(order) + '): tree not empty after deleting everything')
+        errors += 1
+print('B+ tree delete finished')
+
+# deletes and key changing updates through queries, with a secondary index on a column of duplicates
+db = Database()
+grades_table = db.create_table('Grades', 3, 0)
+query = Query(grades_table)
+records = {}
+for key in range(2000):
+    records[key] = [key, randint(0, 20), randint(0, 20)]
+    query.insert(*records[key])
+grades_table.index.create_index(1)
+
+for key in sample(sorted(records), 500):
+    query.delete(key)
+    del records[key]
+for key in sample(sorted(records), 300):
+    new_key = key + 10000
+    if not query.update(key, new_key, None, None):
+        print('update error: key', key, 'not changed to', new_key)
+        errors += 1
+        continue
+    records[new_key] = records.pop(key)
+    records[new_key][0] = new_key
+
+for key in list(range(2000)) + list(range(10000, 12000)):
+    result = query.select(key, 0, [1, 1, 1])
+    if key not in records:
+        if result:
+            print('select error on', key, ': found', result[0].columns, 'after delete or key change')
+            errors += 1
+    elif not result or result[0].columns != records[key]:
+        print('select error on', key, ':', result[0].columns if result else result, ', correct:', records[key])
+        errors += 1
+for value in range(21):
+    result = sorted(record.columns for record in query.select(value, 1, [1, 1, 1]))
+    correct = sorted(record for record in records.values() if record[1] == value)
+    if result != correct:
+        print('select error on column 1 =', value, ':', len(result), 'records, correct:', len(correct))
+        errors += 1
+if query.sum(0, 20000, 2) != sum(record[2] for record in records.values()):
+    print('sum error:', query.sum(0, 20000, 2), ', correct:', sum(record[2] for record in records.values()))
+    errors += 1
+# a deleted key can be inserted again
+if not query.insert(*[next(key for key in range(2000) if key not in records), 1, 1]):
+    print('insert error: deleted key not reusable')
+    errors += 1
+print('Delete and key change finished')
+
+print('Errors', errors)
@@ -0,0 +1,81 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+from random import randint, sample, seed
+
+# Batches of records are inserted at once: Query.insert_many takes rows, Query.insert_columns a
+# columnar batch, both rejecting the whole batch on a repeated or existing primary key, and
+# Table.insert_rows writes rows straight into the table. Indexes are bulk loaded when empty.
+
+seed(3562901)
+
+errors = 0
+
+db = Database()
+grades_table = db.create_table('Grades', 3, 0)
+query = Query(grades_table)
+grades_table.index.create_index(1)
+records = {}
+
+
+def check(stage):
+    global errors
+    for key in range(4000):
+        result = query.select(key, 0, [1, 1, 1])
+        if key not in records:
+            if result:
+                print('select error', stage, 'on', key, ': found', result[0].columns)
+                errors += 1
+        elif not result or result[0].columns != records[key]:
+            print('select error', stage, 'on', key, ':', result[0].columns if result else result, ', correct:', records[key])
+            errors += 1
+    for value in range(0, 21, 4):
+        result = sorted(record.columns for record in query.select(value, 1, [1, 1, 1]))
+        correct = sorted(record for record in records.values() if record[1] == value)
+        if result != correct:
+            print('select error', stage, 'on column 1 =', value, ':', len(result), 'records, correct:', len(correct))
+            errors += 1
+
+
+# rows into empty indexes, then a columnar batch into filled ones
+rows = [[key, randint(0, 20), randint(0, 20)] for key in sample(range(1000), 1000)]
+if not query.insert_many(rows):
+    print('insert_many error: batch refused')
+    errors += 1
+records.update((row[0], row) for row in rows)
+rows = [[key, randint(0, 20), randint(0, 20)] for key in range(1000, 2000)]
+if not query.insert_columns([list(column) for column in zip(*rows)]):
+    print('insert_columns error: batch refused')
+    errors += 1
+records.update((row[0], row) for row in rows)
+check('after batches')
+
+# a repeated key or one already in the table refuses the whole batch
+for batch in [[[2000, 1, 1], [2001, 1, 1], [2000, 2, 2]], [[2002, 1, 1], [500, 2, 2]]]:
+    if query.insert_many(batch):
+        print('insert_many error: batch', batch, 'with a repeated key inserted')
+        errors += 1
+check('after refused batches')
+
+# straight into the table, rids in row order
+rows = [[key, randint(0, 20), randint(0, 20)] for key in range(2000, 3000)]
+rids = grades_table.insert_rows(rows)
+if rids != list(range(rids[0], rids[0] + len(rows))) or rids[0] != 2001:
+    print('insert_rows error: rids', rids[:3], '..., correct: 2001, 2002, 2003, ...')
+    errors += 1
+records.update((row[0], row) for row in rows)
+check('after insert_rows')
+
+# an aborted transaction takes its batch back
+rows = [[key, randint(0, 20), randint(0, 20)] for key in range(3000, 4000)]
+transaction = Transaction()
+transaction.add_query(query.insert_many, grades_table, rows)
+transaction.add_query(lambda: False, grades_table)
+if transaction.run():
+    print('transaction error: committed although a query failed')
+    errors += 1
+check('after an aborted batch')
+print('Batch insert finished')
+
+print('Errors', errors)
@@ -0,0 +1,75 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.index import HASH_INDEX
+
+from random import randint, sample, seed
+
+# Selects and sums on columns without an index scan the column's base pages, reading updated values
+# from tail pages or merged copies. sum_where filters on any column, through its index if it has
+# one and by scanning it otherwise.
+
+seed(3562901)
+
+errors = 0
+
+db = Database()
+grades_table = db.create_table('Grades', 4, 0)
+query = Query(grades_table)
+records = {}
+for key in range(3000):
+    records[key] = [key, randint(0, 20), randint(0, 20), randint(0, 50)]
+    query.insert(*records[key])
+# updates, some merged into base page copies, and deletes
+for key in sample(sorted(records), 800):
+    for col in sample([1, 2, 3], randint(1, 3)):
+        records[key][col] = randint(0, 20) if col < 3 else randint(0, 50)
+    query.update(key, None, *records[key][1:])
+grades_table.merge()
+for key in sample(sorted(records), 400):
+    records[key][2] = randint(0, 20)
+    query.update(key, None, None, records[key][2], None)
+for key in sample(sorted(records), 300):
+    query.delete(key)
+    del records[key]
+
+
+def check_sums(stage):
+    global errors
+    for search_column in [0, 1, 2, 3]:
+        for begin, end in [(5, 5), (3, 12), (0, 50), (60, 70)]:
+            if search_column == 0:
+                begin, end = begin * 50, end * 50
+            for aggregate_column in [1, 2, 3, search_column]:
+                matching = [record for record in records.values() if begin <= record[search_column] <= end]
+                correct = sum(record[aggregate_column] for record in matching) if matching else False
+                result = query.sum_where(begin, end, search_column, aggregate_column)
+                if result != correct:
+                    print('sum_where error', stage, 'on column', search_column, 'in', (begin, end), 'summing column',
+                          aggregate_column, ':', result, ', correct:', correct)
+                    errors += 1
+
+
+def check_selects(stage):
+    global errors
+    for value in range(21):
+        result = sorted(record.columns for record in query.select(value, 2, [1, 1, 1, 1]))
+        correct = sorted(record for record in records.values() if record[2] == value)
+        if result != correct:
+            print('select error', stage, 'on column 2 =', value, ':', len(result), 'records, correct:', len(correct))
+            errors += 1
+
+
+check_selects('by scan')
+check_sums('by scan')
+print('Scan finished')
+
+# the same through a B+ tree on column 1, a hash index on column 2 and both on column 3
+grades_table.index.create_index(1)
+grades_table.index.create_index(2, HASH_INDEX)
+grades_table.index.create_index(3)
+grades_table.index.create_index(3, HASH_INDEX)
+check_selects('by index')
+check_sums('by index')
+print('Indexed sum_where finished')
+
+print('Errors', errors)
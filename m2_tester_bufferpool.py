@@ -0,0 +1,105 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.bufferpool import BufferPool
+
+from random import randint, seed
+import shutil
+
+# A buffer pool far smaller than the table: pages are evicted and read back all the time, and a
+# page just read or created must never be the one evicted, even when every other page is pinned.
+
+path = './CS451_bufferpool'
+number_of_records = 10 * 512
+bufferpool_size = 8
+
+seed(3562901)
+shutil.rmtree(path, ignore_errors=True)
+
+errors = 0
+
+db = Database(bufferpool_size=bufferpool_size)
+db.open(path)
+grades_table = db.create_table('Grades', 3, 0)
+query = Query(grades_table)
+records = {key: [key, randint(0, 20), randint(0, 20)] for key in range(number_of_records)}
+query.insert_many(list(records.values()))
+db.checkpoint()
+
+# searches an unindexed column: reads every page of it in one batch
+for value in range(3):
+    result = query.select(value, 1, [1, 1, 1])
+    correct = sorted(record for record in records.values() if record[1] == value)
+    if result is False or sorted(record.columns for record in result) != correct:
+        print('select error on column 1 =', value, ':', len(result) if result else result, 'records, correct:', len(correct))
+        errors += 1
+    # a batch pins one page at a time, so the pool never has to grow past its capacity
+    if len(db.bufferpool.frames) > bufferpool_size:
+        print('capacity error after select:', len(db.bufferpool.frames), 'frames, capacity', bufferpool_size)
+        errors += 1
+print('Select through a small pool finished')
+
+for key in range(0, number_of_records, 7):
+    records[key][2] = randint(0, 20)
+    query.update(key, None, None, records[key][2])
+if query.sum(0, number_of_records - 1, 2) != sum(record[2] for record in records.values()):
+    print('sum error:', query.sum(0, number_of_records - 1, 2), ', correct:', sum(record[2] for record in records.values()))
+    errors += 1
+pinned = [page_id for page_id, frame in db.bufferpool.frames.items() if frame.pin_count]
+if pinned:
+    print('pin error:', len(pinned), 'pages left pinned')
+    errors += 1
+if len(db.bufferpool.frames) > bufferpool_size:
+    print('capacity error:', len(db.bufferpool.frames), 'frames, capacity', bufferpool_size)
+    errors += 1
+print('Update through a small pool finished')
+db.close()
+
+# every page written through the small pool made it to disk
+db = Database(bufferpool_size=bufferpool_size)
+db.open(path)
+grades_table = db.get_table('Grades')
+query = Query(grades_table)
+for key in range(0, number_of_records, 13):
+    result = query.select(key, 0, [1, 1, 1])
+    if not result or result[0].columns != records[key]:
+        print('select error on', key, 'after reopen :', result[0].columns if result else result, ', correct:', records[key])
+        errors += 1
+print('Reopen finished')
+db.close()
+shutil.rmtree(path, ignore_errors=True)
+
+# evictions go in LRU order past pinned frames, a page created again keeps its frame and pins
+pool = BufferPool(4)
+pool.path = path
+page_ids = [('T', 'base', 0, page_idx) for page_idx in range(8)]
+for page_idx, page_id in enumerate(page_ids):
+    pool.new_page(page_id).write(page_idx)
+    if page_idx != 0:
+        pool.unpin_page(page_id, dirty=True)
+if list(pool.frames) != [page_ids[0]] + page_ids[5:]:
+    print('eviction error: frames', [page_id[3] for page_id in pool.frames], ', correct: [0, 5, 6, 7]')
+    errors += 1
+for page_idx in [1, 4]:
+    page = pool.fetch_page(page_ids[page_idx])
+    if page.read(0) != page_idx:
+        print('eviction error: page', page_idx, 'read back as', page.read(0))
+        errors += 1
+    pool.unpin_page(page_ids[page_idx])
+reader = pool.fetch_page(page_ids[7])
+pool.new_page(page_ids[7]).write(70)
+frame = pool.frames[page_ids[7]]
+if reader.read(0) != 7 or frame.page.read(0) != 70 or frame.pin_count != 2 or not frame.dirty:
+    print('new_page error on a pinned page: reader reads', reader.read(0), ', frame holds', frame.page.read(0),
+          'with', frame.pin_count, 'pins')
+    errors += 1
+pool.unpin_page(page_ids[7], dirty=True)
+pool.unpin_page(page_ids[7])
+pool.unpin_page(page_ids[0], dirty=True)
+if any(frame.pin_count for frame in pool.frames.values()):
+    print('pin error: pins left after new_page on a pinned page')
+    errors += 1
+pool.close()
+shutil.rmtree(path, ignore_errors=True)
+print('Eviction order finished')
+
+print('Errors', errors)
@@ -0,0 +1,196 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction, OPTIMISTIC
+
+from random import randint, seed
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+# Checkpoints write only what changed: dirty pages and page directory deltas, the full directory
+# once the deltas outgrow it. A checkpoint taken while a transaction runs waits for it to end, so a
+# crash can't leave the transaction's changes on disk.
+
+path = './CS451_checkpoint'
+number_of_records = 2000
+
+
+def signal(event):
+    event.set()
+    return True
+
+
+def wait(event):
+    return event.wait(10)
+
+
+if sys.argv[1:] == ['crash']:
+    # run in a separate process: checkpoint while a transaction is running, then die without closing
+    db = Database()
+    db.open(path)
+    grades_table = db.get_table('Grades')
+    query = Query(grades_table)
+    changed = threading.Event()
+    transaction = Transaction()
+    transaction.add_query(query.update, grades_table, 1, None, 11)
+    transaction.add_query(query.delete, grades_table, 2)
+    transaction.add_query(signal, grades_table, changed)
+    transaction.add_query(wait, grades_table, threading.Event())
+    threading.Thread(target=transaction.run, daemon=True).start()
+    wait(changed)
+    threading.Thread(target=db.checkpoint, daemon=True).start()
+    time.sleep(0.5)
+    os._exit(0)
+
+seed(3562901)
+shutil.rmtree(path, ignore_errors=True)
+
+errors = 0
+
+
+def check(records, stage):
+    global errors
+    db = Database()
+    db.open(path)
+    query = Query(db.get_table('Grades'))
+    for key in range(number_of_records):
+        result = query.select(key, 0, [1, 1, 1])
+        if key not in records:
+            if result:
+                print('delete error on', key, 'after', stage, ':', result[0].columns)
+                errors += 1
+        elif not result or result[0].columns != records[key]:
+            print('select error on', key, 'after', stage, ':', result[0].columns if result else result, ', correct:', records[key])
+            errors += 1
+    db.close()
+
+
+def modified(table_path):
+    return {name: os.stat(os.path.join(table_path, name)).st_mtime_ns for name in os.listdir(table_path)}
+
+
+db = Database()
+db.open(path)
+grades_table = db.create_table('Grades', 3, 0)
+query = Query(grades_table)
+records = {key: [key, randint(0, 20), randint(0, 20)] for key in range(number_of_records)}
+query.insert_many(list(records.values()))
+db.close()
+
+# a few updates and deletes only append to the directory delta and write tail pages
+db = Database()
+db.open(path)
+query = Query(db.get_table('Grades'))
+table_path = os.path.join(path, 'Grades')
+before = modified(table_path)
+for key in [5, 600, 1500]:
+    records[key][1] = randint(0, 20)
+    query.update(key, None, records[key][1], None)
+for key in [7, 1999]:
+    query.delete(key)
+    del records[key]
+db.checkpoint()
+after = modified(table_path)
+rewritten = [name for name in before
+             if (name.startswith('base_') or name == 'page_directory.dat') and after[name] != before[name]]
+if rewritten:
+    print('checkpoint error: rewrote', rewritten)
+    errors += 1
+delta_path = os.path.join(table_path, 'page_directory.delta')
+if not os.path.exists(delta_path) or os.path.getsize(delta_path) > 5 * 64:
+    print('delta error: page_directory.delta has', os.path.getsize(delta_path) if os.path.exists(delta_path) else 0,
+          'bytes for 5 changes')
+    errors += 1
+db.close()
+check(records, 'deltas')
+print('Incremental checkpoint finished')
+
+# once the deltas would hold more entries than the directory, it is rewritten and the deltas dropped
+db = Database()
+db.open(path)
+query = Query(db.get_table('Grades'))
+for key in records:
+    records[key][2] = randint(0, 20)
+    query.update(key, None, None, records[key][2])
+db.close()
+if os.path.exists(os.path.join(table_path, 'page_directory.delta')):
+    print('compaction error: page_directory.delta left after', len(records) + 5, 'changes')
+    errors += 1
+check(records, 'compaction')
+print('Delta compaction finished')
+
+# a checkpoint requested during a transaction doesn't write its changes
+subprocess.run([sys.executable, __file__, 'crash'])
+check(records, 'a crash during a transaction')
+db = Database()
+db.open(path)
+query = Query(db.get_table('Grades'))
+sums = []
+snapshot = Transaction(snapshot=True)
+snapshot.add_query(lambda: sums.append(query.sum(1, 1, 1)) or True, db.get_table('Grades'))
+snapshot.run()
+if sums != [records[1][1]] or query.sum(1, 1, 1) != records[1][1]:
+    print('sum error after a crash during a transaction:', sums, 'in a snapshot,', query.sum(1, 1, 1), 'latest, correct:', records[1][1])
+    errors += 1
+db.close()
+# closing again does nothing
+try:
+    db.close()
+except Exception as e:
+    print('close error: a second close raised', repr(e))
+    errors += 1
+print('Checkpoint during a transaction finished')
+
+# transactions that haven't written anything don't hold a checkpoint up: one runs while a snapshot
+# transaction and an optimistic one still reading are open, and an update transaction isn't kept waiting
+db = Database()
+db.open(path)
+grades_table = db.get_table('Grades')
+query = Query(grades_table)
+reading = [threading.Event(), threading.Event()]
+done = threading.Event()
+sums = []
+snapshot = Transaction(snapshot=True)
+snapshot.add_query(signal, grades_table, reading[0])
+snapshot.add_query(wait, grades_table, done)
+snapshot.add_query(lambda: sums.append(query.sum(10, 10, 1)) or True, grades_table)
+optimistic = Transaction(mode=OPTIMISTIC)
+optimistic.add_query(query.select, grades_table, 12, 0, [1, 1, 1])
+optimistic.add_query(signal, grades_table, reading[1])
+optimistic.add_query(wait, grades_table, done)
+optimistic.add_query(query.update, grades_table, 12, None, 12, None)
+readers = [threading.Thread(target=snapshot.run), threading.Thread(target=optimistic.run)]
+for thread in readers:
+    thread.start()
+for event in reading:
+    wait(event)
+checkpoint_thread = threading.Thread(target=db.checkpoint)
+checkpoint_thread.start()
+checkpoint_thread.join(5)
+updater = Transaction()
+updater.add_query(query.update, grades_table, 10, None, 10, None)
+updater_thread = threading.Thread(target=updater.run)
+updater_thread.start()
+updater_thread.join(5)
+if checkpoint_thread.is_alive() or updater_thread.is_alive():
+    print('checkpoint error: waited for transactions that wrote nothing, checkpoint done:', not checkpoint_thread.is_alive(),
+          ', update done:', not updater_thread.is_alive())
+    errors += 1
+done.set()
+for thread in readers + [checkpoint_thread, updater_thread]:
+    thread.join()
+if sums != [records[10][1]] or query.select(12, 0, [1, 1, 1])[0].columns[1] != 12:
+    print('read error beside a checkpoint:', sums, 'in a snapshot, correct:', [records[10][1]], ', optimistic update',
+          query.select(12, 0, [1, 1, 1])[0].columns)
+    errors += 1
+records[10][1] = 10
+records[12][1] = 12
+db.close()
+check(records, 'a checkpoint beside reading transactions')
+print('Checkpoint beside reading transactions finished')
+shutil.rmtree(path, ignore_errors=True)
+
+print('Errors', errors)
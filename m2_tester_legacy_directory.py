@@ -0,0 +1,107 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.page_directory import PageDirectory, PAGE_DIRECTORY_MAGIC, PAGE_DIRECTORY_VERSION, HEADER
+
+from random import randint, sample, seed
+import os
+import shutil
+import struct
+
+# Page directories written in older layouts are still read: version 0 kept a location per column
+# for every rid, version 1 a position array and a tombstone bitmap. Their deltas are read in the
+# same layout, and the next checkpoint rewrites the directory in the current one.
+
+path = './CS451_legacy_directory'
+number_of_records = 1500
+num_columns = 3
+
+seed(3562901)
+
+errors = 0
+
+
+def write_version_0(f, positions):
+    f.write(struct.pack('i', len(positions)))
+    for rid, (page_idx, slot_idx) in positions.items():
+        f.write(struct.pack('q', rid))
+        for col in range(num_columns):
+            f.write(struct.pack('ii', page_idx, slot_idx))
+
+
+def write_version_1(f, positions):
+    directory = PageDirectory()
+    for rid, position in positions.items():
+        directory[rid] = position
+    f.write(HEADER.pack(PAGE_DIRECTORY_MAGIC, 1, len(directory.positions)))
+    directory.positions.tofile(f)
+    f.write(directory.tombstones)
+
+
+for version, write_directory in [(0, write_version_0), (1, write_version_1)]:
+    shutil.rmtree(path, ignore_errors=True)
+    db = Database()
+    db.open(path)
+    grades_table = db.create_table('Grades', num_columns, 0)
+    query = Query(grades_table)
+    records = {}
+    for key in range(number_of_records):
+        records[key] = [key, randint(0, 20), randint(0, 20)]
+        query.insert(*records[key])
+    db.close()
+
+    # rewrite the directory in the old layout, deleting some records in it and some in its delta
+    table_path = os.path.join(path, 'Grades')
+    pd_path = os.path.join(table_path, 'page_directory.dat')
+    directory = PageDirectory()
+    with open(pd_path, 'rb') as f:
+        directory.load(f)
+    rids = {key: rid for rid, key in zip(directory, range(number_of_records))}
+    positions = {rid: directory[rid] for rid in directory}
+    deleted = sample(sorted(records), 200)
+    for key in deleted[:100]:
+        del positions[rids[key]]
+    with open(pd_path, 'wb') as f:
+        write_directory(f, positions)
+    with open(os.path.join(table_path, 'page_directory.delta'), 'wb') as f:
+        # a record written again at its own location, then deletes
+        key = next(key for key in records if key not in deleted)
+        f.write(struct.pack('q?', rids[key], True))
+        for col in range(num_columns if version == 0 else 1):
+            f.write(struct.pack('ii', *positions[rids[key]]))
+        for key in deleted[100:]:
+            f.write(struct.pack('q?', rids[key], False))
+    for key in deleted:
+        del records[key]
+
+    for round in range(2):
+        db = Database()
+        db.open(path)
+        query = Query(db.get_table('Grades'))
+        for key in range(number_of_records):
+            result = query.select(key, 0, [1, 1, 1])
+            if key not in records:
+                if result:
+                    print('delete error on', key, 'in version', version, ':', result[0].columns)
+                    errors += 1
+            elif not result or result[0].columns != records[key]:
+                print('select error on', key, 'in version', version, ':', result[0].columns if result else result,
+                      ', correct:', records[key])
+                errors += 1
+        if query.sum(0, number_of_records - 1, 2) != sum(record[2] for record in records.values()):
+            print('sum error in version', version, ':', query.sum(0, number_of_records - 1, 2),
+                  ', correct:', sum(record[2] for record in records.values()))
+            errors += 1
+        db.close()
+
+        with open(pd_path, 'rb') as f:
+            magic, written_version, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != PAGE_DIRECTORY_MAGIC or written_version != PAGE_DIRECTORY_VERSION:
+            print('rewrite error: version', version, 'directory saved as', magic, written_version)
+            errors += 1
+        if os.path.exists(os.path.join(table_path, 'page_directory.delta')):
+            print('rewrite error: version', version, 'delta left after the directory was rewritten')
+            errors += 1
+    print('Version', version, 'page directory finished')
+shutil.rmtree(path, ignore_errors=True)
+
+print('Errors', errors)
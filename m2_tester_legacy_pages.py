@@ -0,0 +1,78 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.segment import Segment
+
+from random import randint, seed
+import os
+import shutil
+import struct
+
+# Columns written in the old layout, one directory per column holding a page_<idx>.dat file per
+# page, are converted into segment files the first time their table is loaded.
+
+path = './CS451_legacy_pages'
+number_of_records = 1500
+
+seed(3562901)
+shutil.rmtree(path, ignore_errors=True)
+
+errors = 0
+
+db = Database()
+db.open(path)
+grades_table = db.create_table('Grades', 3, 0)
+query = Query(grades_table)
+records = {}
+for key in range(number_of_records):
+    records[key] = [key, randint(0, 20), randint(0, 20)]
+    query.insert(*records[key])
+previous = {}
+for key in range(0, number_of_records, 3):
+    previous[key] = list(records[key])
+    records[key][2] = randint(0, 20)
+    query.update(key, None, None, records[key][2])
+db.close()
+
+# rewrite every segment in the old layout: num_records followed by the page image, per page file
+table_path = os.path.join(path, 'Grades')
+segment_names = sorted(name for name in os.listdir(table_path) if name.endswith('.seg'))
+for name in segment_names:
+    segment = Segment(os.path.join(table_path, name))
+    pages = segment.read_pages()
+    segment.close()
+    legacy_dir = os.path.join(table_path, name[:-len('.seg')])
+    os.makedirs(legacy_dir)
+    for page_idx, page in enumerate(pages):
+        with open(os.path.join(legacy_dir, 'page_' + str(page_idx) + '.dat'), 'wb') as f:
+            f.write(struct.pack('i', page.num_records))
+            f.write(page.data)
+    os.remove(os.path.join(table_path, name))
+
+for round in range(2):
+    db = Database()
+    db.open(path)
+    query = Query(db.get_table('Grades'))
+    for key in range(number_of_records):
+        result = query.select(key, 0, [1, 1, 1])
+        if not result or result[0].columns != records[key]:
+            print('select error on', key, ':', result[0].columns if result else result, ', correct:', records[key])
+            errors += 1
+    for key in previous:
+        result = query.select_version(key, 0, [1, 1, 1], -1)
+        if not result or result[0].columns != previous[key]:
+            print('select_version error on', key, ':', result[0].columns if result else result, ', correct:', previous[key])
+            errors += 1
+    if query.sum(0, number_of_records - 1, 2) != sum(record[2] for record in records.values()):
+        print('sum error:', query.sum(0, number_of_records - 1, 2), ', correct:', sum(record[2] for record in records.values()))
+        errors += 1
+    db.close()
+
+    converted = sorted(name for name in os.listdir(table_path) if name.endswith('.seg'))
+    left = [name for name in os.listdir(table_path) if os.path.isdir(os.path.join(table_path, name))]
+    if converted != segment_names or left:
+        print('conversion error: segments', converted, ', correct:', segment_names, ', old directories left:', left)
+        errors += 1
+print('Legacy page conversion finished')
+shutil.rmtree(path, ignore_errors=True)
+
+print('Errors', errors)
@@ -0,0 +1,142 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.page import Page
+from lstore.page_directory import PageDirectory
+from lstore.segment import Segment
+
+from random import randint, sample, seed
+import os
+import shutil
+import struct
+
+# Tables written before tail records kept the latest values in the base pages, the values each
+# update replaced in the tail pages and per record lists of their locations in version_chains.dat
+# (and its delta). They are rebuilt into base and tail records when first loaded, every version
+# still readable.
+
+path = './CS451_legacy_versions'
+number_of_records = 1500
+num_columns = 3
+
+seed(3562901)
+shutil.rmtree(path, ignore_errors=True)
+
+errors = 0
+
+db = Database()
+db.open(path)
+grades_table = db.create_table('Grades', num_columns, 0)
+query = Query(grades_table)
+versions = {}
+for key in range(number_of_records):
+    versions[key] = [[key, randint(0, 20), randint(0, 20)]]
+    query.insert(*versions[key][0])
+db.close()
+
+# every version of the updated records, oldest first
+for key in sample(sorted(versions), 400):
+    for update in range(randint(1, 4)):
+        latest = list(versions[key][-1])
+        for col in sample([1, 2], randint(1, 2)):
+            latest[col] = randint(0, 20)
+        versions[key].append(latest)
+
+table_path = os.path.join(path, 'Grades')
+pd_path = os.path.join(table_path, 'page_directory.dat')
+if os.path.exists(os.path.join(table_path, 'page_directory.delta')):
+    print('setup error: page_directory.delta left by close')
+    errors += 1
+directory = PageDirectory()
+with open(pd_path, 'rb') as f:
+    directory.load(f)
+rids = {key: rid for rid, key in zip(directory, range(number_of_records))}
+
+# rewrite the table in the old layout: latest values in the base pages, replaced values in the tail pages
+base_segments = [Segment(os.path.join(table_path, 'base_col_' + str(col) + '.seg')) for col in range(num_columns)]
+base_pages = [segment.read_pages() for segment in base_segments]
+tail_pages = [[] for col in range(num_columns)]
+chains = {}
+for key, history in versions.items():
+    page_idx, slot_idx = directory[rids[key]]
+    for col in range(num_columns):
+        base_pages[col][page_idx].update(slot_idx, history[-1][col])
+    chain = []
+    for update in range(len(history) - 1, 0, -1):
+        locations = []
+        for col in range(num_columns):
+            if history[update][col] == history[update - 1][col]:
+                locations.append(None)
+                continue
+            if not tail_pages[col] or not tail_pages[col][-1].has_capacity():
+                tail_pages[col].append(Page())
+            locations.append((len(tail_pages[col]) - 1, tail_pages[col][-1].num_records))
+            tail_pages[col][-1].write(history[update - 1][col])
+        chain.append(locations)
+    if chain:
+        chains[rids[key]] = chain
+for col in range(num_columns):
+    base_segments[col].write_pages(base_pages[col])
+    base_segments[col].close()
+    if tail_pages[col]:
+        segment = Segment(os.path.join(table_path, 'tail_col_' + str(col) + '.seg'))
+        segment.write_pages(tail_pages[col])
+        segment.close()
+
+
+def write_locations(f, locations):
+    for location in locations:
+        f.write(struct.pack('?', location is not None))
+        if location is not None:
+            f.write(struct.pack('ii', *location))
+
+
+# the version 0 directory, a location per column for every rid
+with open(pd_path, 'wb') as f:
+    f.write(struct.pack('i', len(directory)))
+    for rid in directory:
+        f.write(struct.pack('q', rid))
+        for col in range(num_columns):
+            f.write(struct.pack('ii', *directory[rid]))
+# newest update first, the latest update of some records only in the delta
+in_delta = sample(sorted(chains), 50)
+with open(os.path.join(table_path, 'version_chains.dat'), 'wb') as f:
+    f.write(struct.pack('i', len(chains)))
+    for rid, chain in chains.items():
+        stored = chain[1:] if rid in in_delta else chain
+        f.write(struct.pack('qi', rid, len(stored)))
+        for locations in stored:
+            write_locations(f, locations)
+with open(os.path.join(table_path, 'version_chains.delta'), 'wb') as f:
+    for rid in in_delta:
+        f.write(struct.pack('q', rid))
+        write_locations(f, chains[rid][0])
+
+for round in range(2):
+    db = Database()
+    db.open(path)
+    query = Query(db.get_table('Grades'))
+    for key, history in versions.items():
+        for relative_version in range(0, -6, -1):
+            correct = history[max(0, len(history) - 1 + relative_version)]
+            result = query.select_version(key, 0, [1, 1, 1], relative_version)
+            if not result or result[0].columns != correct:
+                print('select_version error on', key, 'version', relative_version, ':',
+                      result[0].columns if result else result, ', correct:', correct)
+                errors += 1
+    for relative_version in range(0, -6, -1):
+        for col in [1, 2]:
+            correct = sum(history[max(0, len(history) - 1 + relative_version)][col] for history in versions.values())
+            result = query.sum_version(0, number_of_records - 1, col, relative_version)
+            if result != correct:
+                print('sum_version error on column', col, 'version', relative_version, ':', result, ', correct:', correct)
+                errors += 1
+    db.close()
+
+    left = [name for name in os.listdir(table_path) if name.startswith('version_chains')]
+    if left:
+        print('conversion error:', left, 'left after conversion')
+        errors += 1
+print('Legacy version chain conversion finished')
+shutil.rmtree(path, ignore_errors=True)
+
+print('Errors', errors)
@@ -0,0 +1,116 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+from random import randint, seed
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+# A process that dies without closing the database loses nothing it committed: reopening replays
+# the write-ahead log on top of the last checkpoint. Transactions still running when it died, and
+# log records torn by the crash, leave nothing behind.
+
+path = './CS451_recovery'
+number_of_records = 1000
+
+seed(3562901)
+
+# what each crashing run committed, the same in every process
+records = {key: [key, randint(0, 20), randint(0, 20)] for key in range(number_of_records)}
+updates = {key: randint(0, 20) for key in range(0, number_of_records, 3)}
+deleted = list(range(1, number_of_records, 10))
+
+
+def crash(stage):
+    db = Database()
+    db.open(path)
+    if stage == 'insert':
+        grades_table = db.create_table('Grades', 3, 0)
+        query = Query(grades_table)
+        query.insert_many([records[key] for key in range(number_of_records // 2)])
+        for key in range(number_of_records // 2, number_of_records):
+            query.insert(*records[key])
+    elif stage == 'update':
+        grades_table = db.get_table('Grades')
+        query = Query(grades_table)
+        # a checkpoint in the middle, the log then only holds what came after it
+        for i, (key, value) in enumerate(updates.items()):
+            query.update(key, None, value, None)
+            if i == len(updates) // 2:
+                db.checkpoint()
+        transaction = Transaction()
+        for key in deleted:
+            transaction.add_query(query.delete, grades_table, key)
+        transaction.run()
+        # still running when the process dies
+        changed = threading.Event()
+        running = Transaction()
+        running.add_query(query.update, grades_table, 0, None, 99, 99)
+        running.add_query(query.delete, grades_table, 2)
+        running.add_query(lambda: changed.set() or True, grades_table)
+        running.add_query(threading.Event().wait, grades_table, 10)
+        threading.Thread(target=running.run, daemon=True).start()
+        changed.wait(10)
+    elif stage == 'torn':
+        query = Query(db.get_table('Grades'))
+        db.checkpoint()
+        query.update(3, None, None, 77)
+        query.update(6, None, None, 88)
+    os._exit(0)
+
+
+if sys.argv[1:2] == ['crash']:
+    crash(sys.argv[2])
+
+shutil.rmtree(path, ignore_errors=True)
+
+errors = 0
+
+
+def check(correct, stage):
+    global errors
+    db = Database()
+    db.open(path)
+    query = Query(db.get_table('Grades'))
+    wrong = 0
+    for key in range(number_of_records):
+        result = query.select(key, 0, [1, 1, 1])
+        if key not in correct:
+            if result:
+                wrong += 1
+                print('delete error on', key, 'after', stage, ':', result[0].columns)
+        elif not result or result[0].columns != correct[key]:
+            wrong += 1
+            print('select error on', key, 'after', stage, ':', result[0].columns if result else result, ', correct:', correct[key])
+    db.close()
+    return wrong
+
+
+subprocess.run([sys.executable, __file__, 'crash', 'insert'])
+errors += check(records, 'a crash after inserting')
+print('Recovery of inserts finished')
+
+subprocess.run([sys.executable, __file__, 'crash', 'update'])
+for key, value in updates.items():
+    records[key][1] = value
+for key in deleted:
+    del records[key]
+errors += check(records, 'a crash after updating')
+print('Recovery of updates and a transaction finished')
+
+# the last record in the log was torn by the crash, the ones before it are replayed
+subprocess.run([sys.executable, __file__, 'crash', 'torn'])
+wal_path = os.path.join(path, 'wal.log')
+with open(wal_path, 'rb') as f:
+    log = f.read()
+with open(wal_path, 'wb') as f:
+    f.write(log[:-5])
+records[3][2] = 77
+errors += check(records, 'a torn log record')
+print('Recovery of a torn log finished')
+shutil.rmtree(path, ignore_errors=True)
+
+print('Errors', errors)
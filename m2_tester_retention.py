@@ -0,0 +1,157 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+
+from random import randint, seed
+import shutil
+import threading
+
+# With a version_retention merges cut the version chain of every record they merge after that many
+# versions (more while a snapshot still reads older ones) and reuse the tail pages left holding only
+# versions cut off. Rows updated over and over keep a bounded number of tail pages, before and after
+# the database is reopened, and relative versions older than the ones kept read the oldest one kept.
+
+path = './CS451_retention'
+# 8 rounds fill a tail page, a merge every 32 rounds merges every page written
+number_of_keys = 64
+merge_every = 32
+retention = 3
+# tail page slots the hot rows may use: pages written since the last merge, the page with the versions
+# kept and the pages waiting for a checkpoint before they're reused
+slot_limit = 12
+
+seed(3562901)
+shutil.rmtree(path, ignore_errors=True)
+
+errors = 0
+histories = {key: [[key, 0]] for key in range(number_of_keys)}
+
+
+def update_rounds(db, table, query, num_rounds):
+    for round in range(1, num_rounds + 1):
+        for key in range(number_of_keys):
+            histories[key].append([key, randint(0, 1000)])
+            query.update(key, None, histories[key][-1][1])
+        if round % merge_every == 0:
+            table.merge()
+            db.checkpoint()
+
+
+def check_versions(query, stage, kept):
+    global errors
+    for key, history in histories.items():
+        for relative_version in range(0, -6, -1):
+            steps = min(-relative_version, kept - 1, len(history) - 1)
+            correct = history[len(history) - 1 - steps]
+            result = query.select_version(key, 0, [1, 1], relative_version)
+            if not result or result[0].columns != correct:
+                print('select_version error', stage, 'on', key, 'version', relative_version, ':',
+                      result[0].columns if result else result, ', correct:', correct)
+                errors += 1
+
+
+def check_pages(db, table, stage, limit):
+    global errors
+    tail_pages = table.tail_pages
+    if tail_pages.num_slots > limit or len(tail_pages) < 4 * limit:
+        print('retention error', stage, ':', len(tail_pages), 'tail pages stored in', tail_pages.num_slots, 'slots')
+        errors += 1
+    if db.path is not None:
+        page_counts = [db.bufferpool.get_segment(table.name, 'tail', col_idx).page_count for col_idx in range(table.total_columns)]
+        if max(page_counts) > tail_pages.num_slots:
+            print('retention error', stage, ': tail segments hold', page_counts, 'pages,', tail_pages.num_slots, 'slots used')
+            errors += 1
+    else:
+        frames = sum(1 for page_id in db.bufferpool.frames if page_id[:2] == (table.name, 'tail'))
+        if frames > tail_pages.num_slots * table.total_columns:
+            print('retention error', stage, ':', frames, 'tail frames kept for', tail_pages.num_slots, 'slots')
+            errors += 1
+
+
+db = Database(merge_threshold=None, version_retention=retention)
+db.open(path)
+hot_table = db.create_table('Hot', 2, 0)
+query = Query(hot_table)
+for key in range(number_of_keys):
+    query.insert(key, 0)
+update_rounds(db, hot_table, query, 16 * merge_every)
+check_versions(query, 'after merges', retention)
+check_pages(db, hot_table, 'after merges', slot_limit)
+if hot_table.merge_stats.tail_pages_reclaimed == 0:
+    print('retention error: no tail page reclaimed')
+    errors += 1
+db.close()
+
+# the chains stay cut and the slots of reclaimed pages are reused after reopening
+db = Database(merge_threshold=None, version_retention=retention)
+db.open(path)
+hot_table = db.get_table('Hot')
+query = Query(hot_table)
+check_versions(query, 'after reopening', retention)
+update_rounds(db, hot_table, query, 8 * merge_every)
+check_versions(query, 'after reopening and merges', retention)
+check_pages(db, hot_table, 'after reopening and merges', slot_limit)
+db.close()
+
+# reopened without a retention, the chains cut before read the same
+db = Database(merge_threshold=None)
+db.open(path)
+query = Query(db.get_table('Hot'))
+check_versions(query, 'without a retention', retention)
+db.close()
+shutil.rmtree(path, ignore_errors=True)
+print('Retention on disk finished')
+
+# in memory pages are reused right away, while a snapshot keeps every version it reads: the pages
+# it kept are reused once it ends
+db = Database(merge_threshold=None, version_retention=1)
+hot_table = db.create_table('Hot', 2, 0)
+query = Query(hot_table)
+histories = {key: [[key, 0]] for key in range(number_of_keys)}
+for key in range(number_of_keys):
+    query.insert(key, 0)
+update_rounds(db, hot_table, query, 4 * merge_every)
+
+taken = threading.Event()
+updated = threading.Event()
+seen = []
+
+
+def read_all():
+    seen.append([query.select(key, 0, [1, 1])[0].columns[1] for key in range(number_of_keys)])
+    return True
+
+
+def signal(event):
+    event.set()
+    return True
+
+
+def wait(event):
+    return event.wait(30)
+
+
+snapshot = Transaction(snapshot=True)
+snapshot.add_query(read_all, hot_table)
+snapshot.add_query(signal, hot_table, taken)
+snapshot.add_query(wait, hot_table, updated)
+snapshot.add_query(read_all, hot_table)
+reader = threading.Thread(target=snapshot.run)
+reader.start()
+taken.wait(30)
+correct = [histories[key][-1][1] for key in range(number_of_keys)]
+update_rounds(db, hot_table, query, 4 * merge_every)
+updated.set()
+reader.join()
+if seen != [correct, correct]:
+    print('snapshot error: read', [values[:4] for values in seen], '..., correct:', correct[:4], '...')
+    errors += 1
+
+update_rounds(db, hot_table, query, merge_every)
+slots_used = hot_table.tail_pages.num_slots
+update_rounds(db, hot_table, query, 16 * merge_every)
+check_versions(query, 'in memory', 1)
+check_pages(db, hot_table, 'in memory', slots_used)
+print('Retention in memory finished')
+
+print('Errors', errors)
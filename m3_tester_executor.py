@@ -0,0 +1,92 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker, configure_executor
+from concurrent.futures import ThreadPoolExecutor
+
+from time import sleep
+import threading
+
+# Workers run on a shared executor, so many workers never use more threads than it has.
+# configure_executor replaces it by one of another size for the workers started from then on,
+# and a worker given an executor of its own runs there instead.
+
+number_of_workers = 24
+
+errors = 0
+
+db = Database()
+grades_table = db.create_table('Grades', 2, 0)
+query = Query(grades_table)
+for key in range(number_of_workers):
+    query.insert(key, 0)
+
+running = 0
+most_running = 0
+counter_lock = threading.Lock()
+threads_used = set()
+
+
+def note_thread():
+    """Counts the transactions running at once and the threads they run on"""
+    global running, most_running
+    with counter_lock:
+        running += 1
+        most_running = max(most_running, running)
+        threads_used.add(threading.current_thread().name)
+    sleep(0.01)
+    with counter_lock:
+        running -= 1
+    return True
+
+
+def run_workers(num_workers, executor=None):
+    global most_running
+    most_running = 0
+    threads_used.clear()
+    workers = []
+    for key in range(num_workers):
+        transaction = Transaction()
+        transaction.add_query(note_thread, grades_table)
+        transaction.add_query(query.increment, grades_table, key, 1)
+        workers.append(TransactionWorker([transaction], executor=executor))
+    for worker in workers:
+        worker.run()
+    for worker in workers:
+        worker.join()
+    return sum(worker.result for worker in workers)
+
+
+for num_threads in [2, 5]:
+    configure_executor(num_threads)
+    committed = run_workers(number_of_workers)
+    if committed != number_of_workers:
+        print('executor error with', num_threads, 'threads:', committed, 'committed, correct:', number_of_workers)
+        errors += 1
+    if most_running > num_threads or len(threads_used) > num_threads:
+        print('executor error with', num_threads, 'threads:', most_running, 'transactions ran at once on',
+              len(threads_used), 'threads')
+        errors += 1
+    if not all(name.startswith('transaction-worker') for name in threads_used):
+        print('executor error: ran on', sorted(threads_used))
+        errors += 1
+print('Shared executor finished')
+
+# a worker's own executor is used instead of the shared one
+own = ThreadPoolExecutor(max_workers=1, thread_name_prefix='own-executor')
+committed = run_workers(4, own)
+own.shutdown()
+if committed != 4 or most_running != 1 or [name.startswith('own-executor') for name in threads_used] != [True]:
+    print('executor error with a worker executor:', committed, 'committed,', most_running, 'at once on', sorted(threads_used))
+    errors += 1
+print('Worker executor finished')
+
+# every increment was counted once
+for key in range(number_of_workers):
+    correct = 2 + (key < 4)
+    result = query.select(key, 0, [1, 1])[0].columns[1]
+    if result != correct:
+        print('increment error on', key, ':', result, ', correct:', correct)
+        errors += 1
+
+print('Errors', errors)
@@ -0,0 +1,170 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction, OPTIMISTIC
+from lstore.transaction_worker import TransactionWorker
+from lstore.lock_manager import NO_WAIT, WAIT_DIE, TIMEOUT
+
+from random import randrange, sample, seed
+from time import sleep
+import threading
+
+# Transactions aborted by a refused lock or a failed validation are retried by their worker
+# until they commit, the other aborts aren't. Every policy must count each increment exactly once.
+
+number_of_records = 5
+number_of_transactions = 800
+num_threads = 8
+
+seed(3562901)
+
+errors = 0
+
+
+def signal(event):
+    event.set()
+    return True
+
+
+def wait(event):
+    return event.wait(10)
+
+
+def hold(event, seconds):
+    event.wait(10)
+    sleep(seconds)
+    return True
+
+
+def leftover_locks(db):
+    return sum(len(shard.locks) for shard in db.lock_manager.shards)
+
+
+for policy in [NO_WAIT, WAIT_DIE, TIMEOUT]:
+    db = Database(lock_policy=policy, lock_timeout=0.05)
+    counters_table = db.create_table('Counters', 3, 0)
+    query = Query(counters_table)
+    for key in range(number_of_records):
+        query.insert(key, 0, 0)
+
+    transaction_workers = [TransactionWorker(max_retries=1000) for i in range(num_threads)]
+    for i in range(number_of_transactions):
+        transaction = Transaction()
+        key = randrange(number_of_records)
+        transaction.add_query(query.select, counters_table, key, 0, [1, 1, 1])
+        transaction.add_query(query.increment, counters_table, key, 1)
+        transaction_workers[i % num_threads].add_transaction(transaction)
+    for i in range(num_threads):
+        transaction_workers[i].run()
+    for i in range(num_threads):
+        transaction_workers[i].join()
+
+    committed = sum(worker.result for worker in transaction_workers)
+    total = query.sum(0, number_of_records - 1, 1)
+    retries = sum(stats.retries for worker in transaction_workers for stats in worker.stats)
+    rates = [worker.validation_failure_rate() for worker in transaction_workers]
+    if committed != number_of_transactions or total != number_of_transactions:
+        print('increment error (' + policy + '):', committed, 'committed, total', total, ', correct:', number_of_transactions)
+        errors += 1
+    if rates != [0.0] * num_threads:
+        print('validation error (' + policy + '): locking transactions have validation failure rates', rates)
+        errors += 1
+
+    # a transaction refused a lock another one holds is retried until it's released
+    locked = threading.Event()
+    started = threading.Event()
+    holder = Transaction()
+    holder.add_query(query.update, counters_table, 0, None, 100, None)
+    holder.add_query(signal, counters_table, locked)
+    holder.add_query(hold, counters_table, started, 0.2)
+    holder_thread = threading.Thread(target=holder.run)
+    holder_thread.start()
+    transaction = Transaction()
+    transaction.add_query(wait, counters_table, locked)
+    transaction.add_query(signal, counters_table, started)
+    transaction.add_query(query.increment, counters_table, 0, 1)
+    transaction_worker = TransactionWorker([transaction])
+    transaction_worker.run()
+    transaction_worker.join()
+    holder_thread.join()
+    stats = transaction_worker.stats[0]
+    if not stats.committed or stats.retries < 1 or query.select(0, 0, [1, 1, 1])[0].columns[1] != 101:
+        print('retry error (' + policy + '): committed', stats.committed, 'after', stats.retries, 'retries, value',
+              query.select(0, 0, [1, 1, 1])[0].columns[1], ', correct: 101')
+        errors += 1
+    if leftover_locks(db):
+        print('lock error (' + policy + '):', leftover_locks(db), 'locks left')
+        errors += 1
+    print('Retries with', policy, ':', retries, 'over', number_of_transactions, 'transactions, blocked transaction retried', stats.retries, 'times')
+    db.close()
+
+
+# optimistic transactions validate their reads at commit and are retried when another commit changed them
+db = Database()
+counters_table = db.create_table('Counters', 3, 0)
+query = Query(counters_table)
+number_of_records = 20
+for key in range(number_of_records):
+    query.insert(key, 0, 0)
+
+transaction_workers = [TransactionWorker(max_retries=1000, mode=OPTIMISTIC) for i in range(num_threads)]
+for i in range(number_of_transactions):
+    transaction = Transaction()
+    first, second = sample(range(number_of_records), 2)
+    transaction.add_query(query.increment, counters_table, first, 1)
+    transaction.add_query(query.increment, counters_table, second, 1)
+    transaction.add_query(query.increment, counters_table, first, 1)
+    transaction_workers[i % num_threads].add_transaction(transaction)
+for i in range(num_threads):
+    transaction_workers[i].run()
+for i in range(num_threads):
+    transaction_workers[i].join()
+
+committed = sum(worker.result for worker in transaction_workers)
+total = query.sum(0, number_of_records - 1, 1)
+retries = sum(stats.retries for worker in transaction_workers for stats in worker.stats)
+validations = sum(stats.validations for worker in transaction_workers for stats in worker.stats)
+failures = sum(stats.validation_failures for worker in transaction_workers for stats in worker.stats)
+rates = [worker.validation_failure_rate() for worker in transaction_workers]
+if committed != number_of_transactions or total != 3 * number_of_transactions:
+    print('increment error (optimistic):', committed, 'committed, total', total, ', correct:', 3 * number_of_transactions)
+    errors += 1
+if validations < number_of_transactions or failures > retries or any(rate < 0.0 or rate > 1.0 for rate in rates):
+    print('validation error (optimistic):', validations, 'validations,', failures, 'failed,', retries, 'retries, rates', rates)
+    errors += 1
+print('Retries with optimistic :', retries, 'over', number_of_transactions, 'transactions, validation failure rate',
+      round(failures / validations, 3) if validations else 0.0)
+
+# a read changed by a commit before validation fails it, the retry reads the new value and commits
+changed = []
+
+
+def change_read():
+    if not changed:
+        # committed by another thread while the transaction is running
+        writer = threading.Thread(target=query.update, args=(0, None, 7, None))
+        writer.start()
+        writer.join()
+        changed.append(True)
+    return True
+
+
+transaction = Transaction()
+transaction.add_query(query.increment, counters_table, 0, 1)
+transaction.add_query(change_read, counters_table)
+transaction_worker = TransactionWorker([transaction], mode=OPTIMISTIC)
+transaction_worker.run()
+transaction_worker.join()
+stats = transaction_worker.stats[0]
+value = query.select(0, 0, [1, 1, 1])[0].columns[1]
+if (not stats.committed or stats.retries != 1 or stats.validations != 2 or stats.validation_failures != 1
+        or transaction_worker.validation_failure_rate() != 0.5 or value != 8):
+    print('validation error: committed', stats.committed, 'after', stats.retries, 'retries,', stats.validation_failures, '/',
+          stats.validations, 'validations failed, value', value, ', correct: 1 retry, 1 / 2 failed, value 8')
+    errors += 1
+if leftover_locks(db):
+    print('lock error (optimistic):', leftover_locks(db), 'locks left')
+    errors += 1
+print('Validation failure finished')
+db.close()
+
+print('Errors', errors)
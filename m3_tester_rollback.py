@@ -0,0 +1,160 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+
+from lstore.lock_manager import NO_WAIT, TIMEOUT
+
+from random import sample, seed
+import threading
+
+# Transactions that abort after a merge ran in the middle of them must still roll back completely:
+# the merge has copied their updates into the merged base pages, or skipped records they deleted.
+
+number_of_records = 600
+number_of_transactions = 1000
+num_threads = 4
+
+seed(3562901)
+
+errors = 0
+
+db = Database()
+grades_table = db.create_table('Grades', 3, 0)
+query = Query(grades_table)
+for key in range(number_of_records):
+    query.insert(key, 1, 0)
+grades_table.index.create_index(1)
+query.update(0, None, 1000, None)
+# fill a tail page, so the merge has something to merge
+for i in range(600):
+    query.update(5, None, 1, i)
+
+
+def merge():
+    grades_table.merge()
+    return True
+
+
+def check(key, correct):
+    global errors
+    result = query.select(key, 0, [1, 1, 1])
+    if not result or result[0].columns != correct:
+        print('select error on', key, ':', result[0].columns if result else None, ', correct:', correct)
+        errors += 1
+
+
+# an aborted delete brings the record back as it was
+transaction = Transaction()
+transaction.add_query(query.delete, grades_table, 0)
+transaction.add_query(merge, grades_table)
+transaction.add_query(query.update, grades_table, -1, None, 0, None)
+if transaction.run():
+    print('transaction with a failing query committed')
+    errors += 1
+check(0, [0, 1000, 0])
+if [record.columns for record in query.select(1000, 1, [1, 1, 1])] != [[0, 1000, 0]]:
+    print('index select error on 1000 :', [record.columns for record in query.select(1000, 1, [1, 1, 1])])
+    errors += 1
+if query.sum(0, 0, 1) != 1000:
+    print('sum error on 0 :', query.sum(0, 0, 1), ', correct:', 1000)
+    errors += 1
+
+# an aborted update brings back the previous version
+transaction = Transaction()
+transaction.add_query(query.update, grades_table, 5, None, 77, None)
+transaction.add_query(query.update, grades_table, 6, None, 66, 6)
+transaction.add_query(merge, grades_table)
+transaction.add_query(query.update, grades_table, -1, None, 0, None)
+transaction.run()
+check(5, [5, 1, 599])
+check(6, [6, 1, 0])
+if [record.columns for record in query.select(77, 1, [1, 1, 1])]:
+    print('index select error on 77 :', [record.columns for record in query.select(77, 1, [1, 1, 1])])
+    errors += 1
+print('Rollback after merge finished')
+
+
+# increments that commit or abort while other transactions merge, nothing of the aborted ones stays
+transaction_workers = [TransactionWorker(max_retries=1000) for i in range(num_threads)]
+aborting = 0
+for i in range(number_of_transactions):
+    transaction = Transaction()
+    first, second = sample(range(1, number_of_records), 2)
+    transaction.add_query(query.increment, grades_table, first, 2)
+    if i % 10 == 0:
+        transaction.add_query(merge, grades_table)
+    transaction.add_query(query.increment, grades_table, second, 2)
+    if i % 7 == 0:
+        transaction.add_query(query.update, grades_table, -1, None, 0, None)
+        aborting += 1
+    transaction_workers[i % num_threads].add_transaction(transaction)
+
+before = query.sum(0, number_of_records - 1, 2)
+for i in range(num_threads):
+    transaction_workers[i].run()
+for i in range(num_threads):
+    transaction_workers[i].join()
+
+committed = sum(worker.result for worker in transaction_workers)
+if committed != number_of_transactions - aborting:
+    print('commit error:', committed, 'committed, correct:', number_of_transactions - aborting)
+    errors += 1
+after = query.sum(0, number_of_records - 1, 2)
+if after - before != 2 * committed:
+    print('sum error:', after - before, ', correct:', 2 * committed)
+    errors += 1
+print('Rollback with concurrent merges finished')
+db.close()
+
+
+# A write outside a transaction locks the record like a transaction would: it never changes a record
+# a running transaction has locked, so that transaction's abort can't wipe it out. Without waiting
+# it fails at once, with a timeout it waits for the abort and then goes through.
+def signal(event):
+    event.set()
+    return True
+
+
+def wait(event):
+    return event.wait(10)
+
+
+for policy, correct_result, correct_value in [(NO_WAIT, False, 10), (TIMEOUT, True, 99)]:
+    db = Database(lock_policy=policy, lock_timeout=5)
+    grades_table = db.create_table('Grades', 2, 0)
+    query = Query(grades_table)
+    query.insert(1, 10)
+    updated = threading.Event()
+    written = threading.Event()
+    results = []
+
+    def write():
+        wait(updated)
+        if policy == TIMEOUT:
+            # the write is waiting for the lock by the time the transaction aborts
+            threading.Timer(0.2, written.set).start()
+            results.append(query.update(1, None, 99))
+        else:
+            results.append(query.update(1, None, 99))
+            written.set()
+
+    transaction = Transaction()
+    transaction.add_query(query.update, grades_table, 1, None, 20)
+    transaction.add_query(signal, grades_table, updated)
+    transaction.add_query(wait, grades_table, written)
+    transaction.add_query(query.update, grades_table, -1, None, 0)
+    writer = threading.Thread(target=write)
+    writer.start()
+    transaction.run()
+    writer.join()
+
+    value = query.select(1, 0, [1, 1])[0].columns[1]
+    if results != [correct_result] or value != correct_value:
+        print('write during transaction error (' + policy + '): update returned', results, ', value', value,
+              ', correct:', [correct_result], ', value', correct_value)
+        errors += 1
+    db.close()
+print('Write during a transaction finished')
+
+print('Errors', errors)
@@ -0,0 +1,258 @@
+from lstore.db import Database
+from lstore.query import Query
+from lstore.transaction import Transaction
+from lstore.transaction_worker import TransactionWorker
+from lstore.lock_manager import NO_WAIT, WAIT_DIE, TIMEOUT
+
+from random import randint, sample, seed
+import threading
+
+# Transfers move money between accounts while snapshot transactions sum every balance.
+# The total never changes, so a snapshot that doesn't see all or none of a transfer sums wrong.
+
+number_of_accounts = 200
+balance = 100
+number_of_transactions = 2000
+num_threads = 4
+num_readers = 2
+
+seed(3562901)
+
+errors = 0
+
+for policy in [NO_WAIT, WAIT_DIE, TIMEOUT]:
+    db = Database(lock_policy=policy, lock_timeout=0.05)
+    accounts_table = db.create_table('Accounts', 3, 0)
+    query = Query(accounts_table)
+    # the third column is the branch an account belongs to
+    for key in range(number_of_accounts):
+        query.insert(key, balance, key % 7)
+    accounts_table.index.create_index(2)
+    total = number_of_accounts * balance
+
+    def transfer(source, target, amount):
+        source_record = query.select(source, 0, [1, 1, 1])
+        target_record = query.select(target, 0, [1, 1, 1])
+        if not source_record or not target_record:
+            return False
+        if not query.update(source, None, source_record[0].columns[1] - amount, None):
+            return False
+        return query.update(target, None, target_record[0].columns[1] + amount, None)
+
+    transaction_workers = [TransactionWorker(max_retries=1000) for i in range(num_threads)]
+    for i in range(number_of_transactions):
+        transaction = Transaction()
+        source, target = sample(range(number_of_accounts), 2)
+        transaction.add_query(transfer, accounts_table, source, target, randint(1, 20))
+        if i % 20 == 0:
+            # fails after the transfer, so the transaction aborts and its updates are rolled back
+            transaction.add_query(query.update, accounts_table, -1, None, 0, None)
+        transaction_workers[i % num_threads].add_transaction(transaction)
+
+    done = threading.Event()
+    checks = [0] * num_readers
+    wrong = [0] * num_readers
+
+    def read_snapshots(reader):
+        while not done.is_set():
+            sums = []
+
+            def sum_balances():
+                sums.append(query.sum(0, number_of_accounts - 1, 1))
+                sums.append(sum(record.columns[1] for branch in range(7) for record in query.select(branch, 2, [1, 1, 1])))
+                return True
+
+            snapshot = Transaction(snapshot=True)
+            snapshot.add_query(sum_balances, accounts_table)
+            snapshot.run()
+            checks[reader] += 1
+            if sums != [total, total]:
+                wrong[reader] += 1
+                print('snapshot error (' + policy + '):', sums, ', correct:', total)
+
+    readers = [threading.Thread(target=read_snapshots, args=(reader,)) for reader in range(num_readers)]
+    for reader in readers:
+        reader.start()
+    for i in range(num_threads):
+        transaction_workers[i].run()
+    for i in range(num_threads):
+        transaction_workers[i].join()
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    committed = sum(worker.result for worker in transaction_workers)
+    final = query.sum(0, number_of_accounts - 1, 1)
+    if final != total:
+        print('sum error (' + policy + '):', final, ', correct:', total)
+        errors += 1
+    errors += sum(wrong)
+    print('Snapshots with', policy, ':', sum(checks), 'checked,', sum(wrong), 'wrong,', committed, '/', number_of_transactions, 'transfers committed')
+    db.close()
+
+
+# A snapshot taken while one transaction has committed and another is still running
+# sees all of the first and nothing of the second.
+db = Database()
+accounts_table = db.create_table('Accounts', 2, 0)
+query = Query(accounts_table)
+for key in range(3):
+    query.insert(key, 100)
+
+first_updated = threading.Event()
+second_updated = threading.Event()
+snapshot_taken = threading.Event()
+
+
+def signal(event):
+    event.set()
+    return True
+
+
+def wait(event):
+    return event.wait(10)
+
+
+first = Transaction()
+first.add_query(query.update, accounts_table, 0, None, 50)
+first.add_query(signal, accounts_table, first_updated)
+first.add_query(wait, accounts_table, second_updated)
+first.add_query(query.update, accounts_table, 1, None, 150)
+second = Transaction()
+second.add_query(wait, accounts_table, first_updated)
+second.add_query(query.update, accounts_table, 2, None, 1)
+second.add_query(signal, accounts_table, second_updated)
+second.add_query(wait, accounts_table, snapshot_taken)
+
+first_thread = threading.Thread(target=first.run)
+second_thread = threading.Thread(target=second.run)
+first_thread.start()
+second_thread.start()
+first_thread.join()
+
+sums = []
+snapshot = Transaction(snapshot=True)
+snapshot.add_query(lambda: sums.append((query.sum(0, 1, 1), query.sum(2, 2, 1))) or True, accounts_table)
+snapshot.run()
+snapshot_taken.set()
+second_thread.join()
+
+if sums != [(200, 100)]:
+    print('snapshot error between commits:', sums, ', correct:', [(200, 100)])
+    errors += 1
+print('Snapshot between commits finished')
+db.close()
+
+
+# Versions written after a snapshot began, committed or still running, are skipped however many
+# there are.
+db = Database()
+accounts_table = db.create_table('Accounts', 2, 0)
+query = Query(accounts_table)
+for key in range(10):
+    query.insert(key, 1)
+
+snapshot_started = threading.Event()
+updated = threading.Event()
+summed = threading.Event()
+
+
+def update_all(value):
+    return all(query.update(key, None, value) for key in range(10))
+
+
+def write():
+    wait(snapshot_started)
+    for value in [100, 200, 300]:
+        update_all(value)
+    writer = Transaction()
+    writer.add_query(update_all, accounts_table, 1000)
+    writer.add_query(signal, accounts_table, updated)
+    writer.add_query(wait, accounts_table, summed)
+    writer.run()
+
+
+sums = []
+snapshot = Transaction(snapshot=True)
+snapshot.add_query(signal, accounts_table, snapshot_started)
+snapshot.add_query(wait, accounts_table, updated)
+snapshot.add_query(lambda: sums.append(query.sum(0, 9, 1)) or True, accounts_table)
+snapshot.add_query(signal, accounts_table, summed)
+writer_thread = threading.Thread(target=write)
+writer_thread.start()
+snapshot.run()
+writer_thread.join()
+
+if sums != [10]:
+    print('snapshot error after newer versions:', sums, ', correct:', [10])
+    errors += 1
+if query.sum(0, 9, 1) != 10000:
+    print('sum error after newer versions:', query.sum(0, 9, 1), ', correct:', 10000)
+    errors += 1
+db.close()
+print('Snapshot after newer versions finished')
+
+
+# Reads don't take the table latch: point reads finish while a writer holds it (range reads wait
+# for B+ tree lookups only), and reads beside writers see every update whole.
+db = Database()
+pairs_table = db.create_table('Pairs', 3, 0)
+query = Query(pairs_table)
+for key in range(100):
+    query.insert(key, 0, 0)
+
+reads = []
+def read_all():
+    snapshot = Transaction(snapshot=True)
+    snapshot.add_query(lambda: reads.append(query.select(7, 0, [1, 1, 1])[0].columns) or True, pairs_table)
+    reads.append(query.select(5, 0, [1, 1, 1])[0].columns)
+    reads.append(query.select_version(5, 0, [1, 1, 1], -1)[0].columns)
+    reads.append(snapshot.run())
+with pairs_table.latch:
+    reader_thread = threading.Thread(target=read_all)
+    reader_thread.start()
+    reader_thread.join(5)
+    blocked = reader_thread.is_alive()
+reader_thread.join()
+if blocked or reads != [[5, 0, 0], [5, 0, 0], [7, 0, 0], True]:
+    print('read error while the latch is held: blocked', blocked, ',', reads)
+    errors += 1
+
+# both columns of a pair are always updated together
+stop = threading.Event()
+def write_pairs():
+    value = 0
+    while not stop.is_set():
+        value += 1
+        for key in range(100):
+            query.update(key, None, value, value)
+
+torn = []
+def read_pairs():
+    for round in range(20):
+        for key in range(100):
+            columns = query.select(key, 0, [1, 1, 1])[0].columns
+            if columns[1] != columns[2]:
+                torn.append(columns)
+        snapshot_sums = []
+        snapshot = Transaction(snapshot=True)
+        snapshot.add_query(lambda: snapshot_sums.append((query.sum(0, 99, 1), query.sum(0, 99, 2))) or True, pairs_table)
+        snapshot.run()
+        if snapshot_sums[0][0] != snapshot_sums[0][1]:
+            torn.append(snapshot_sums[0])
+writer_thread = threading.Thread(target=write_pairs)
+writer_thread.start()
+reader_threads = [threading.Thread(target=read_pairs) for i in range(2)]
+for thread in reader_threads:
+    thread.start()
+for thread in reader_threads:
+    thread.join()
+stop.set()
+writer_thread.join()
+if torn:
+    print('read error beside writers:', len(torn), 'reads saw half an update, e.g.', torn[0])
+    errors += 1
+db.close()
+print('Reads beside writers finished')
+
+print('Errors', errors)